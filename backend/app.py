@@ -1,16 +1,28 @@
-from flask import Flask, request, jsonify, render_template, session, send_from_directory, redirect
+from flask import Flask, request, jsonify, render_template, session, send_from_directory, redirect, Response, stream_with_context, send_file
 import json
 import logging
+import os
 import datetime
 import functools
+import hmac
 from flask_caching import Cache
 from functools import wraps
 from config import ADMIN_PASSWORD 
 import database
 import services
-from collections import Counter
-from config import FLASK_SECRET_KEY
-from utils import get_indian_state_from_gps, get_district_from_gps
+from config import FLASK_SECRET_KEY, CHAT_MAX_MESSAGE_CHARS, MAX_IMAGES_PER_REQUEST, METRICS_TOKEN
+import conversation_store
+import intent_parser
+import report_export
+import report_sync
+import batch_pipeline
+import inference
+import shared_data
+import refresh_scheduler
+import swr_cache
+import metrics
+import profiling
+from utils import locate_from_gps
 from flask_cors import CORS
 
 app = Flask(__name__)
@@ -31,6 +43,8 @@ app.config['SESSION_COOKIE_SECURE'] = True
 config = {"CACHE_TYPE": "SimpleCache", "CACHE_DEFAULT_TIMEOUT": 3600}
 app.config.from_mapping(config)
 cache = Cache(app)
+metrics.init_app(app)
+profiling.init_app(app)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
@@ -128,22 +142,34 @@ def analyze_crop():
     
     # The detailed_advice is now part of the result from the service
     if not analysis_result.get("is_healthy"):
-        disease_name = analysis_result.get('prediction')
-        ai_prompt = (
-            f"You are an expert agronomist creating a concise guide for an Indian farmer whose crop has **{disease_name}**."
-            f"Follow these rules STRICTLY:\n"
-            f"1. The ENTIRE response MUST be under 350 words.\n"
-            f"2. Use simple, direct language. Avoid jargon.\n"
-            f"3. Focus ONLY on the most critical, actionable steps for treatment and prevention.\n"
-            f"4. Structure the output using this exact format: **Description:** ... ## **Symptoms:** ... ## **Treatment:** ... ## **Prevention:** ...\n"
-            f"5. Under Treatment and Prevention, use a simple numbered list (e.g., 1., 2., 3.) for the key actions."
-        )
+        ai_prompt = services.disease_advice_prompt(analysis_result.get('prediction'))
         analysis_result['detailed_advice'] = services.get_gemini_report_advice(ai_prompt)
     else:
         analysis_result['detailed_advice'] = "The plant appears healthy. Continue standard monitoring."
         
     return jsonify({"success": True, "result": analysis_result})
 
+@app.route('/api/analyze_crop_batch', methods=['POST'])
+@login_required
+def analyze_crop_batch():
+    """
+    Several leaf images per request, as 'images' files. An optional 'plot_ids' field per image
+    groups them into plots; without it every image belongs to one plot.
+    """
+    image_files = [image for image in request.files.getlist('images') if image.filename]
+    if not image_files: return jsonify({"success": False, "error": "No images provided."}), 400
+    if len(image_files) > MAX_IMAGES_PER_REQUEST:
+        return jsonify({"success": False, "error": f"At most {MAX_IMAGES_PER_REQUEST} images can be analyzed at once."}), 413
+
+    plot_ids = request.form.getlist('plot_ids')
+    if plot_ids and len(plot_ids) != len(image_files):
+        return jsonify({"success": False, "error": "Provide one plot ID per image."}), 400
+    plots = {}
+    for plot_id, image in zip(plot_ids or ['plot_1'] * len(image_files), image_files):
+        plots.setdefault(plot_id, []).append(image.read())
+
+    return jsonify({"success": True, "result": services.analyze_crop_images(plots)})
+
 @app.route('/api/analyze_field', methods=['POST'])
 @login_required
 def analyze_field():
@@ -159,61 +185,68 @@ def analyze_field():
     if "error" in soil_analysis: return jsonify({"success": False, "error": soil_analysis["error"]}), 500
     
     lang = request.form.get('lang', 'en')
-    state = get_indian_state_from_gps(latitude, longitude)
+    district, state = locate_from_gps(latitude, longitude)
     weather = services.get_weather_data(latitude, longitude)
     historical_weather = services.get_historical_weather_summary(latitude, longitude, lang=lang) 
     
     recommendation_data = services.get_crop_recommendations(state, soil_analysis, weather, historical_weather, request.form.get('lastCrop', ''), lang=lang)
 
-    full_report = {
-        "location": {"latitude": latitude, "longitude": longitude, "state": state, "district": get_district_from_gps(latitude, longitude)}, 
-        "weather": weather,
-        "historical_weather": historical_weather, 
-        "soil_analysis": soil_analysis,
-        "recommendations": recommendation_data,
-        "generated_at": datetime.datetime.now().isoformat(),
-        "lang": lang
-    }
-    
-    recommended_crops_list = recommendation_data.get("recommended_crops", [])
-
-    if lang == 'hi':
-        ai_prompt = (
-            f"आप एक विशेषज्ञ कृषि सलाहकार हैं। {state} में {soil_analysis.get('prediction')} मिट्टी वाले किसान को यह उगाने की सलाह दी गई है: {', '.join(recommended_crops_list)}। "
-            f"एक 2-बिंदु वाली कार्य योजना बनाएं। कोई भी परिचयात्मक या संवादात्मक पाठ न लिखें। "
-            f"प्रत्येक बिंदु का एक शीर्षक और एक विवरण होना चाहिए। "
-            f"आउटपुट को सख्ती से इस प्रकार प्रारूपित करें: **शीर्षक 1:** विवरण 1 ## **शीर्षक 2:** विवरण 2"
-        )
-    else:
-        ai_prompt = (
-            f"You are an expert farming advisor. A farmer in {state} with {soil_analysis.get('prediction')} soil "
-            f"has been recommended to grow: {', '.join(recommended_crops_list)}. "
-            f"Generate a 2-point action plan. DO NOT write any introductory or conversational text. "
-            f"Each point must have a title and a description. "
-            f"Format the output strictly as follows: **Title 1:** Description 1 ## **Title 2:** Description 2"
-        )
-
+    full_report = services.field_report(latitude, longitude, state, district, weather, historical_weather, soil_analysis, recommendation_data, lang)
+    ai_prompt = services.field_advice_prompt(state, soil_analysis.get('prediction'), recommendation_data.get("recommended_crops", []), lang)
     full_report['ai_advice'] = services.get_gemini_report_advice(ai_prompt)
     
     return jsonify(full_report)
 
+@app.route('/api/batch/analyze', methods=['POST'])
+@login_required
+def start_batch_analysis():
+    """
+    Accepts a JSON body {"plots": [...], "lang": ...} or a multipart upload with a 'plots' CSV
+    and optional 'images' files named after their plot_id.
+    """
+    try:
+        if request.files.get('plots'):
+            rows = batch_pipeline.read_csv_plots(request.files['plots'].read())
+            images = {os.path.splitext(image.filename)[0]: image.read() for image in request.files.getlist('images') if image.filename}
+            lang = request.form.get('lang', 'en')
+        else:
+            data = request.get_json(silent=True) or {}
+            rows, images, lang = data.get('plots'), {}, data.get('lang', 'en')
+        job = batch_pipeline.start_job(session['user_id'], rows, images=images, lang=lang)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, "job": job}), 202
+
+@app.route('/api/batch/<job_id>')
+@login_required
+def get_batch_status(job_id):
+    job = batch_pipeline.get_job(session['user_id'], job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Batch job not found."}), 404
+    return jsonify({"success": True, "job": job})
+
+@app.route('/api/batch/<job_id>/download')
+@login_required
+def download_batch_results(job_id):
+    job = batch_pipeline.get_job(session['user_id'], job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Batch job not found."}), 404
+    if job['status'] != 'done':
+        return jsonify({"success": False, "error": f"Batch job is {job['status']}.", "job": job}), 409
+    return send_file(batch_pipeline.result_path(job_id), mimetype='text/csv', as_attachment=True, download_name=f"kisan_drishti_batch_{job_id}.csv")
+
 @app.route('/api/get_fertilizer_plan/<int:report_id>')
 @login_required
 def get_fertilizer_plan(report_id):
     user_id = session['user_id']
-    report_record = database.get_report_by_id(user_id, report_id)
+    report_record = database.get_report_summary_by_id(user_id, report_id)
     
     if not report_record:
         return jsonify({"success": False, "error": "Report not found or you do not have permission to view it."}), 404
         
     try:
-        report_data = report_record['report_data']
-        if isinstance(report_data, str):
-            report_data = json.loads(report_data)
-        lang = report_data.get('lang', 'en') 
-        top_crop = report_data.get("recommendations", {}).get("recommended_crops", [None])[0]
-        state = report_data.get("location", {}).get("state")
-        soil_type = report_data.get("soil_analysis", {}).get("prediction")
+        lang = report_record['lang'] or 'en'
+        top_crop, state, soil_type = report_record['top_crop'], report_record['state'], report_record['soil_type']
 
         if not all([top_crop, state, soil_type]):
             return jsonify({"success": False, "error": "Report is missing crop, state, or soil data."}), 400
@@ -229,6 +262,28 @@ def get_fertilizer_plan(report_id):
         logger.error(f"Error generating fertilizer plan: {e}", exc_info=True)
         return jsonify({"success": False, "error": "An internal error occurred."}), 500
 
+@app.route('/api/get_fertilizer_plans/<int:report_id>')
+@login_required
+def get_fertilizer_plans(report_id):
+    """Plans for every recommended crop of a report. Pass ?advice=true to include AI application advice."""
+    user_id = session['user_id']
+    report_record = database.get_report_summary_by_id(user_id, report_id)
+    
+    if not report_record:
+        return jsonify({"success": False, "error": "Report not found or you do not have permission to view it."}), 404
+
+    try:
+        include_advice = request.args.get('advice', 'false').lower() == 'true'
+        plans = services.get_fertilizer_plans_for_report(report_record, lang=request.args.get('lang'), include_advice=include_advice)
+
+        if plans is None:
+            return jsonify({"success": False, "error": "Report is missing crop, state, or soil data."}), 400
+        return jsonify({"success": True, "plans": plans})
+
+    except Exception as e:
+        logger.error(f"Error generating fertilizer plans: {e}", exc_info=True)
+        return jsonify({"success": False, "error": "An internal error occurred."}), 500
+
 @app.route('/api/locations')
 def get_locations():
     return send_from_directory('data', 'state_districts.json')
@@ -243,6 +298,19 @@ def get_prices():
     else:
         return jsonify({"success": True, "result": price_result})
 
+@app.route('/api/price_matrix', methods=['POST'])
+@login_required
+def get_price_matrix():
+    data = request.get_json(silent=True) or {}
+    try:
+        area = float(data.get('area', 1))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "Invalid area."}), 400
+    result = services.get_price_matrix(data.get('state'), crop=data.get('crop'), district=data.get('district'), area=area)
+    if "error" in result:
+        return jsonify({"success": False, "error": result["error"]}), 404
+    return jsonify({"success": True, "result": result})
+
 @app.route('/api/save_report', methods=['POST'])
 @login_required
 def save_report():
@@ -251,6 +319,13 @@ def save_report():
     res, code = database.save_report_to_db(session['user_id'], loc.get('latitude'), loc.get('longitude'), json.dumps(data))
     return jsonify(res), code
 
+@app.route('/api/reports/bulk', methods=['POST'])
+@login_required
+def sync_reports():
+    data = request.get_json(silent=True) or {}
+    res, code = report_sync.sync_reports(session['user_id'], data.get('reports'))
+    return jsonify(res), code
+
 @app.route('/api/reports', methods=['GET'])
 @login_required
 def get_reports():
@@ -261,6 +336,19 @@ def get_reports():
                 report['saved_at'] = report['saved_at'].isoformat()
     return jsonify(res), code
 
+@app.route('/api/reports/export', methods=['GET'])
+@login_required
+def export_reports():
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in report_export.FORMATS:
+        return jsonify({"success": False, "error": f"Unsupported export format. Use one of: {', '.join(report_export.FORMATS)}."}), 400
+    filename = f"kisan_drishti_reports_{datetime.date.today().isoformat()}.{export_format}"
+    return Response(
+        stream_with_context(report_export.stream_reports(session['user_id'], export_format)),
+        mimetype=report_export.FORMATS[export_format],
+        headers={"Content-Disposition": f"attachment; filename={filename}", "X-Accel-Buffering": "no"},
+    )
+
 @app.route('/api/reports/<int:report_id>', methods=['DELETE'])
 @login_required
 def delete_report(report_id):
@@ -281,6 +369,16 @@ def delete_account():
     if res.get("success"): session.clear()
     return jsonify(res), code
 
+CHAT_WELCOME_MESSAGE = {
+    "type": "options",
+    "content": "Hello! I am Drishti, your farming expert. How can I help you today?",
+    "options": [
+        {"label": "Get Mandi Price", "payload": {"message": "I'd like to check a mandi price."}},
+        {"label": "Create a Fertilizer Plan", "payload": {"message": "Help me create a fertilizer plan"}},
+        {"label": "See My Latest Report", "payload": {"message": "Show me a summary of my last report"}},
+    ]
+}
+
 @app.route('/api/chat_with_drishti', methods=['POST'])
 @login_required
 def chat_with_drishti():
@@ -288,26 +386,24 @@ def chat_with_drishti():
     user_id = session['user_id']
     
     if data.get("event") == "init_chat":
-        welcome_message = {
-            "type": "options",
-            "content": "Hello! I am Drishti, your farming expert. How can I help you today?",
-            "options": [
-                {"label": "Get Mandi Price", "payload": {"message": "I'd like to check a mandi price."}},
-                {"label": "Create a Fertilizer Plan", "payload": {"message": "Help me create a fertilizer plan"}},
-                {"label": "See My Latest Report", "payload": {"message": "Show me a summary of my last report"}},
-            ]
-        }
-        return jsonify({"success": True, "reply": welcome_message, "history": []})
+        # Each chat window starts a fresh server-side conversation.
+        conversation_store.reset(user_id, session.get('chat_session_key'))
+        session['chat_session_key'] = conversation_store.new_session_key()
+        return jsonify({"success": True, "reply": CHAT_WELCOME_MESSAGE})
 
     user_message = data.get('message')
-    history = data.get('history', [])
     if not user_message:
         return jsonify({"success": False, "error": "No message provided."}), 400
+    if len(user_message) > CHAT_MAX_MESSAGE_CHARS:
+        return jsonify({"success": False, "error": f"Message is too long (max {CHAT_MAX_MESSAGE_CHARS} characters)."}), 413
 
-    # This now calls the single, correct function and gets the full history back
-    reply, new_history = services.get_drishti_response(user_message, user_id, conversation_history=history)
+    if 'chat_session_key' not in session:
+        session['chat_session_key'] = conversation_store.new_session_key()
+
+    # History lives server-side; the browser only sends the new message.
+    reply = services.get_drishti_response(user_message, user_id, session_key=session['chat_session_key'])
     
-    return jsonify({"success": True, "reply": reply, "history": new_history})
+    return jsonify({"success": True, "reply": reply})
 
 # --- ADMIN SECTION ---
 
@@ -354,13 +450,9 @@ def get_admin_reports():
     try:
         # Use DictCursor for easy dictionary access
         cursor = conn.cursor(cursor_factory=database.DictCursor)
-        # PostgreSQL uses the ->> operator to extract a JSON field as text
+        # Summary fields are generated columns, so the report documents are never read here
         query = """
-        SELECT
-            id, user_id, saved_at,
-            report_data->>'district' AS district,
-            report_data->>'state' AS state,
-            report_data->'recommendations'->'recommended_crops'->>0 AS top_crop
+        SELECT id, user_id, saved_at, district, state, top_crop
         FROM field_reports ORDER BY saved_at DESC LIMIT 20;
         """
         cursor.execute(query)
@@ -411,23 +503,111 @@ def get_top_crops_analytics():
         return jsonify({"error": "DB connection failed"}), 500
     try:
         cursor = conn.cursor()
-        # Fetch the JSONB array; psycopg2 will automatically convert it to a Python list
-        cursor.execute("SELECT report_data->'recommendations'->'recommended_crops' FROM field_reports;")
-        all_recs_tuples = cursor.fetchall()
-        
-        crop_counts = Counter()
-        for rec_tuple in all_recs_tuples:
-            crops_list = rec_tuple[0] # The list is the first element of the tuple
-            if isinstance(crops_list, list):
-                crop_counts.update(crops_list)
-        
-        top_7_crops = crop_counts.most_common(7)
+        # Count every recommended crop in the database instead of shipping all arrays to Python
+        cursor.execute("""
+            SELECT crop, COUNT(*) AS count
+            FROM field_reports, jsonb_array_elements_text(report_data->'recommendations'->'recommended_crops') AS crop
+            WHERE jsonb_typeof(report_data->'recommendations'->'recommended_crops') = 'array'
+            GROUP BY crop ORDER BY count DESC, crop LIMIT 7;
+        """)
+        top_7_crops = cursor.fetchall()
         return jsonify({"success": True, "labels": [crop[0] for crop in top_7_crops], "data": [crop[1] for crop in top_7_crops]})
     finally:
         if conn:
             database.release_db_connection(conn)
 
-services.start_background_cache_updater()
+@app.route('/api/admin/chat/intent_stats')
+@admin_required
+def get_chat_intent_stats():
+    """Shows how much chat traffic the local intent fast path answers without the model."""
+    return jsonify({"success": True, "stats": intent_parser.stats()})
+
+@app.route('/api/admin/memory')
+@admin_required
+def get_memory_usage():
+    """Per-worker RSS/PSS/USS, to size how many workers fit on a box."""
+    return jsonify({"success": True, "memory": shared_data.worker_memory()})
+
+@app.route('/api/admin/refresher')
+@admin_required
+def get_refresher_status():
+    """Which process currently leads the price refresh, and how fresh its heartbeat is."""
+    return jsonify({"success": True, "refresher": services.REFRESHER_LOCK.status()})
+
+@app.route('/api/admin/refresh_schedule')
+@admin_required
+def get_refresh_schedule():
+    """The price refresh queue as last published by the refresh leader."""
+    schedule = refresh_scheduler.published_schedule()
+    if schedule is None:
+        return jsonify({"success": False, "error": "No refresh schedule has been published yet."}), 404
+    return jsonify({"success": True, "schedule": schedule})
+
+@app.route('/api/admin/cache_stats')
+@admin_required
+def get_cache_stats():
+    """Fresh and stale hits of the stale-while-revalidate caches in this worker."""
+    return jsonify({"success": True, "stats": swr_cache.stats()})
+
+@app.route('/api/admin/metrics')
+def get_metrics():
+    """
+    Route, upstream and DB latency histograms plus pool and cache counters for this worker.
+    Prometheus text by default, ?format=json for the dashboard. Scrapers may use METRICS_TOKEN instead of an admin session.
+    """
+    scraper = METRICS_TOKEN and hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {METRICS_TOKEN}".encode())
+    if not scraper and 'admin_logged_in' not in session:
+        return jsonify({"success": False, "error": "Admin access required"}), 401
+    if request.args.get('format') == 'json':
+        return jsonify({"success": True, "metrics": metrics.snapshot()})
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/admin/profiles')
+@admin_required
+def list_request_profiles():
+    """Recently captured request profiles, newest first. Send X-Profile on any request to capture one."""
+    return jsonify({"success": True, "profiles": profiling.list_profiles()})
+
+@app.route('/api/admin/profiles/<profile_id>')
+@admin_required
+def get_request_profile(profile_id):
+    """
+    A profile's per-step breakdown (dashboard, recommendations, DB helpers).
+    ?format=text gives the top functions or stacks; ?format=raw downloads the .pstats or .collapsed file.
+    """
+    profile = profiling.get_profile(profile_id)
+    if profile is None:
+        return jsonify({"success": False, "error": "Profile not found."}), 404
+    output = request.args.get('format')
+    if output == 'raw':
+        path = profiling.data_path(profile)
+        return send_file(os.path.abspath(path), mimetype='application/octet-stream', as_attachment=True, download_name=os.path.basename(path))
+    if output == 'text':
+        return Response(profiling.render_text(profile, request.args.get('limit', 40, type=int)), mimetype='text/plain')
+    return jsonify({"success": True, "profile": profile})
+
+@app.route('/api/admin/chat/tool_stats')
+@admin_required
+def get_chat_tool_stats():
+    """Per-tool call counts, cache hits and timings for the chatbot."""
+    return jsonify({"success": True, "stats": services.TOOL_RUNTIME.stats()})
+
+def start_worker_services():
+    """
+    Per-process startup: database pool, local models and the price refresher.
+    Under a preloading gunicorn (gunicorn.conf.py) this runs in each worker after fork.
+    """
+    if database.pg_pool is None:
+        database.init_connection_pool()
+    # Loads the local soil/plant-health models, if configured, before the first request.
+    inference.warm_up()
+    services.start_background_cache_updater()
+
+if os.getenv('GUNICORN_PRELOAD') == '1':
+    # Connections opened while preloading would be shared by every forked worker.
+    database.close_connection_pool()
+else:
+    start_worker_services()
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
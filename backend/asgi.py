@@ -0,0 +1,222 @@
+# asgi.py - ASGI entry point: async views for the upstream-heavy endpoints, Flask for the rest
+#
+#   GUNICORN_ASGI=1 gunicorn -c gunicorn.conf.py        # uvicorn workers
+#   uvicorn asgi:application --port 5000               # single process, for development
+#
+# /api/analyze_field, /api/chat_with_drishti and /api/mandi_prices are served on the event loop
+# through async_services, so a worker can wait on hundreds of slow upstream calls at once instead of
+# pinning a thread per request. Every other route is the unchanged Flask app, run on a thread pool.
+# The Flask session cookie is read and written here too, so logins carry over between both halves.
+# Requests that may be profiled (X-Profile, or a PROFILE_ROUTES path while sampling) go to Flask instead.
+
+import asyncio
+import contextlib
+import functools
+import time
+
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.routing import Route
+
+import app as flask_module
+import async_services
+import conversation_store
+import metrics
+import services
+from config import CHAT_MAX_MESSAGE_CHARS, ASYNC_WSGI_THREADS, PROFILE_SAMPLE_RATE, PROFILE_ROUTES
+from utils import locate_from_gps
+
+flask_app = flask_module.app
+
+
+def _json(body, status=200):
+    # Flask's encoder, so both halves serialise reports the same way.
+    return Response(flask_app.json.dumps(body), status_code=status, media_type='application/json')
+
+
+async def _request_json(request):
+    """The JSON body as a dict, or None when it isn't one."""
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+# --- Flask session cookie ---
+
+def _session_serializer():
+    return flask_app.session_interface.get_signing_serializer(flask_app)
+
+
+def _load_session(request):
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return {}
+    try:
+        return dict(_session_serializer().loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds())))
+    except BadSignature:
+        return {}
+
+
+def _save_session(response, session):
+    config = flask_app.config
+    response.set_cookie(
+        config['SESSION_COOKIE_NAME'], _session_serializer().dumps(session),
+        path=config['SESSION_COOKIE_PATH'] or '/', domain=config['SESSION_COOKIE_DOMAIN'] or None,
+        secure=config['SESSION_COOKIE_SECURE'], httponly=config['SESSION_COOKIE_HTTPONLY'],
+        samesite=config['SESSION_COOKIE_SAMESITE'] or 'lax',
+    )
+
+
+def login_required(view):
+    """Async twin of app.login_required; the view gets the session and may change it."""
+    @functools.wraps(view)
+    async def wrapped_view(request):
+        session = _load_session(request)
+        if 'logged_in' not in session:
+            return _json({"success": False, "error": "Unauthorized"}, 401)
+        before = dict(session)
+        response = await view(request, session)
+        if session != before:
+            _save_session(response, session)
+        return response
+    return wrapped_view
+
+
+# --- Async views ---
+
+@login_required
+async def analyze_field(request, session):
+    form = await request.form()
+    try:
+        latitude, longitude = float(form.get('latitude')), float(form.get('longitude'))
+    except (ValueError, TypeError):
+        return _json({"success": False, "error": "Invalid coordinates."}, 400)
+
+    image_file = form.get('image')
+    if not image_file or isinstance(image_file, str):
+        return _json({"success": False, "error": "A soil image is required."}, 400)
+
+    soil_analysis = await async_services.analyze_soil_type(await image_file.read())
+    if "error" in soil_analysis:
+        return _json({"success": False, "error": soil_analysis["error"]}, 500)
+
+    lang = form.get('lang', 'en')
+    district, state = locate_from_gps(latitude, longitude)
+    # Forecast and history come from different upstreams, so they are awaited together.
+    weather, historical_weather = await asyncio.gather(
+        async_services.get_weather_data(latitude, longitude),
+        async_services.get_historical_weather_summary(latitude, longitude, lang=lang),
+    )
+
+    recommendation_data = await async_services.run_blocking(
+        services.get_crop_recommendations, state, soil_analysis, weather, historical_weather, form.get('lastCrop', ''), lang=lang)
+
+    full_report = services.field_report(latitude, longitude, state, district, weather, historical_weather, soil_analysis, recommendation_data, lang)
+    ai_prompt = services.field_advice_prompt(state, soil_analysis.get('prediction'), recommendation_data.get("recommended_crops", []), lang)
+    full_report['ai_advice'] = await async_services.get_gemini_report_advice(ai_prompt)
+    return _json(full_report)
+
+
+@login_required
+async def chat_with_drishti(request, session):
+    data = await _request_json(request)
+    if data is None:
+        return _json({"success": False, "error": "Invalid JSON body."}, 400)
+    user_id = session['user_id']
+
+    if data.get("event") == "init_chat":
+        # Each chat window starts a fresh server-side conversation.
+        await async_services.run_blocking(conversation_store.reset, user_id, session.get('chat_session_key'))
+        session['chat_session_key'] = conversation_store.new_session_key()
+        return _json({"success": True, "reply": flask_module.CHAT_WELCOME_MESSAGE})
+
+    user_message = data.get('message')
+    if not user_message:
+        return _json({"success": False, "error": "No message provided."}, 400)
+    if len(user_message) > CHAT_MAX_MESSAGE_CHARS:
+        return _json({"success": False, "error": f"Message is too long (max {CHAT_MAX_MESSAGE_CHARS} characters)."}, 413)
+
+    if 'chat_session_key' not in session:
+        session['chat_session_key'] = conversation_store.new_session_key()
+
+    reply = await async_services.get_drishti_response(user_message, user_id, session_key=session['chat_session_key'])
+    return _json({"success": True, "reply": reply})
+
+
+@login_required
+async def mandi_prices(request, session):
+    data = await _request_json(request)
+    if data is None:
+        return _json({"success": False, "error": "Invalid JSON body."}, 400)
+    try:
+        area = float(data.get('area', 1))
+        state, district, crop = data['state'], data['district'], data['crop']
+    except (KeyError, TypeError, ValueError):
+        return _json({"success": False, "error": "State, district and crop are required."}, 400)
+
+    price_result = await async_services.get_mandi_prices(state=state, district=district, crop=crop, area=area)
+    if "error" in price_result:
+        return _json({"success": False, "error": price_result["error"]}, 404)
+    return _json({"success": True, "result": price_result})
+
+
+# --- Application ---
+
+@contextlib.asynccontextmanager
+async def _lifespan(app):
+    yield
+    await async_services.close()
+
+
+_async_app = Starlette(
+    routes=[
+        Route('/api/analyze_field', analyze_field, methods=['POST']),
+        Route('/api/chat_with_drishti', chat_with_drishti, methods=['POST']),
+        Route('/api/mandi_prices', mandi_prices, methods=['POST']),
+    ],
+    # Same policy Flask-CORS applies to the Flask routes.
+    middleware=[Middleware(CORSMiddleware, allow_origins=flask_module.allowed_origins, allow_credentials=True, allow_methods=['*'], allow_headers=['*'])],
+    lifespan=_lifespan,
+)
+_flask_asgi = WSGIMiddleware(flask_app, workers=ASYNC_WSGI_THREADS)
+ASYNC_PATHS = {route.path for route in _async_app.routes}
+
+
+async def _timed(scope, receive, send):
+    """Records the async routes in the same latency histogram the Flask hooks feed."""
+    started = time.perf_counter()
+    status = {}
+
+    async def send_with_status(message):
+        if message["type"] == 'http.response.start':
+            status["code"] = message["status"]
+        await send(message)
+
+    try:
+        await _async_app(scope, receive, send_with_status)
+    finally:
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - started, scope["path"], scope["method"], str(status.get("code", 500)))
+
+
+def _profiling_wanted(scope):
+    """
+    Requests that may be profiled stay on Flask, where profiling hooks in: a profile of the
+    event-loop thread would mix in every other request it is serving at the time.
+    """
+    return 'x-profile' in Headers(scope=scope) or (PROFILE_SAMPLE_RATE > 0 and scope["path"] in PROFILE_ROUTES)
+
+
+async def application(scope, receive, send):
+    if scope["type"] == 'lifespan':
+        await _async_app(scope, receive, send)
+    elif scope["type"] == 'http' and scope["path"] in ASYNC_PATHS and not _profiling_wanted(scope):
+        await _timed(scope, receive, send)
+    else:
+        await _flask_asgi(scope, receive, send)
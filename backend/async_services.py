@@ -0,0 +1,289 @@
+# async_services.py - Non-blocking variants of the upstream-bound service calls, served by asgi.py
+#
+# Vision, weather, history, Gemini and data.gov.in calls share one aiohttp session, so a single
+# worker can keep hundreds of slow upstream calls in flight. Parsing, caching and fallbacks are the
+# ones in services.py; the steps that still block (database, local models, price store files) run
+# on a bounded thread pool instead of the event loop.
+
+import asyncio
+import base64
+import functools
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import requests
+
+import cassette
+import conversation_store
+import inference
+import mandi_feed
+import metrics
+import price_store
+import services
+from config import (
+    GEMINI_API_KEY, GEMINI_API_URL, OPENWEATHERMAP_API_KEY, OPEN_METEO_ARCHIVE_URL,
+    DATA_GOV_IN_MAX_WORKERS, CHAT_MAX_TOOL_ROUNDS,
+    ASYNC_HTTP_MAX_CONNECTIONS, ASYNC_HTTP_MAX_PER_HOST, ASYNC_BLOCKING_THREADS, UPSTREAM_CASSETTE_MODE
+)
+
+logger = logging.getLogger(__name__)
+
+_BLOCKING_EXECUTOR = ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_THREADS, thread_name_prefix='async_blocking')
+_SESSION = None
+_PRICE_REFRESHES = {}   # state -> the task refreshing it, so concurrent misses share one fetch
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Runs a blocking call (database, local model, price store files) without stalling the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_BLOCKING_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+
+def _session():
+    global _SESSION
+    if _SESSION is None or _SESSION.closed:
+        connector = aiohttp.TCPConnector(limit=ASYNC_HTTP_MAX_CONNECTIONS, limit_per_host=ASYNC_HTTP_MAX_PER_HOST)
+        _SESSION = aiohttp.ClientSession(connector=connector)
+    return _SESSION
+
+
+async def close():
+    """Closes the upstream session; called on ASGI shutdown."""
+    global _SESSION
+    if _SESSION is not None:
+        await _SESSION.close()
+        _SESSION = None
+
+
+async def _fetch(method, url, timeout, params=None, json=None, headers=None):
+    """
+    Body of one upstream call, timed under the same upstream labels as the blocking session.
+    Recorded or replayed like cassette.CassetteSession when UPSTREAM_CASSETTE_MODE is set.
+    """
+    started = time.perf_counter()
+    outcome = 'error'
+    # The cassette keys come from the request as requests would send it, so both paths share recordings.
+    prepared = requests.Request(method, url, params=params, json=json, headers=headers).prepare() if UPSTREAM_CASSETTE_MODE in ('record', 'replay') else None
+    try:
+        if UPSTREAM_CASSETTE_MODE == 'replay':
+            entry = cassette.lookup(prepared)
+            await asyncio.sleep(cassette.replay_delay(entry))
+            response = cassette.to_response(entry, prepared)
+            outcome = f"{response.status_code // 100}xx"
+            response.raise_for_status()
+            return response.content
+
+        async with _session().request(method, url, params=params, json=json, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            outcome = f"{response.status // 100}xx"
+            body = await response.read()
+            if prepared is not None:
+                cassette.record_exchange(prepared, response.status, response.reason, response.headers, body, time.perf_counter() - started)
+            response.raise_for_status()
+            return body
+    finally:
+        metrics.UPSTREAM_LATENCY.observe(time.perf_counter() - started, metrics.upstream_name(url), outcome)
+
+
+async def _fetch_json(method, url, timeout, **kwargs):
+    return json.loads(await _fetch(method, url, timeout, **kwargs))
+
+
+# --- Vision ---
+
+async def _local_analysis(mode, image_data):
+    """In-process model result, or None to fall back to the remote vision service."""
+    return services.local_analysis_result(await run_blocking(inference.classify, mode, image_data))
+
+
+async def _remote_analysis(api_url, mode, image_data):
+    if not api_url:
+        return {"error": "Vision service URL is not configured."}
+
+    b64_image = base64.b64encode(image_data).decode('utf-8')
+    payload = {"data": [f"data:image/jpeg;base64,{b64_image}", mode]}
+    try:
+        return (await _fetch_json('POST', api_url, 60, json=payload)).get("data", [{}])[0]
+    except Exception as e:
+        logger.error(f"Error calling Vision API for {mode}: {e}")
+        return {"error": "The AI vision service is currently unavailable."}
+
+
+async def analyze_crop_health(image_data):
+    return await _local_analysis(inference.CROP, image_data) or await _remote_analysis(services.CROP_API_URL, inference.CROP, image_data)
+
+
+async def analyze_soil_type(image_data):
+    return await _local_analysis(inference.SOIL, image_data) or await _remote_analysis(services.SOIL_API_URL, inference.SOIL, image_data)
+
+
+# --- Weather ---
+
+async def _fetch_forecast(latitude, longitude, lang):
+    try:
+        return services.parse_forecast(await _fetch_json('GET', services.forecast_url(latitude, longitude, lang), 10))
+    except Exception as e:
+        logger.error(f"Error fetching forecast from OpenWeatherMap: {e}")
+        return None
+
+
+async def get_forecast_data(latitude, longitude, lang='en'):
+    """services.get_forecast_data, awaiting OpenWeatherMap on a cache miss."""
+    key = services.forecast_key(latitude, longitude, lang)
+    if not OPENWEATHERMAP_API_KEY or key is None:
+        return services.default_forecast()
+
+    forecast, is_stale = await services.FORECAST_CACHE.get_async(
+        key, lambda: services.fetch_forecast(latitude, longitude, lang), lambda: _fetch_forecast(latitude, longitude, lang))
+    if forecast is None:
+        return services.default_forecast()
+    return {**forecast, "is_stale": is_stale}
+
+
+async def get_weather_data(lat, lon, lang='en'):
+    return (await get_forecast_data(lat, lon, lang=lang)).get('current', {})
+
+
+async def _fetch_historical_weather(lat, lon, lang):
+    try:
+        daily = (await _fetch_json('GET', OPEN_METEO_ARCHIVE_URL, 20, params=services.historical_weather_params(lat, lon)))['daily']
+        return services.summarise_historical_weather(daily, lang)
+    except Exception as e:
+        logger.error(f"Error fetching historical weather from Open-Meteo: {e}")
+        return None
+
+
+async def get_historical_weather_summary(lat, lon, lang='en'):
+    """services.get_historical_weather_summary, awaiting Open-Meteo on a cache miss."""
+    key = services.historical_weather_key(lat, lon, lang)
+    if key is None:
+        return services.default_historical_weather()
+
+    summary, is_stale = await services.HISTORICAL_WEATHER_CACHE.get_async(
+        key, lambda: services.fetch_historical_weather(key[0], key[1], lang), lambda: _fetch_historical_weather(key[0], key[1], lang))
+    if summary is None:
+        return services.default_historical_weather()
+    return {**summary, "is_stale": is_stale}
+
+
+# --- Gemini ---
+
+async def _gemini(payload, timeout):
+    return await _fetch_json('POST', f"{GEMINI_API_URL}?key={GEMINI_API_KEY}", timeout, headers=services.GEMINI_HEADERS, json=payload)
+
+
+async def get_gemini_report_advice(prompt):
+    if not GEMINI_API_KEY or not GEMINI_API_URL:
+        return [dict(services.ADVICE_NOT_CONFIGURED)]
+    try:
+        return services.parse_report_advice(await _gemini({"contents": [{"parts": [{"text": prompt}]}]}, 30))
+    except Exception as e:
+        logger.error(f"Error contacting or parsing Gemini API response: {e}")
+        return [dict(services.ADVICE_ERROR)]
+
+
+async def get_drishti_response(user_message, user_id, session_key=None):
+    """services.get_drishti_response with the model calls awaited; tools and the conversation store run on the blocking pool."""
+    conversation = await run_blocking(conversation_store.load, user_id, session_key)
+    started_at = time.perf_counter()
+
+    local_reply = await run_blocking(services.local_chat_reply, user_message, user_id, session_key, conversation, started_at)
+    if local_reply:
+        return local_reply
+
+    if not GEMINI_API_KEY or not GEMINI_API_URL:
+        return {"type": "text", "content": "Chatbot AI service is not configured."}
+
+    gemini_history, payload = services.chat_model_payload(conversation, user_message)
+    try:
+        candidate = (await _gemini(payload, 90)).get('candidates', [{}])[0]
+
+        for tool_round in range(1, CHAT_MAX_TOOL_ROUNDS + 1):
+            tool_calls = services.model_tool_calls(candidate)
+            if not tool_calls:
+                break
+
+            tool_outputs = await run_blocking(services.run_tool_calls, tool_calls, user_id)
+            options_reply = services.tool_options_reply(tool_calls, tool_outputs)
+            if options_reply:
+                return options_reply
+
+            follow_up_payload = services.chat_follow_up_payload(gemini_history, payload, tool_calls, tool_outputs, tool_round)
+            candidate = (await _gemini(follow_up_payload, 90)).get('candidates', [{}])[0]
+
+        return await run_blocking(services.finish_chat_reply, candidate, user_message, user_id, session_key, conversation, started_at)
+
+    except Exception as e:
+        logger.error(f"FATAL error in Gemini API call: {e}", exc_info=True)
+        return {"type": "text", "content": "A critical error occurred while contacting the AI assistant."}
+
+
+# --- Live prices ---
+
+async def _fetch_page(state, api_date_str, offset):
+    """mandi_feed._fetch_page over the shared session; HTTP errors surface as requests' HTTPError, as they do there."""
+    await asyncio.sleep(mandi_feed.rate_limiter.reserve())
+    try:
+        body = await _fetch('GET', mandi_feed.DATA_GOV_IN_URL, 20, params=mandi_feed.page_params(state, api_date_str, offset), headers=mandi_feed.REQUEST_HEADERS)
+    except aiohttp.ClientResponseError as e:
+        raise requests.exceptions.HTTPError(str(e)) from e
+    return mandi_feed.index_page(state, [body])
+
+
+async def _fetch_page_or_error(state, api_date_str, offset, slots):
+    async with slots:
+        try:
+            return await _fetch_page(state, api_date_str, offset)
+        except Exception as e:
+            return e
+
+
+async def fetch_state_prices(state, for_date):
+    """
+    mandi_feed.fetch_state_prices with the pages awaited instead of threaded. Shares its rate limiter,
+    so sync and async fetches together still respect DATA_GOV_IN_MIN_REQUEST_INTERVAL.
+    """
+    api_date_str = for_date.strftime('%Y-%m-%d')
+    slots = asyncio.Semaphore(max(1, DATA_GOV_IN_MAX_WORKERS))
+    plan = mandi_feed.page_plan(state, for_date)
+    try:
+        offsets = next(plan)
+        while True:
+            offsets = plan.send(await asyncio.gather(*(_fetch_page_or_error(state, api_date_str, offset, slots) for offset in offsets)))
+    except StopIteration as done:
+        return done.value
+
+
+async def _refresh_price_store(state):
+    """
+    price_store.refresh_state for the latest arrivals, run on the blocking pool with each date fetched on
+    the event loop; older missing dates are backfilled on the background refresh pool.
+    """
+    loop = asyncio.get_running_loop()
+
+    def fetch_fn(state, for_date):
+        return asyncio.run_coroutine_threadsafe(fetch_state_prices(state, for_date), loop).result()
+
+    refreshed = await run_blocking(price_store.refresh_state, state, fetch_fn, latest_only=True)
+    services.queue_price_backfill(state)
+    return refreshed
+
+
+async def refresh_price_store(state):
+    """_refresh_price_store, shared by every request that misses on the same state at once."""
+    key = state.lower()
+    task = _PRICE_REFRESHES.get(key)
+    if task is None:
+        task = _PRICE_REFRESHES[key] = asyncio.ensure_future(_refresh_price_store(state))
+        task.add_done_callback(lambda _: _PRICE_REFRESHES.pop(key, None))
+    return await asyncio.shield(task)
+
+
+async def get_mandi_prices(state, district, crop, area=1.0, lang='en'):
+    """services.get_mandi_prices, awaiting data.gov.in when the price store can't answer."""
+    price_data, fallback = await run_blocking(services.stored_price_data, state, district, crop)
+    if price_data is None:
+        refreshed = await refresh_price_store(state)
+        price_data = await run_blocking(services.price_data_after_refresh, state, district, crop, refreshed, fallback)
+    return services.mandi_price_report(price_data, state, district, crop, area, lang)
@@ -0,0 +1,351 @@
+# batch_pipeline.py - Cooperative-scale batch field analysis running as background jobs
+
+import csv
+import io
+import json
+import logging
+import math
+import multiprocessing
+import os
+import re
+import secrets
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import services
+from config import (
+    BATCH_OUTPUT_DIR, BATCH_MAX_PLOTS, BATCH_CLIMATE_GRID_DEG, BATCH_CLIMATE_WORKERS,
+    BATCH_VISION_WORKERS, BATCH_PROCESS_WORKERS, BATCH_SCORE_CHUNK_SIZE, BATCH_JOB_RETENTION_HOURS,
+    BATCH_JOB_HEARTBEAT_SECONDS
+)
+from utils import locate_many_from_gps
+
+logger = logging.getLogger(__name__)
+
+CSV_FIELDS = ['plot_id', 'latitude', 'longitude', 'district', 'state', 'soil_type', 'recommended_crops', 'considerations', 'error']
+_JOB_ID = re.compile(r'^[0-9a-f]{16}$')
+
+_PROCESS_POOL = None
+_POOL_LOCK = threading.Lock()
+_STATUS_LOCK = threading.Lock()
+_ORPHANED_AFTER_SECONDS = 4 * BATCH_JOB_HEARTBEAT_SECONDS
+
+
+# --- Input ---
+
+def _clean_plot(index, raw):
+    """Returns a plot dict or raises ValueError."""
+    if not isinstance(raw, dict):
+        raise ValueError("each plot must be an object")
+    try:
+        latitude, longitude = float(raw.get('latitude')), float(raw.get('longitude'))
+    except (TypeError, ValueError):
+        raise ValueError("latitude and longitude must be numbers")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("coordinates are out of range")
+    plot_id = str(raw.get('plot_id') or index + 1).strip()
+    return {
+        "plot_id": plot_id, "latitude": latitude, "longitude": longitude,
+        "soil_type": (raw.get('soil_type') or '').strip() or None,
+        "last_crop": (raw.get('last_crop') or '').strip(),
+    }
+
+
+def parse_plots(rows):
+    """
+    Validates plots given as a list of dicts (JSON body or CSV rows).
+    Returns (plots, errors) where errors are {'plot_id', 'error'} rows for the output file.
+    """
+    if not isinstance(rows, list) or not rows:
+        raise ValueError("Provide at least one plot.")
+    if len(rows) > BATCH_MAX_PLOTS:
+        raise ValueError(f"A batch can contain at most {BATCH_MAX_PLOTS} plots.")
+    plots, errors = [], []
+    for index, raw in enumerate(rows):
+        try:
+            plots.append(_clean_plot(index, raw))
+        except ValueError as e:
+            plot_id = raw.get('plot_id') if isinstance(raw, dict) else None
+            errors.append({"plot_id": plot_id or index + 1, "error": f"Invalid plot: {e}"})
+    return plots, errors
+
+
+def read_csv_plots(file_bytes):
+    """Reads an uploaded CSV with columns plot_id, latitude, longitude, soil_type, last_crop."""
+    text = file_bytes.decode('utf-8-sig')
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or not {'latitude', 'longitude'} <= {name.strip().lower() for name in reader.fieldnames}:
+        raise ValueError("The CSV needs latitude and longitude columns.")
+    return [{(key or '').strip().lower(): value for key, value in row.items()} for row in reader]
+
+
+# --- Pipeline stages ---
+
+def _grid_cell(latitude, longitude):
+    return (math.floor(latitude / BATCH_CLIMATE_GRID_DEG), math.floor(longitude / BATCH_CLIMATE_GRID_DEG))
+
+
+def _cell_centre(cell):
+    return ((cell[0] + 0.5) * BATCH_CLIMATE_GRID_DEG, (cell[1] + 0.5) * BATCH_CLIMATE_GRID_DEG)
+
+
+def _fetch_climate(cells, lang):
+    """One current-weather and one historical fetch per grid cell, run concurrently."""
+    def fetch(cell):
+        latitude, longitude = _cell_centre(cell)
+        return services.get_weather_data(latitude, longitude), services.get_historical_weather_summary(latitude, longitude, lang=lang)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_CLIMATE_WORKERS, len(cells)))) as executor:
+        return dict(zip(cells, executor.map(fetch, cells)))
+
+
+def _classify_soil_images(plots, images):
+    """Runs the soil vision model for plots that came with an image instead of a soil type."""
+    pending = [plot for plot in plots if not plot['soil_type'] and plot['plot_id'] in images]
+    if not pending:
+        return
+
+    def classify(plot):
+        return plot, services.analyze_soil_type(images[plot['plot_id']])
+
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_VISION_WORKERS, len(pending)))) as executor:
+        for plot, result in executor.map(classify, pending):
+            if "error" in result:
+                plot['error'] = result["error"]
+            else:
+                plot['soil_type'] = result.get('prediction')
+
+
+def score_chunk(targets, dataset_vectors, labels, last_crops, lang):
+    """Cosine similarity of many fields against one soil group in a single matrix product."""
+    targets = targets / np.maximum(np.linalg.norm(targets, axis=1, keepdims=True), 1e-12)
+    dataset = dataset_vectors / np.maximum(np.linalg.norm(dataset_vectors, axis=1, keepdims=True), 1e-12)
+    similarities = targets @ dataset.T
+    return [services.rank_crops(similarities[i], labels, last_crops[i], lang) for i in range(len(last_crops))]
+
+
+def _process_pool():
+    """
+    Scoring pool, started on first use. Workers come from a forkserver (or are spawned) rather than
+    forked from this multithreaded web worker, which could copy a lock held by another thread.
+    """
+    global _PROCESS_POOL
+    with _POOL_LOCK:
+        if _PROCESS_POOL is None and BATCH_PROCESS_WORKERS > 1:
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            try:
+                _PROCESS_POOL = ProcessPoolExecutor(max_workers=BATCH_PROCESS_WORKERS, mp_context=multiprocessing.get_context(start_method))
+            except (OSError, NotImplementedError) as e:
+                logger.warning(f"BATCH: Process pool unavailable, scoring in-process: {e}")
+                return None
+        return _PROCESS_POOL
+
+
+def _score_plots(plots, climate, lang):
+    """
+    Groups plots by soil, builds their target vectors and scores each group in chunks.
+    Large batches fan the chunks out over a process pool. Yields (plots, results) as chunks finish.
+    """
+    is_kharif = services.is_kharif_season()
+    groups = {}
+    for plot in plots:
+        groups.setdefault(services.soil_search_term(plot['soil_type']), []).append(plot)
+
+    targets_cache = {}
+    chunks = []
+    for search_term, group in groups.items():
+        dataset_vectors, labels = services.soil_candidates(search_term)
+        if not len(labels):
+            for plot in group:
+                plot['error'] = f"No crop data for detected soil type: {plot['soil_type']}."
+            yield group, [None] * len(group)
+            continue
+        for start in range(0, len(group), BATCH_SCORE_CHUNK_SIZE):
+            chunk = group[start:start + BATCH_SCORE_CHUNK_SIZE]
+            rows = []
+            for plot in chunk:
+                key = (plot['state'], plot['cell'])
+                if key not in targets_cache:
+                    weather, historical = climate[plot['cell']]
+                    targets_cache[key] = services.climate_target_vector(plot['state'], weather, historical, is_kharif)
+                rows.append(targets_cache[key])
+            chunks.append((chunk, (np.vstack(rows), dataset_vectors, labels, [plot['last_crop'] for plot in chunk], lang)))
+
+    pool = _process_pool() if len(plots) > BATCH_SCORE_CHUNK_SIZE else None
+    if pool is None:
+        for chunk, args in chunks:
+            yield chunk, score_chunk(*args)
+        return
+
+    futures = {pool.submit(score_chunk, *args): chunk for chunk, args in chunks}
+    for future in as_completed(futures):
+        yield futures[future], future.result()
+
+
+# --- Jobs ---
+
+def _paths(job_id):
+    return os.path.join(BATCH_OUTPUT_DIR, f"{job_id}.json"), os.path.join(BATCH_OUTPUT_DIR, f"{job_id}.csv")
+
+
+def _write_status(job):
+    """Job status lives next to the results on disk so any worker process can answer status requests."""
+    status_path, _ = _paths(job['job_id'])
+    tmp_path = f"{status_path}.{os.getpid()}.tmp"
+    with _STATUS_LOCK:
+        job['heartbeat_at'] = time.time()
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(job), f)
+        os.replace(tmp_path, status_path)
+
+
+def _heartbeat(job, stop):
+    """Rewrites a running job's status every BATCH_JOB_HEARTBEAT_SECONDS, so a job whose worker died can be told apart."""
+    while not stop.wait(BATCH_JOB_HEARTBEAT_SECONDS):
+        try:
+            _write_status(job)
+        except OSError as e:
+            logger.warning(f"BATCH: Heartbeat for job {job['job_id']} failed: {e}")
+
+
+def _owner_gone(job):
+    """True when the worker process that owns an unfinished job is known to have exited."""
+    if job.get('owner_host') != socket.gethostname() or not job.get('owner_pid'):
+        return False
+    try:
+        os.kill(job['owner_pid'], 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def _fail_if_orphaned(job):
+    """Marks a queued or running job failed once its owner exited or it missed its heartbeats."""
+    if job.get('status') not in ('queued', 'running'):
+        return job
+    silent_for = time.time() - (job.get('heartbeat_at') or job.get('created_at') or 0)
+    if silent_for < _ORPHANED_AFTER_SECONDS and not _owner_gone(job):
+        return job
+    logger.warning(f"BATCH: Job {job['job_id']} lost its worker (pid {job.get('owner_pid')}, silent for {silent_for:.0f}s); marking it failed.")
+    job['status'], job['error'] = 'failed', "The batch was interrupted before it finished. Please submit it again."
+    job['finished_at'] = time.time()
+    try:
+        _write_status(job)
+    except OSError as e:
+        logger.error(f"BATCH: Could not mark job {job['job_id']} failed: {e}")
+    return job
+
+
+def _cleanup_old_jobs():
+    cutoff = time.time() - BATCH_JOB_RETENTION_HOURS * 3600
+    for name in os.listdir(BATCH_OUTPUT_DIR):
+        path = os.path.join(BATCH_OUTPUT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _result_row(plot, result):
+    return {
+        "plot_id": plot['plot_id'], "latitude": plot['latitude'], "longitude": plot['longitude'],
+        "district": plot.get('district'), "state": plot.get('state'), "soil_type": plot['soil_type'],
+        "recommended_crops": "; ".join(result["recommended_crops"]) if result else "",
+        "considerations": result["considerations"] if result else "",
+        "error": plot.get('error', ''),
+    }
+
+
+def _run_job(job, plots, invalid_rows, images, lang):
+    _, results_path = _paths(job['job_id'])
+    started = time.perf_counter()
+    job['status'] = 'running'
+    _write_status(job)
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job, stop_heartbeat), daemon=True, name=f"batch_heartbeat_{job['job_id']}").start()
+    try:
+        with open(results_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(invalid_rows)
+            job['failed'] += len(invalid_rows)
+
+            _classify_soil_images(plots, images)
+            for plot, (district, state) in zip(plots, locate_many_from_gps((plot['latitude'], plot['longitude']) for plot in plots)):
+                plot['district'], plot['state'] = district, state
+                plot['cell'] = _grid_cell(plot['latitude'], plot['longitude'])
+
+            ready = []
+            for plot in plots:
+                if plot.get('error') or not plot['soil_type']:
+                    plot.setdefault('error', "A soil type or soil image is required.")
+                    writer.writerow(_result_row(plot, None))
+                    job['failed'] += 1
+                else:
+                    ready.append(plot)
+
+            climate = _fetch_climate(sorted({plot['cell'] for plot in ready}), lang) if ready else {}
+            job['climate_cells'] = len(climate)
+            _write_status(job)
+
+            for chunk, results in _score_plots(ready, climate, lang):
+                for plot, result in zip(chunk, results):
+                    writer.writerow(_result_row(plot, result))
+                    job['processed' if result else 'failed'] += 1
+                f.flush()
+                _write_status(job)
+
+        job['status'] = 'done'
+    except Exception as e:
+        logger.error(f"BATCH: Job {job['job_id']} failed: {e}", exc_info=True)
+        job['status'], job['error'] = 'failed', "The batch could not be completed."
+    finally:
+        stop_heartbeat.set()
+    job['finished_at'] = time.time()
+    job['elapsed_seconds'] = round(time.perf_counter() - started, 2)
+    _write_status(job)
+    logger.info(f"BATCH: Job {job['job_id']} {job['status']}: {job['processed']} scored, {job['failed']} failed, "
+                f"{job.get('climate_cells', 0)} climate cells in {job['elapsed_seconds']}s.")
+
+
+def start_job(user_id, rows, images=None, lang='en'):
+    """Validates the plots and starts a background job. Returns the job status dict; raises ValueError on bad input."""
+    plots, invalid_rows = parse_plots(rows)
+    os.makedirs(BATCH_OUTPUT_DIR, exist_ok=True)
+    _cleanup_old_jobs()
+
+    job = {
+        "job_id": secrets.token_hex(8), "user_id": user_id, "status": "queued",
+        "total": len(plots) + len(invalid_rows), "processed": 0, "failed": 0,
+        "created_at": time.time(), "finished_at": None, "error": None,
+        "owner_host": socket.gethostname(), "owner_pid": os.getpid(),
+    }
+    _write_status(job)
+    threading.Thread(target=_run_job, args=(job, plots, invalid_rows, images or {}, lang), daemon=True, name=f"batch_{job['job_id']}").start()
+    return job
+
+
+def get_job(user_id, job_id):
+    """Returns the job's status dict, or None if it doesn't exist or belongs to another user."""
+    if not _JOB_ID.match(job_id or ''):
+        return None
+    status_path, _ = _paths(job_id)
+    try:
+        with open(status_path, 'r', encoding='utf-8') as f:
+            job = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if job.get('user_id') != user_id:
+        return None
+    return _fail_if_orphaned(job)
+
+
+def result_path(job_id):
+    return os.path.abspath(_paths(job_id)[1])
@@ -0,0 +1,175 @@
+# fake_upstreams.py - Local stand-ins for Gemini, OpenWeatherMap, open-meteo, data.gov.in and the vision API
+
+import json
+import random
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+BENCH_DISTRICTS = ['Ludhiana', 'Amritsar', 'Jalandhar', 'Patiala', 'Bathinda']
+BENCH_COMMODITIES = ['Wheat', 'Paddy(Dhan)(Common)', 'Maize', 'Cotton', 'Potato']
+
+
+class UpstreamProfile:
+    """Latency and payload knobs for one fake upstream."""
+
+    def __init__(self, latency_ms=50.0, jitter_ms=10.0, payload_scale=1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.payload_scale = payload_scale
+
+    def delay(self):
+        time.sleep(max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000)
+
+
+def _gemini_response(payload, profile):
+    contents = payload.get("contents") or []
+    last = contents[-1] if contents else {}
+    # With tools on offer and a fresh user turn, answer with a price lookup so the tool path is exercised too.
+    if payload.get("tools") and last.get("role") == "user":
+        parts = [{"functionCall": {"name": "get_mandi_price", "args": {"district": "Ludhiana", "crop": "Wheat", "state": "Punjab"}}}]
+    else:
+        filler = " ".join(["Apply fertilizer in split doses and irrigate after each application."] * profile.payload_scale)
+        text = f"**Description:** Benchmark advice. ## **Treatment:** 1. {filler} ## **Prevention:** 1. Rotate crops."
+        parts = [{"text": text}]
+    return {"candidates": [{"content": {"role": "model", "parts": parts}}]}
+
+
+def _forecast_response(profile):
+    start = int(time.time())
+    items = []
+    for step in range(40 * profile.payload_scale):
+        items.append({
+            "dt": start + step * 3 * 3600,
+            "main": {"temp": 24.0 + step % 8, "temp_max": 27.0 + step % 8, "temp_min": 19.0 + step % 8, "humidity": 60 + step % 20},
+            "weather": [{"description": "scattered clouds", "icon": "03d"}],
+        })
+    return {"list": items}
+
+
+def _archive_response(query, profile):
+    start = date.fromisoformat(query.get("start_date", [(date.today() - timedelta(days=365)).isoformat()])[0])
+    end = date.fromisoformat(query.get("end_date", [date.today().isoformat()])[0])
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    return {"daily": {
+        "time": [day.isoformat() for day in days],
+        "temperature_2m_mean": [30.0 if 6 <= day.month <= 10 else 22.0 for day in days],
+        "precipitation_sum": [6.0 if 6 <= day.month <= 9 else 0.8 for day in days],
+    }}
+
+
+def _mandi_response(query, profile):
+    total = 200 * profile.payload_scale
+    limit = int(query.get("limit", ["1000"])[0])
+    offset = int(query.get("offset", ["0"])[0])
+    state = query.get("filters[state]", ["Punjab"])[0]
+    arrival = query.get("filters[arrival_date]", [date.today().isoformat()])[0]
+    arrival_ddmmyyyy = "/".join(reversed(arrival.split("-")))
+    records = []
+    for i in range(offset, min(total, offset + limit)):
+        records.append({
+            "state": state, "district": BENCH_DISTRICTS[i % len(BENCH_DISTRICTS)], "market": f"Market {i % 7}",
+            "commodity": BENCH_COMMODITIES[i % len(BENCH_COMMODITIES)], "arrival_date": arrival_ddmmyyyy,
+            "min_price": str(1800 + i % 50), "max_price": str(2400 + i % 50), "modal_price": str(2100 + i % 50),
+        })
+    return {"total": total, "count": len(records), "limit": str(limit), "offset": str(offset), "records": records}
+
+
+def _vision_response(payload):
+    image, mode = (payload.get("data") or [None, "Soil"])[:2]
+    if mode == "Crop" or (isinstance(mode, list) and mode and mode[0] == "Crop"):
+        result = {"prediction": "Tomato___Late_blight", "confidence": 0.91, "is_healthy": False}
+    else:
+        result = {"prediction": "Alluvial Soil", "confidence": 0.93}
+    if isinstance(image, list):
+        return {"data": [[dict(result) for _ in image]]}
+    return {"data": [result]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive, like the real services
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, body, status=200):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _payload(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+    def do_GET(self):
+        self.server.profile.delay()
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        kind = self.server.kind
+        if kind == 'openweathermap':
+            self._reply(_forecast_response(self.server.profile))
+        elif kind == 'open_meteo':
+            self._reply(_archive_response(query, self.server.profile))
+        elif kind == 'data_gov_in':
+            self._reply(_mandi_response(query, self.server.profile))
+        else:
+            self._reply({"error": "not found"}, 404)
+
+    def do_POST(self):
+        payload = self._payload()
+        self.server.profile.delay()
+        if self.server.kind == 'gemini':
+            self._reply(_gemini_response(payload, self.server.profile))
+        elif self.server.kind == 'vision_api':
+            self._reply(_vision_response(payload))
+        else:
+            self._reply({"error": "not found"}, 404)
+
+
+class FakeUpstreams:
+    """Starts one HTTP server per upstream on a free local port; `env()` points the app at them."""
+
+    KINDS = ('gemini', 'openweathermap', 'open_meteo', 'data_gov_in', 'vision_api')
+
+    def __init__(self, profiles=None):
+        self.profiles = profiles or {}
+        self.servers = {}
+
+    def start(self):
+        for kind in self.KINDS:
+            server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+            server.daemon_threads = True
+            server.kind = kind
+            server.profile = self.profiles.get(kind) or UpstreamProfile()
+            threading.Thread(target=server.serve_forever, daemon=True, name=f"fake_{kind}").start()
+            self.servers[kind] = server
+        return self
+
+    def url(self, kind):
+        host, port = self.servers[kind].server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        return {
+            "GEMINI_API_URL": f"{self.url('gemini')}/v1beta/models/bench:generateContent",
+            "GEMINI_API_KEY": "bench",
+            "OPENWEATHERMAP_API_URL": f"{self.url('openweathermap')}/data/2.5/forecast",
+            "OPENWEATHERMAP_API_KEY": "bench",
+            "OPEN_METEO_ARCHIVE_URL": f"{self.url('open_meteo')}/v1/archive",
+            "DATA_GOV_IN_BASE_URL": f"{self.url('data_gov_in')}/resource",
+            "DATA_GOV_IN_API_KEY": "bench",
+            "DATA_GOV_IN_MIN_REQUEST_INTERVAL": "0",
+            "CROP_API_URL": f"{self.url('vision_api')}/predict",
+            "SOIL_API_URL": f"{self.url('vision_api')}/predict",
+            "INFERENCE_BACKEND": "remote",
+        }
+
+    def stop(self):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
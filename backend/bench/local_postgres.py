@@ -0,0 +1,62 @@
+# local_postgres.py - A throwaway PostgreSQL cluster for benchmark runs
+
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+def _pg_binary(name):
+    """Finds initdb/pg_ctl on PATH, in PG_BIN, or in the usual Debian/Ubuntu install locations."""
+    candidates = [os.path.join(os.environ['PG_BIN'], name)] if os.getenv('PG_BIN') else []
+    found = shutil.which(name)
+    if found:
+        candidates.append(found)
+    lib_root = '/usr/lib/postgresql'
+    if os.path.isdir(lib_root):
+        for version in sorted(os.listdir(lib_root), reverse=True):
+            candidates.append(os.path.join(lib_root, version, 'bin', name))
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    raise RuntimeError(f"Could not find '{name}'. Install PostgreSQL, set PG_BIN, or pass --database-url.")
+
+
+class LocalPostgres:
+    """
+    initdb's a cluster in a temporary directory and runs it on a Unix socket only, so it can't
+    collide with a real server. Everything is deleted on stop().
+    """
+
+    def __init__(self, port=55432):
+        self.port = port
+        self.root = None
+
+    def start(self):
+        self.root = tempfile.mkdtemp(prefix='kisan_bench_pg_')
+        data_dir = os.path.join(self.root, 'data')
+        subprocess.run([_pg_binary('initdb'), '-D', data_dir, '-U', 'bench', '-A', 'trust', '--no-sync'],
+                       check=True, stdout=subprocess.DEVNULL)
+        options = f"-p {self.port} -k {self.root} -c listen_addresses='' -c fsync=off -c synchronous_commit=off"
+        subprocess.run([_pg_binary('pg_ctl'), '-D', data_dir, '-o', options, '-l', os.path.join(self.root, 'server.log'), '-w', 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([_pg_binary('createdb'), '-h', self.root, '-p', str(self.port), '-U', 'bench', 'bench'], check=True)
+        logger.info(f"BENCH: Started disposable PostgreSQL in '{self.root}'.")
+        return self
+
+    @property
+    def url(self):
+        return f"postgresql://bench@/bench?host={self.root}&port={self.port}"
+
+    def stop(self):
+        if not self.root:
+            return
+        try:
+            subprocess.run([_pg_binary('pg_ctl'), '-D', os.path.join(self.root, 'data'), '-m', 'immediate', '-w', 'stop'],
+                           check=False, stdout=subprocess.DEVNULL)
+        finally:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
@@ -0,0 +1,288 @@
+# run_bench.py - Throughput and latency benchmark for the main API endpoints against local stand-ins
+#
+#   cd backend
+#   python -m bench.run_bench                              # compare against bench/baseline.json
+#   python -m bench.run_bench --save-baseline              # record a new baseline
+#   python -m bench.run_bench --concurrency 16 --latency gemini=800,data_gov_in=300
+#   python -m bench.run_bench --cassettes ../cassettes         # replay traffic recorded in production
+#
+# Every upstream is replaced by a local fake server (bench/fake_upstreams.py), or with --cassettes by
+# responses recorded with UPSTREAM_CASSETTE_MODE=record (cassette.py), and the database by a
+# disposable PostgreSQL cluster (bench/local_postgres.py) unless --database-url is given. The exit
+# status is 1 when an endpoint's throughput or p95 regressed by more than --tolerance.
+
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.fake_upstreams import FakeUpstreams, UpstreamProfile
+from bench.local_postgres import LocalPostgres
+
+logger = logging.getLogger('bench')
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+BENCH_LOCATION = {"latitude": 30.90, "longitude": 75.86}   # Ludhiana, Punjab
+CHAT_MESSAGES = [
+    "What is the mandi price of wheat in Ludhiana?",
+    "How should I prepare my field for the rabi season?",
+]
+
+
+class _Client:
+    """
+    One logged-in browser. The session cookie is sent by hand because the app marks it
+    Secure, which requests would otherwise refuse to send over plain http.
+    """
+
+    def __init__(self, base_url, cookie=None):
+        self.base_url = base_url
+        self.cookie = cookie
+        self.http = requests.Session()
+
+    def request(self, method, path, **kwargs):
+        headers = {'Cookie': f"session={self.cookie}"} if self.cookie else {}
+        response = self.http.request(method, self.base_url + path, headers=headers, timeout=120, **kwargs)
+        self.cookie = response.cookies.get('session') or self.cookie
+        return response
+
+
+def _soil_image():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), (120, 90, 60)).save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def _analyze_field(client, i, image):
+    return client.request('POST', '/api/analyze_field', data={**BENCH_LOCATION, "lang": "en", "lastCrop": "Rice"},
+                          files={"image": ("soil.jpg", image, "image/jpeg")})
+
+
+def _mandi_prices(client, i, image):
+    return client.request('POST', '/api/mandi_prices', json={"state": "Punjab", "district": "Ludhiana", "crop": "Wheat", "area": 2})
+
+
+def _dashboard_summary(client, i, image):
+    return client.request('GET', '/api/dashboard_summary', params={"lang": "en"})
+
+
+def _chat(client, i, image):
+    return client.request('POST', '/api/chat_with_drishti', json={"message": CHAT_MESSAGES[i % len(CHAT_MESSAGES)]})
+
+
+SCENARIOS = {
+    "analyze_field": _analyze_field,
+    "mandi_prices": _mandi_prices,
+    "dashboard_summary": _dashboard_summary,
+    "chat_with_drishti": _chat,
+}
+
+
+def _percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def run_scenario(name, clients, total_requests, warmup, image):
+    """Runs `total_requests` calls spread over the clients (one thread each) and summarises them."""
+    scenario = SCENARIOS[name]
+    for i in range(warmup):
+        scenario(clients[i % len(clients)], i, image)
+
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+
+    def worker(client):
+        nonlocal errors
+        for i in counter:   # the shared iterator hands out request numbers until they run out
+            started = time.perf_counter()
+            try:
+                ok = scenario(client, i, image).status_code < 400
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                errors += int(not ok)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        list(executor.map(worker, clients))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda value: round(value * 1000, 1) if value is not None else None
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "p50_ms": ms(_percentile(latencies, 0.50)),
+        "p95_ms": ms(_percentile(latencies, 0.95)),
+        "p99_ms": ms(_percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Lists regressions: throughput down or p95 up by more than `tolerance` (a fraction)."""
+    regressions = []
+    for name, current in results.items():
+        before = (baseline.get("endpoints") or {}).get(name)
+        if not before:
+            continue
+        if before.get("throughput_rps") and current["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {current['throughput_rps']} rps vs baseline {before['throughput_rps']} rps")
+        if before.get("p95_ms") and current["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']} ms vs baseline {before['p95_ms']} ms")
+        if current["errors"] > before.get("errors", 0):
+            regressions.append(f"{name}: {current['errors']} errors vs baseline {before.get('errors', 0)}")
+    return regressions
+
+
+def _parse_overrides(text, cast):
+    overrides = {}
+    for item in filter(None, (text or '').split(',')):
+        kind, _, value = item.partition('=')
+        if kind not in FakeUpstreams.KINDS:
+            raise SystemExit(f"Unknown upstream '{kind}'. Use one of: {', '.join(FakeUpstreams.KINDS)}.")
+        overrides[kind] = cast(value)
+    return overrides
+
+
+def _print_table(results):
+    print(f"\n{'endpoint':<20}{'reqs':>7}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, row in results.items():
+        print(f"{name:<20}{row['requests']:>7}{row['errors']:>8}{row['throughput_rps']:>9}{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the main API endpoints against local stand-ins for every upstream.")
+    parser.add_argument('--endpoints', default=','.join(SCENARIOS), help="comma-separated subset of: " + ', '.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help="measured requests per endpoint")
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--latency-ms', type=float, default=50.0, help="default latency of every fake upstream")
+    parser.add_argument('--latency', default='', help="per-upstream latency, e.g. gemini=800,data_gov_in=300")
+    parser.add_argument('--payload-scale', default='', help="per-upstream payload multiplier, e.g. data_gov_in=20")
+    parser.add_argument('--cassettes', help="replay upstream responses recorded in this directory instead of the fake upstreams")
+    parser.add_argument('--database-url', help="use this PostgreSQL instead of starting a disposable one")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed regression as a fraction (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s: %(message)s')
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = set(endpoints) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown endpoint(s): {', '.join(sorted(unknown))}.")
+
+    latencies = _parse_overrides(args.latency, float)
+    scales = _parse_overrides(args.payload_scale, int)
+    profiles = {kind: UpstreamProfile(latency_ms=latencies.get(kind, args.latency_ms), jitter_ms=latencies.get(kind, args.latency_ms) * 0.2,
+                                      payload_scale=scales.get(kind, 1)) for kind in FakeUpstreams.KINDS}
+    upstreams = None if args.cassettes else FakeUpstreams(profiles).start()
+    postgres = None if args.database_url else LocalPostgres().start()
+    work_dir = tempfile.mkdtemp(prefix='kisan_bench_')
+    server = None
+    try:
+        # Config is read at import time, so the environment has to be in place before the app is imported.
+        if upstreams is not None:
+            os.environ.update(upstreams.env())
+        else:
+            # Recordings are matched by endpoint, not by exact query, since the benchmark's requests
+            # won't repeat production's. CROP_API_URL/SOIL_API_URL must be the ones used while recording.
+            os.environ.update({
+                "UPSTREAM_CASSETTE_MODE": "replay",
+                "UPSTREAM_CASSETTE_DIR": os.path.abspath(args.cassettes),
+                "UPSTREAM_CASSETTE_MATCH": "path",
+                "DATA_GOV_IN_MIN_REQUEST_INTERVAL": "0",
+            })
+            for name in ("GEMINI_API_KEY", "OPENWEATHERMAP_API_KEY", "DATA_GOV_IN_API_KEY"):
+                os.environ.setdefault(name, "replay")
+        os.environ.update({
+            "DATABASE_URL": args.database_url or postgres.url,
+            "FLASK_SECRET_KEY": "bench",
+            "PRICE_CACHE_DIR": os.path.join(work_dir, 'price_data_cache'),
+            "SHARED_DATA_DIR": os.path.join(work_dir, 'shared_data'),
+            "BATCH_OUTPUT_DIR": os.path.join(work_dir, 'batch_results'),
+            "PRICE_REFRESHER_ENABLED": "false",
+        })
+        from werkzeug.serving import make_server
+        import app as app_module
+
+        server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True, name='bench_app').start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        owner = _Client(base_url)
+        email = f"bench-{uuid.uuid4().hex[:8]}@example.com"
+        registered = owner.request('POST', '/api/register', json={"username": email.split('@')[0], "contact": "9999999999", "email": email, "password": "bench-password"})
+        if registered.status_code >= 400:
+            raise SystemExit(f"Could not register the benchmark user: {registered.text}")
+
+        # One saved report so the dashboard has something to summarise.
+        image = _soil_image()
+        analysis = _analyze_field(owner, 0, image)
+        if analysis.status_code == 200:
+            owner.request('POST', '/api/save_report', json={"report_data": analysis.json()})
+        else:
+            print(f"Warning: seeding a report failed ({analysis.status_code}); dashboard_summary will measure the empty case.")
+
+        clients = [_Client(base_url, owner.cookie) for _ in range(max(1, args.concurrency))]
+        results = {}
+        for name in endpoints:
+            print(f"Running {name} ({args.requests} requests at concurrency {len(clients)})...", flush=True)
+            results[name] = run_scenario(name, clients, args.requests, args.warmup, image)
+    finally:
+        if server is not None:
+            server.shutdown()
+        if upstreams is not None:
+            upstreams.stop()
+        if postgres is not None:
+            postgres.stop()
+
+    _print_table(results)
+    meta = {"concurrency": args.concurrency, "requests": args.requests, "latency_ms": args.latency_ms,
+            "latency": args.latency, "payload_scale": args.payload_scale, "cassettes": args.cassettes, "recorded_at": time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({"meta": meta, "endpoints": results}, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}.")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("\nNo baseline yet; run with --save-baseline to record one.")
+        return 0
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    settings = ('concurrency', 'requests', 'latency_ms', 'latency', 'payload_scale', 'cassettes')
+    if any(baseline.get("meta", {}).get(key) != meta[key] for key in settings):
+        print("\nWarning: the baseline was recorded with different settings; the comparison may not be meaningful.")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nRegressions against the baseline:")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print(f"\nNo regressions beyond {args.tolerance:.0%} of the baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+# cassette.py - Opt-in recording and replay of upstream HTTP traffic
+#
+# UPSTREAM_CASSETTE_MODE=record appends every upstream request/response pair, with API keys
+# scrubbed, to UPSTREAM_CASSETTE_DIR/<upstream>.<pid>.jsonl. UPSTREAM_CASSETTE_MODE=replay
+# answers from those files instead of the network, waiting the recorded time scaled by
+# UPSTREAM_CASSETTE_TIME_SCALE, so production slowdowns can be reproduced and profiled offline.
+
+import base64
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import metrics
+from config import (
+    UPSTREAM_CASSETTE_MODE, UPSTREAM_CASSETTE_DIR, UPSTREAM_CASSETTE_TIME_SCALE, UPSTREAM_CASSETTE_MATCH,
+    DATA_GOV_IN_API_KEY, OPENWEATHERMAP_API_KEY, GEMINI_API_KEY
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_PARAMS = {'api-key', 'api_key', 'apikey', 'appid', 'key', 'token'}
+REDACTED = 'REDACTED'
+_MAX_STORED_REQUEST_BYTES = 64 * 1024   # larger bodies (image uploads) are kept as a hash only
+_KEPT_RESPONSE_HEADERS = ('Content-Type', 'Content-Encoding')
+
+_SECRETS = [secret for secret in (DATA_GOV_IN_API_KEY, OPENWEATHERMAP_API_KEY, GEMINI_API_KEY) if secret]
+_WRITE_LOCK = threading.Lock()
+_FILES = {}
+_INDEX = None            # (exact key -> [records], path key -> [records]), loaded on first replay
+_INDEX_LOCK = threading.Lock()
+_CURSORS = {}            # key -> next record to hand out, so repeated calls cycle through recordings
+
+
+def _scrub_text(text):
+    for secret in _SECRETS:
+        text = text.replace(secret, REDACTED)
+    return text
+
+
+def scrub_url(url):
+    """The URL with credential query parameters redacted."""
+    parts = urlsplit(url)
+    query = [(name, REDACTED if name.lower() in SECRET_PARAMS else value) for name, value in parse_qsl(parts.query, keep_blank_values=True)]
+    return _scrub_text(urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), parts.fragment)))
+
+
+def _body_bytes(body):
+    if body is None:
+        return b''
+    return body.encode('utf-8') if isinstance(body, str) else bytes(body)
+
+
+def _keys(method, url, body):
+    """(exact key, path key): the exact key also covers query and body; the path key only method, host and path."""
+    scrubbed = scrub_url(url)
+    parts = urlsplit(scrubbed)
+    body_digest = hashlib.sha1(_scrub_text(_body_bytes(body).decode('utf-8', 'replace')).encode('utf-8')).hexdigest()
+    exact = hashlib.sha1(f"{method} {scrubbed} {body_digest}".encode('utf-8')).hexdigest()
+    return exact, f"{method} {parts.netloc}{parts.path}"
+
+
+# --- Recording ---
+
+def _cassette_file(upstream):
+    handle = _FILES.get(upstream)
+    if handle is None:
+        os.makedirs(UPSTREAM_CASSETTE_DIR, exist_ok=True)
+        safe_name = ''.join(ch if ch.isalnum() or ch in '-_' else '_' for ch in upstream)
+        handle = _FILES[upstream] = open(os.path.join(UPSTREAM_CASSETTE_DIR, f"{safe_name}.{os.getpid()}.jsonl"), 'a', encoding='utf-8')
+    return handle
+
+
+def record(request, response, elapsed):
+    """Appends one scrubbed interaction. Never raises; a failed write only costs the recording."""
+    record_exchange(request, response.status_code, response.reason, response.headers, response.content, elapsed)
+
+
+def record_exchange(request, status, reason, headers, content, elapsed):
+    """record() for a response that isn't a requests.Response, e.g. one read through aiohttp."""
+    try:
+        exact, path_key = _keys(request.method, request.url, request.body)
+        body = _body_bytes(request.body)
+        try:
+            response_body = {"text": _scrub_text(content.decode('utf-8'))}
+        except UnicodeDecodeError:
+            response_body = {"base64": base64.b64encode(content).decode('ascii')}
+        entry = {
+            "key": exact,
+            "path_key": path_key,
+            "method": request.method,
+            "url": scrub_url(request.url),
+            "request_body": _scrub_text(body.decode('utf-8', 'replace')) if len(body) <= _MAX_STORED_REQUEST_BYTES else None,
+            "request_bytes": len(body),
+            "status": status,
+            "reason": reason,
+            "headers": {name: headers[name] for name in _KEPT_RESPONSE_HEADERS if name in headers},
+            "elapsed": round(elapsed, 4),
+            "recorded_at": time.time(),
+            **response_body,
+        }
+        line = json.dumps(entry, ensure_ascii=False)
+        with _WRITE_LOCK:
+            handle = _cassette_file(metrics.upstream_name(request.url))
+            handle.write(line + '\n')
+            handle.flush()
+    except Exception as e:
+        logger.error(f"CASSETTE: Could not record {scrub_url(request.url)}: {e}")
+
+
+# --- Replay ---
+
+def _load_index():
+    global _INDEX
+    if _INDEX is not None:
+        return _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            by_key, by_path, count = {}, {}, 0
+            for path in sorted(glob.glob(os.path.join(UPSTREAM_CASSETTE_DIR, '*.jsonl'))):
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue  # a line cut short by a crash while recording
+                        by_key.setdefault(entry["key"], []).append(entry)
+                        by_path.setdefault(entry["path_key"], []).append(entry)
+                        count += 1
+            logger.info(f"CASSETTE: Loaded {count} recorded interaction(s) from '{UPSTREAM_CASSETTE_DIR}'.")
+            _INDEX = (by_key, by_path)
+    return _INDEX
+
+
+def _next_entry(key, entries):
+    with _INDEX_LOCK:
+        position = _CURSORS.get(key, 0)
+        _CURSORS[key] = position + 1
+    return entries[position % len(entries)]
+
+
+def lookup(request):
+    """The recorded interaction that answers a prepared request; raises requests.ConnectionError if there is none."""
+    by_key, by_path = _load_index()
+    exact, path_key = _keys(request.method, request.url, request.body)
+    entries = by_key.get(exact)
+    key = exact
+    if not entries and UPSTREAM_CASSETTE_MATCH == 'path':
+        entries, key = by_path.get(path_key), path_key
+    if not entries:
+        raise requests.ConnectionError(f"No recorded response for {request.method} {scrub_url(request.url)}", request=request)
+    return _next_entry(key, entries)
+
+
+def replay_delay(entry):
+    """Seconds to wait before delivering a replayed interaction."""
+    return entry.get("elapsed", 0) * UPSTREAM_CASSETTE_TIME_SCALE if UPSTREAM_CASSETTE_TIME_SCALE > 0 else 0.0
+
+
+def replay(request):
+    """A Response rebuilt from the cassette store, delivered after the recorded delay."""
+    entry = lookup(request)
+    time.sleep(replay_delay(entry))
+    return to_response(entry, request)
+
+
+def to_response(entry, request):
+    """A requests.Response carrying a recorded interaction."""
+    response = requests.Response()
+    response.status_code = entry["status"]
+    response.reason = entry.get("reason")
+    response.headers = CaseInsensitiveDict(entry.get("headers") or {})
+    response._content = entry["text"].encode('utf-8') if "text" in entry else base64.b64decode(entry.get("base64", ""))
+    response._content_consumed = True
+    response.encoding = 'utf-8' if "text" in entry else None
+    response.url = request.url
+    response.request = request
+    return response
+
+
+class CassetteSession(metrics.InstrumentedSession):
+    """The upstream session used by the service layer: instrumented, and recording or replaying when enabled."""
+
+    def send(self, request, **kwargs):
+        if UPSTREAM_CASSETTE_MODE == 'replay':
+            return replay(request)
+        if UPSTREAM_CASSETTE_MODE != 'record':
+            return super().send(request, **kwargs)
+        started = time.perf_counter()
+        response = super().send(request, **kwargs)
+        response.content   # reads a streamed body now, so the timing and the recording are complete
+        record(request, response, time.perf_counter() - started)
+        return response
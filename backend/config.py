@@ -2,6 +2,7 @@
 
 import os
 import json
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,13 +16,21 @@ DATA_GOV_IN_API_KEY = os.getenv('DATA_GOV_IN_API_KEY')
 OPENWEATHERMAP_API_KEY = os.getenv('OPENWEATHERMAP_API_KEY')
 LOCAL_AI_API_URL = os.getenv('LOCAL_AI_API_URL')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+GEMINI_API_URL = os.getenv('GEMINI_API_URL', "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent")
+
+# --- Upstream Endpoints ---
+# Overridable so benchmarks and tests can point the app at local stand-ins.
+OPENWEATHERMAP_API_URL = os.getenv('OPENWEATHERMAP_API_URL', 'https://api.openweathermap.org/data/2.5/forecast')
+OPEN_METEO_ARCHIVE_URL = os.getenv('OPEN_METEO_ARCHIVE_URL', 'https://archive-api.open-meteo.com/v1/archive')
+DATA_GOV_IN_BASE_URL = os.getenv('DATA_GOV_IN_BASE_URL', 'https://api.data.gov.in/resource')
 
 # --- Database Config ---
 MYSQL_HOST = os.getenv('MYSQL_HOST', 'localhost')
 MYSQL_USER = os.getenv('MYSQL_USER', 'root')
 MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD', '')
 MYSQL_DB = os.getenv('MYSQL_DB', 'kisan_drishti_db')
+DB_POOL_MAX_CONNECTIONS = int(os.getenv('DB_POOL_MAX_CONNECTIONS', '20'))  # per worker process, shared by all its threads
+DB_POOL_WAIT_SECONDS = float(os.getenv('DB_POOL_WAIT_SECONDS', '10'))  # how long a caller waits for a free connection
 
 # --- ML Model Paths (from .env) ---
 PLANT_HEALTH_MODEL_PATH = os.getenv('PLANT_HEALTH_MODEL_PATH')
@@ -37,6 +46,98 @@ ICRISAT_DATA_PATH = os.getenv('ICRISAT_DATA_PATH', 'data/icrisat_data.csv')
 FARM_HARVEST_PRICE_DATA_PATH = os.getenv('FARM_HARVEST_PRICE_DATA_PATH', 'data/FarmHarvestPrice.csv')
 RAINFALL_DATA_PATH = os.getenv('RAINFALL_DATA_PATH', 'data/Rainfall_data_Monthly.csv')
 MANDI_PRICE_DATA_PATH = os.getenv('MANDI_PRICE_DATA_PATH')
+DISTRICT_CENTROIDS_PATH = os.getenv('DISTRICT_CENTROIDS_PATH', 'data/district_centroids.csv')
+
+# --- GPS Resolution ---
+GPS_MAX_DISTANCE_KM = float(os.getenv('GPS_MAX_DISTANCE_KM', '150'))
+
+# --- data.gov.in Mandi Feed ---
+DATA_GOV_IN_RESOURCE_ID = os.getenv('DATA_GOV_IN_RESOURCE_ID', '9ef84268-d588-465a-a308-a864a43d0070')
+DATA_GOV_IN_PAGE_SIZE = int(os.getenv('DATA_GOV_IN_PAGE_SIZE', '1000'))
+DATA_GOV_IN_MAX_WORKERS = int(os.getenv('DATA_GOV_IN_MAX_WORKERS', '4'))
+DATA_GOV_IN_MIN_REQUEST_INTERVAL = float(os.getenv('DATA_GOV_IN_MIN_REQUEST_INTERVAL', '0.5'))
+
+# --- Rolling Mandi Price Store ---
+PRICE_CACHE_DIR = os.getenv('PRICE_CACHE_DIR', 'price_data_cache')
+PRICE_HISTORY_DAYS = int(os.getenv('PRICE_HISTORY_DAYS', '7'))
+PRICE_AVERAGE_WINDOW_DAYS = int(os.getenv('PRICE_AVERAGE_WINDOW_DAYS', '3'))
+PRICE_REFRESH_INTERVAL_HOURS = float(os.getenv('PRICE_REFRESH_INTERVAL_HOURS', '6'))
+PRICE_REFRESHER_ENABLED = os.getenv('PRICE_REFRESHER_ENABLED', 'true').lower() == 'true'
+REFRESHER_LOCK_PATH = os.getenv('REFRESHER_LOCK_PATH', os.path.join(PRICE_CACHE_DIR, 'refresher.lock'))
+REFRESHER_HEARTBEAT_SECONDS = float(os.getenv('REFRESHER_HEARTBEAT_SECONDS', '30'))
+REFRESHER_ELECTION_RETRY_SECONDS = float(os.getenv('REFRESHER_ELECTION_RETRY_SECONDS', '60'))
+REFRESH_MIN_INTERVAL_MINUTES = float(os.getenv('REFRESH_MIN_INTERVAL_MINUTES', '60'))
+REFRESH_MAX_INTERVAL_HOURS = float(os.getenv('REFRESH_MAX_INTERVAL_HOURS', '24'))
+REFRESH_DEMAND_REFERENCE = float(os.getenv('REFRESH_DEMAND_REFERENCE', '10'))  # recent lookups that earn the base interval
+REFRESH_DEMAND_HALF_LIFE_HOURS = float(os.getenv('REFRESH_DEMAND_HALF_LIFE_HOURS', '24'))
+
+# --- Stale-While-Revalidate Caches ---
+# Past its TTL an entry is still served (flagged is_stale) for the grace period while one background refresh runs.
+SWR_REFRESH_WORKERS = int(os.getenv('SWR_REFRESH_WORKERS', '4'))
+SWR_RETRY_SECONDS = float(os.getenv('SWR_RETRY_SECONDS', '60'))  # back-off after a failed background refresh
+SWR_MAX_ENTRIES = int(os.getenv('SWR_MAX_ENTRIES', '4096'))
+PRICE_STALE_AFTER_HOURS = float(os.getenv('PRICE_STALE_AFTER_HOURS', '12'))
+PRICE_STALE_GRACE_HOURS = float(os.getenv('PRICE_STALE_GRACE_HOURS', '48'))
+FORECAST_CACHE_TTL_SECONDS = int(os.getenv('FORECAST_CACHE_TTL_SECONDS', '7200'))
+FORECAST_STALE_GRACE_SECONDS = int(os.getenv('FORECAST_STALE_GRACE_SECONDS', '21600'))
+HISTORICAL_WEATHER_TTL_HOURS = float(os.getenv('HISTORICAL_WEATHER_TTL_HOURS', '24'))
+HISTORICAL_WEATHER_STALE_GRACE_HOURS = float(os.getenv('HISTORICAL_WEATHER_STALE_GRACE_HOURS', '168'))
+
+# --- Chat Conversation Store ---
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv('CHAT_HISTORY_TOKEN_BUDGET', '1500'))
+CHAT_SUMMARY_MAX_CHARS = int(os.getenv('CHAT_SUMMARY_MAX_CHARS', '1200'))
+CHAT_MAX_MESSAGE_CHARS = int(os.getenv('CHAT_MAX_MESSAGE_CHARS', '2000'))
+CHAT_MAX_PAYLOAD_CHARS = int(os.getenv('CHAT_MAX_PAYLOAD_CHARS', '24000'))
+
+# --- Chat Tool Execution ---
+CHAT_MAX_TOOL_ROUNDS = int(os.getenv('CHAT_MAX_TOOL_ROUNDS', '2'))
+CHAT_TOOL_TIMEOUT_SECONDS = float(os.getenv('CHAT_TOOL_TIMEOUT_SECONDS', '20'))
+CHAT_TOOL_MAX_WORKERS = int(os.getenv('CHAT_TOOL_MAX_WORKERS', '8'))
+
+# --- Chat Intent Fast Path ---
+CHAT_FAST_PATH_ENABLED = os.getenv('CHAT_FAST_PATH_ENABLED', 'true').lower() == 'true'
+INTENT_MIN_CONFIDENCE = float(os.getenv('INTENT_MIN_CONFIDENCE', '0.9'))
+
+# --- Chat Tool Result Cache ---
+TOOL_RESULT_CACHE_TTL_SECONDS = int(os.getenv('TOOL_RESULT_CACHE_TTL_SECONDS', '600'))
+TOOL_RESULT_CACHE_MAX_ENTRIES = int(os.getenv('TOOL_RESULT_CACHE_MAX_ENTRIES', '2048'))
+
+# --- Report Export ---
+REPORT_EXPORT_ITERSIZE = int(os.getenv('REPORT_EXPORT_ITERSIZE', '500'))  # rows per server-side cursor fetch
+REPORT_EXPORT_CHUNK_BYTES = int(os.getenv('REPORT_EXPORT_CHUNK_BYTES', '65536'))
+
+# --- Bulk Report Sync ---
+REPORT_SYNC_MAX_BATCH = int(os.getenv('REPORT_SYNC_MAX_BATCH', '500'))
+
+# --- Batch Field Analysis ---
+BATCH_OUTPUT_DIR = os.getenv('BATCH_OUTPUT_DIR', 'batch_results')
+BATCH_MAX_PLOTS = int(os.getenv('BATCH_MAX_PLOTS', '5000'))
+BATCH_CLIMATE_GRID_DEG = float(os.getenv('BATCH_CLIMATE_GRID_DEG', '0.25'))  # plots in one cell share a climate fetch
+BATCH_CLIMATE_WORKERS = int(os.getenv('BATCH_CLIMATE_WORKERS', '8'))
+BATCH_VISION_WORKERS = int(os.getenv('BATCH_VISION_WORKERS', '4'))
+BATCH_PROCESS_WORKERS = int(os.getenv('BATCH_PROCESS_WORKERS', '0')) or (os.cpu_count() or 1)
+BATCH_SCORE_CHUNK_SIZE = int(os.getenv('BATCH_SCORE_CHUNK_SIZE', '1000'))
+BATCH_JOB_RETENTION_HOURS = float(os.getenv('BATCH_JOB_RETENTION_HOURS', '24'))
+BATCH_JOB_HEARTBEAT_SECONDS = float(os.getenv('BATCH_JOB_HEARTBEAT_SECONDS', '15'))  # a running job missing 4 beats is failed
+
+# --- Local Model Inference ---
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'auto').lower()  # 'auto' (local, then remote), 'local' or 'remote'
+PLANT_HEALTH_ONNX_PATH = os.getenv('PLANT_HEALTH_ONNX_PATH')  # defaults to PLANT_HEALTH_MODEL_PATH with an .onnx suffix
+SOIL_TYPE_ONNX_PATH = os.getenv('SOIL_TYPE_ONNX_PATH')
+INFERENCE_IMAGE_SIZE = int(os.getenv('INFERENCE_IMAGE_SIZE', '224'))
+INFERENCE_INTRA_OP_THREADS = int(os.getenv('INFERENCE_INTRA_OP_THREADS', '2'))
+INFERENCE_MAX_BATCH = int(os.getenv('INFERENCE_MAX_BATCH', '16'))
+INFERENCE_BATCH_WAIT_MS = float(os.getenv('INFERENCE_BATCH_WAIT_MS', '10'))
+INFERENCE_TIMEOUT_SECONDS = float(os.getenv('INFERENCE_TIMEOUT_SECONDS', '30'))
+
+# --- Multi-Image Analysis ---
+MAX_IMAGES_PER_REQUEST = int(os.getenv('MAX_IMAGES_PER_REQUEST', '24'))
+IMAGE_PREPROCESS_WORKERS = int(os.getenv('IMAGE_PREPROCESS_WORKERS', '4'))
+VISION_UPLOAD_MAX_SIDE = int(os.getenv('VISION_UPLOAD_MAX_SIDE', '512'))  # images are downscaled before upload
+VISION_API_BATCHING = os.getenv('VISION_API_BATCHING', 'false').lower() == 'true'  # endpoint accepts list inputs
+
+# --- Shared Worker Data ---
+SHARED_DATA_DIR = os.getenv('SHARED_DATA_DIR', 'shared_data')  # memory-mapped .npy files shared by all workers
 
 def load_labels(path):
     if not path or not os.path.exists(path): return {}
@@ -48,4 +149,42 @@ def load_labels(path):
         return {}
 
 PLANT_HEALTH_CLASS_LABELS = load_labels(PLANT_HEALTH_LABELS_PATH)
-SOIL_TYPE_CLASS_LABELS = load_labels(SOIL_TYPE_LABELS_PATH)
\ No newline at end of file
+SOIL_TYPE_CLASS_LABELS = load_labels(SOIL_TYPE_LABELS_PATH)
+
+# --- Upstream Cassettes ---
+UPSTREAM_CASSETTE_MODE = os.getenv('UPSTREAM_CASSETTE_MODE', 'off').lower()  # 'off', 'record' or 'replay'
+UPSTREAM_CASSETTE_DIR = os.getenv('UPSTREAM_CASSETTE_DIR', 'cassettes')
+UPSTREAM_CASSETTE_TIME_SCALE = float(os.getenv('UPSTREAM_CASSETTE_TIME_SCALE', '1.0'))  # 0 replays without the recorded delays
+UPSTREAM_CASSETTE_MATCH = os.getenv('UPSTREAM_CASSETTE_MATCH', 'exact').lower()  # 'path' falls back to any recording of the same endpoint
+
+# --- Metrics ---
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # lets a Prometheus scraper read /api/admin/metrics without an admin session
+# Outbound hosts (host[:port]) reported under a service name; any other host is labelled as itself.
+UPSTREAM_NAMES = {
+    urlsplit(url).netloc: name
+    for name, url in (
+        ('vision_api', LOCAL_AI_API_URL), ('vision_api', os.getenv('CROP_API_URL')), ('vision_api', os.getenv('SOIL_API_URL')),
+        ('gemini', GEMINI_API_URL), ('openweathermap', OPENWEATHERMAP_API_URL),
+        ('open_meteo', OPEN_METEO_ARCHIVE_URL), ('data_gov_in', DATA_GOV_IN_BASE_URL),
+    )
+    if url
+}
+
+# --- Request Profiling ---
+# Admins (or anyone sending X-Profile-Token) can profile one request with "X-Profile: deterministic|sampling".
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))  # oldest profiles are deleted beyond this
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5'))
+# Background sampling of live traffic: the fraction of requests to PROFILE_ROUTES profiled, optionally only for some users.
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_SAMPLE_MODE = os.getenv('PROFILE_SAMPLE_MODE', 'sampling').lower()
+PROFILE_ROUTES = [route.strip() for route in os.getenv('PROFILE_ROUTES', '/api/dashboard_summary,/api/analyze_field').split(',') if route.strip()]
+PROFILE_USER_IDS = {user_id.strip() for user_id in os.getenv('PROFILE_USER_IDS', '').split(',') if user_id.strip()}
+
+# --- Async I/O (asgi.py) ---
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv('ASYNC_HTTP_MAX_CONNECTIONS', '500'))  # upstream sockets one ASGI worker may hold open
+ASYNC_HTTP_MAX_PER_HOST = int(os.getenv('ASYNC_HTTP_MAX_PER_HOST', '100'))
+ASYNC_BLOCKING_THREADS = int(os.getenv('ASYNC_BLOCKING_THREADS', '32'))  # database, local models and file I/O called from async views
+ASYNC_WSGI_THREADS = int(os.getenv('ASYNC_WSGI_THREADS', '8'))  # threads serving the remaining Flask routes under asgi.py
@@ -0,0 +1,101 @@
+# conversation_store.py - Server-side chat history with a token-budgeted window
+
+import json
+import logging
+import re
+import secrets
+
+import database
+from config import CHAT_HISTORY_TOKEN_BUDGET, CHAT_SUMMARY_MAX_CHARS, CHAT_MAX_PAYLOAD_CHARS
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END = re.compile(r'(?<=[.!?।])\s+')
+_SUMMARY_LINE_CHARS = 200
+
+
+def new_session_key():
+    return secrets.token_urlsafe(16)
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token) - close enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+def _as_text(content):
+    return content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+
+
+def load(user_id, session_key):
+    """Returns the stored conversation as {'summary': str, 'turns': [{'role', 'content'}]}."""
+    conversation = database.get_chat_conversation(user_id, session_key) if session_key else None
+    if not conversation:
+        return {"summary": "", "turns": []}
+    return {"summary": conversation.get("summary") or "", "turns": list(conversation.get("turns") or [])}
+
+
+def reset(user_id, session_key):
+    if session_key:
+        database.delete_chat_conversation(user_id, session_key)
+
+
+def _summary_line(turn):
+    """Extractive summary of one turn: its first sentence, trimmed."""
+    text = " ".join(_as_text(turn.get("content", "")).split())
+    first_sentence = _SENTENCE_END.split(text, maxsplit=1)[0]
+    if len(first_sentence) > _SUMMARY_LINE_CHARS:
+        first_sentence = first_sentence[:_SUMMARY_LINE_CHARS].rstrip() + "..."
+    speaker = "Farmer" if turn.get("role") == "user" else "Drishti"
+    return f"{speaker}: {first_sentence}"
+
+
+def _compact(conversation):
+    """Folds the oldest turns into the rolling summary until the rest fit the token budget."""
+    turns = conversation["turns"]
+    summary_lines = [line for line in conversation["summary"].split("\n") if line]
+
+    total_tokens = sum(estimate_tokens(turn["content"]) for turn in turns)
+    # Always keep the latest exchange verbatim, however long it is.
+    while total_tokens > CHAT_HISTORY_TOKEN_BUDGET and len(turns) > 2:
+        oldest = turns.pop(0)
+        total_tokens -= estimate_tokens(oldest["content"])
+        summary_lines.append(_summary_line(oldest))
+
+    # The summary itself is bounded; the oldest points drop off first.
+    while summary_lines and sum(len(line) + 1 for line in summary_lines) > CHAT_SUMMARY_MAX_CHARS:
+        summary_lines.pop(0)
+    conversation["summary"] = "\n".join(summary_lines)
+
+
+def record_exchange(user_id, session_key, conversation, user_message, reply_content):
+    """Appends one user/assistant exchange, compacts the history and persists it."""
+    conversation["turns"].append({"role": "user", "content": _as_text(user_message)})
+    conversation["turns"].append({"role": "assistant", "content": _as_text(reply_content)})
+    _compact(conversation)
+    if session_key:
+        database.save_chat_conversation(user_id, session_key, conversation["summary"], conversation["turns"])
+    return conversation
+
+
+def request_window(conversation, user_message, reserved_chars=0):
+    """
+    Returns (summary, turns) to send upstream with the next message. The newest turns
+    are kept and older ones dropped until the request fits CHAT_MAX_PAYLOAD_CHARS.
+    """
+    summary = conversation["summary"]
+    budget = CHAT_MAX_PAYLOAD_CHARS - reserved_chars - len(user_message) - len(summary)
+    if budget < 0:
+        summary, budget = "", CHAT_MAX_PAYLOAD_CHARS - reserved_chars - len(user_message)
+
+    window = []
+    for turn in reversed(conversation["turns"]):
+        budget -= len(turn["content"])
+        if budget < 0:
+            break
+        window.append(turn)
+    window.reverse()
+
+    if len(window) < len(conversation["turns"]):
+        logger.info(f"CHAT: Trimmed {len(conversation['turns']) - len(window)} turn(s) to fit the request size cap.")
+    return summary, window
@@ -3,16 +3,76 @@
 import os
 import psycopg2
 from psycopg2 import pool
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, execute_values
 import bcrypt
 import logging
 import datetime
 import json
+import sys
+import threading
+import time
+
+import metrics
+from config import DB_POOL_MAX_CONNECTIONS, DB_POOL_WAIT_SECONDS
 
 DATABASE_URL = os.getenv('DATABASE_URL')
 logger = logging.getLogger(__name__)
 
 pg_pool = None
+# One slot per pooled connection: callers beyond the pool size wait here instead of getting a PoolError.
+_POOL_SLOTS = threading.BoundedSemaphore(DB_POOL_MAX_CONNECTIONS)
+
+# Stored generated columns on field_reports, derived from the report_data document.
+REPORT_SUMMARY_FIELDS = {
+    "top_crop": "report_data->'recommendations'->'recommended_crops'->>0",
+    "state": "report_data->'location'->>'state'",
+    "district": "report_data->'location'->>'district'",
+    "soil_type": "report_data->'soil_analysis'->>'prediction'",
+    "lang": "report_data->>'lang'",
+}
+REPORT_SUMMARY_COLUMNS = (
+    "id, latitude, longitude, saved_at, top_crop, state, district, soil_type, lang, "
+    "report_data->'recommendations'->'recommended_crops' AS recommended_crops"
+)
+
+_TIMED_CURSORS = {}
+_POOL_EXHAUSTED = metrics.counter('db_pool_exhausted_total', 'Connection requests refused because the pool was empty.', ())
+
+def _caller_name():
+    """Name of the function that ran a statement, skipping psycopg2 helpers such as execute_values."""
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_globals.get('__name__', '').startswith('psycopg2'):
+        frame = frame.f_back
+    return frame.f_code.co_name if frame is not None else 'unknown'
+
+def _timed_cursor_class(base):
+    """A subclass of a cursor class whose execute() reports its latency to the metrics module."""
+    timed = _TIMED_CURSORS.get(base)
+    if timed is None:
+        def execute(self, query, vars=None):
+            started = time.perf_counter()
+            try:
+                return base.execute(self, query, vars)
+            finally:
+                metrics.DB_LATENCY.observe(time.perf_counter() - started, _caller_name())
+        timed = _TIMED_CURSORS[base] = type(f"Timed{base.__name__}", (base,), {'execute': execute})
+    return timed
+
+class _TimedConnection(psycopg2.extensions.connection):
+    """Hands out timed cursors, including when a caller asks for a DictCursor."""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+def _pool_metrics():
+    if pg_pool is None:
+        return []
+    counts = {(('state', 'in_use'),): len(pg_pool._used), (('state', 'idle'),): len(pg_pool._pool), (('state', 'max'),): pg_pool.maxconn}
+    return [('db_pool_connections', "Connections in this worker's PostgreSQL pool.", counts)]
+
+metrics.register_collector(_pool_metrics)
 
 def init_connection_pool():
     global pg_pool
@@ -20,20 +80,44 @@ def init_connection_pool():
         logger.critical("DATABASE_URL environment variable not set. Application cannot start.")
         return
     try:
-        pg_pool = psycopg2.pool.SimpleConnectionPool(1, 5, dsn=DATABASE_URL)
+        # Request threads, the async blocking pool and background refreshers all share this pool.
+        pg_pool = psycopg2.pool.ThreadedConnectionPool(1, DB_POOL_MAX_CONNECTIONS, dsn=DATABASE_URL, connection_factory=_TimedConnection)
         logger.info("PostgreSQL connection pool created successfully.")
     except Exception as e:
         logger.error(f"Error creating PostgreSQL pool: {e}")
 
+def close_connection_pool():
+    global pg_pool
+    if pg_pool:
+        pg_pool.closeall()
+        pg_pool = None
+        logger.info("PostgreSQL connection pool closed.")
+
 def get_db_connection():
     if not pg_pool:
         logger.error("Database pool is not initialized.")
         return None
-    return pg_pool.getconn()
+    if not _POOL_SLOTS.acquire(timeout=DB_POOL_WAIT_SECONDS):
+        _POOL_EXHAUSTED.inc()
+        logger.error(f"Could not get a database connection: none freed up within {DB_POOL_WAIT_SECONDS}s.")
+        return None
+    try:
+        return pg_pool.getconn()
+    except pool.PoolError as e:
+        _POOL_SLOTS.release()
+        _POOL_EXHAUSTED.inc()
+        logger.error(f"Could not get a database connection: {e}")
+        return None
+    except Exception:
+        _POOL_SLOTS.release()
+        raise
 
 def release_db_connection(conn):
     if pg_pool and conn:
-        pg_pool.putconn(conn)
+        try:
+            pg_pool.putconn(conn)
+        finally:
+            _POOL_SLOTS.release()
 
 def create_tables():
     conn = None
@@ -65,6 +149,29 @@ def create_tables():
                     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
                 );
             """)
+            # Summary fields are generated from report_data on write so hot paths never decode the document.
+            for column, expression in REPORT_SUMMARY_FIELDS.items():
+                cursor.execute(f"ALTER TABLE field_reports ADD COLUMN IF NOT EXISTS {column} TEXT GENERATED ALWAYS AS ({expression}) STORED;")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_field_reports_user_saved ON field_reports (user_id, saved_at DESC);")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_field_reports_saved ON field_reports (saved_at DESC);")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_field_reports_location ON field_reports (state, district);")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_field_reports_top_crop ON field_reports (top_crop);")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_field_reports_soil_type ON field_reports (soil_type);")
+            # Client-supplied key that makes offline report syncs safe to retry.
+            cursor.execute("ALTER TABLE field_reports ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(128);")
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_field_reports_idempotency ON field_reports (user_id, idempotency_key);")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS chat_conversations (
+                    id SERIAL PRIMARY KEY,
+                    user_id INT NOT NULL,
+                    session_key VARCHAR(64) NOT NULL,
+                    summary TEXT NOT NULL DEFAULT '',
+                    turns JSONB NOT NULL DEFAULT '[]',
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (user_id, session_key),
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                );
+            """)
         conn.commit()
         logger.info("Database tables checked/created successfully for PostgreSQL.")
     except Exception as e:
@@ -137,6 +244,41 @@ def save_report_to_db(user_id, latitude, longitude, report_data_json):
         if conn:
             release_db_connection(conn)
 
+def save_reports_bulk(user_id, reports):
+    """
+    Inserts many reports in one statement and one transaction. `reports` is a list of
+    (idempotency_key, latitude, longitude, report_data_json). Returns ({key: (report_id, created)}, status).
+    Keys that were already synced come back with their existing report ID and created=False.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            sql = """
+                INSERT INTO field_reports (user_id, idempotency_key, latitude, longitude, report_data) VALUES %s
+                ON CONFLICT (user_id, idempotency_key) DO NOTHING
+                RETURNING idempotency_key, id
+            """
+            rows = [(user_id, key, latitude, longitude, report_json) for key, latitude, longitude, report_json in reports]
+            created = dict(execute_values(cursor, sql, rows, page_size=len(rows) or 1, fetch=True))
+            results = {key: (report_id, True) for key, report_id in created.items()}
+
+            existing_keys = [key for key, _, _, _ in reports if key not in created]
+            if existing_keys:
+                cursor.execute("SELECT idempotency_key, id FROM field_reports WHERE user_id = %s AND idempotency_key = ANY(%s)", (user_id, existing_keys))
+                results.update({key: (report_id, False) for key, report_id in cursor.fetchall()})
+        conn.commit()
+        logger.info(f"Bulk sync for user {user_id}: {len(created)} created, {len(reports) - len(created)} already present.")
+        return results, 200
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        logger.error(f"Error bulk saving reports to PostgreSQL: {e}")
+        return None, 500
+    finally:
+        if conn:
+            release_db_connection(conn)
+
 def get_user_reports(user_id):
     conn = None
     try:
@@ -159,7 +301,7 @@ def get_latest_user_report(user_id):
     try:
         conn = get_db_connection()
         with conn.cursor(cursor_factory=DictCursor) as cursor:
-            sql = "SELECT report_data, saved_at FROM field_reports WHERE user_id = %s ORDER BY saved_at DESC LIMIT 1"
+            sql = "SELECT id, report_data, saved_at FROM field_reports WHERE user_id = %s ORDER BY saved_at DESC LIMIT 1"
             cursor.execute(sql, (user_id,))
             report = cursor.fetchone()
         return report
@@ -170,6 +312,78 @@ def get_latest_user_report(user_id):
         if conn:
             release_db_connection(conn)
 
+def get_user_report_summaries(user_id, limit=None):
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            sql = "SELECT id, saved_at, top_crop, state, district, soil_type FROM field_reports WHERE user_id = %s ORDER BY saved_at DESC LIMIT %s"
+            cursor.execute(sql, (user_id, limit))
+            return [dict(row) for row in cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Error fetching report summaries: {e}")
+        return []
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def get_latest_report_summary(user_id):
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            sql = f"SELECT {REPORT_SUMMARY_COLUMNS} FROM field_reports WHERE user_id = %s ORDER BY saved_at DESC LIMIT 1"
+            cursor.execute(sql, (user_id,))
+            report = cursor.fetchone()
+        return dict(report) if report else None
+    except Exception as e:
+        logger.error(f"Error fetching latest report summary: {e}")
+        return None
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def get_report_summary_by_id(user_id, report_id):
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            sql = f"SELECT {REPORT_SUMMARY_COLUMNS} FROM field_reports WHERE user_id = %s AND id = %s"
+            cursor.execute(sql, (user_id, report_id))
+            report = cursor.fetchone()
+        return dict(report) if report else None
+    except Exception as e:
+        logger.error(f"Error fetching report summary by ID: {e}")
+        return None
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def iter_user_reports(user_id, columns, itersize=500):
+    """
+    Yields a user's reports oldest first through a server-side (named) cursor, so only
+    `itersize` rows are held in memory at a time. The pooled connection is kept until the
+    generator is exhausted or closed.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Database pool is not initialized.")
+        with conn.cursor(name=f"report_export_{user_id}_{id(conn)}", cursor_factory=DictCursor) as cursor:
+            cursor.itersize = itersize
+            cursor.execute(f"SELECT {columns} FROM field_reports WHERE user_id = %s ORDER BY saved_at, id", (user_id,))
+            for row in cursor:
+                yield row
+    finally:
+        if conn:
+            try:
+                # The export only reads, so end its transaction without committing anything.
+                conn.rollback()
+            except Exception as e:
+                logger.error(f"Error closing report export transaction: {e}")
+            release_db_connection(conn)
+
 def delete_report_from_db(report_id, user_id):
     conn = None
     try:
@@ -270,4 +484,56 @@ def get_username_by_id(user_id):
         return "User"
     finally:
         if conn:
-            release_db_connection(conn)
\ No newline at end of file
+            release_db_connection(conn)
+
+def get_chat_conversation(user_id, session_key):
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=DictCursor) as cursor:
+            sql = "SELECT summary, turns FROM chat_conversations WHERE user_id = %s AND session_key = %s"
+            cursor.execute(sql, (user_id, session_key))
+            conversation = cursor.fetchone()
+        return dict(conversation) if conversation else None
+    except Exception as e:
+        logger.error(f"Error fetching chat conversation: {e}")
+        return None
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def save_chat_conversation(user_id, session_key, summary, turns):
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            sql = """
+                INSERT INTO chat_conversations (user_id, session_key, summary, turns, updated_at)
+                VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (user_id, session_key)
+                DO UPDATE SET summary = EXCLUDED.summary, turns = EXCLUDED.turns, updated_at = CURRENT_TIMESTAMP
+            """
+            cursor.execute(sql, (user_id, session_key, summary, json.dumps(turns)))
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error saving chat conversation: {e}")
+        return False
+    finally:
+        if conn:
+            release_db_connection(conn)
+
+def delete_chat_conversation(user_id, session_key):
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM chat_conversations WHERE user_id = %s AND session_key = %s", (user_id, session_key))
+        conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error deleting chat conversation: {e}")
+        return False
+    finally:
+        if conn:
+            release_db_connection(conn)
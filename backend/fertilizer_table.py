@@ -0,0 +1,115 @@
+# fertilizer_table.py - Precomputed crop x soil/state nutrient-gap table
+
+import logging
+import threading
+
+import numpy as np
+
+import gazetteer
+
+logger = logging.getLogger(__name__)
+
+KG_PER_HA_TO_KG_PER_ACRE = 2.471
+DEFAULT_AVAILABLE_NPK = (60, 45, 45)
+DEFAULT_SOURCE = '__default__'
+
+_CROPS = {}         # crop name or canonical commodity ID -> row
+_CROP_NAMES = []    # row -> crop name as listed in crop_nutrients.csv
+_SOURCES = {}       # ('soil', name) / ('state', NAME) / DEFAULT_SOURCE -> column
+_SOIL_NAMES = []    # soil types in file order, for substring matching
+_GAPS = np.zeros((0, 0, 3), dtype=np.int32)   # [crop, source, (N, P, K)] in kg per acre
+_SOIL_MATCHES = {}  # raw soil label -> soil name or None
+_SOIL_MATCHES_LIMIT = 256   # labels come from batch CSVs and chat tool args, so capped
+_LOCK = threading.Lock()
+
+
+def build(crop_nutrients_df, soil_nutrients_df, state_macro_nutrients):
+    """
+    Precomputes N/P/K gaps for every crop against every soil type and state, so plan
+    lookups are two dictionary hits and one array read.
+    """
+    global _CROPS, _CROP_NAMES, _SOURCES, _SOIL_NAMES, _GAPS
+    if crop_nutrients_df is None or soil_nutrients_df is None:
+        return
+
+    crop_names = list(crop_nutrients_df['crop'])
+    requirements = crop_nutrients_df[['n_req', 'p_req', 'k_req']].to_numpy(dtype=float)
+
+    sources, available = {}, []
+    soil_names = []
+    for soil_type, n, p, k in soil_nutrients_df[['soil_type', 'n_avg', 'p_avg', 'k_avg']].itertuples(index=False):
+        if ('soil', soil_type) not in sources:
+            sources[('soil', soil_type)] = len(available)
+            soil_names.append(soil_type)
+            available.append((n, p, k))
+    for state, nutrients in state_macro_nutrients.items():
+        sources[('state', state.upper())] = len(available)
+        available.append((nutrients['N'], nutrients['P'], nutrients['K']))
+    sources[DEFAULT_SOURCE] = len(available)
+    available.append(DEFAULT_AVAILABLE_NPK)
+
+    gaps = np.rint((requirements[:, None, :] - np.asarray(available, dtype=float)[None, :, :]) / KG_PER_HA_TO_KG_PER_ACRE)
+    gaps = np.maximum(gaps, 0).astype(np.int32)
+
+    crops = {}
+    for row, crop_name in enumerate(crop_names):
+        crops.setdefault(crop_name, row)
+    for row, crop_name in enumerate(crop_names):
+        # Let 'paddy', 'dhan' or 'bajra' find their rows too.
+        crops.setdefault(gazetteer.commodity_key(crop_name), row)
+
+    with _LOCK:
+        _CROPS, _CROP_NAMES, _SOURCES, _SOIL_NAMES, _GAPS = crops, crop_names, sources, soil_names, gaps
+        _SOIL_MATCHES.clear()
+    logger.info(f"FERTILIZER TABLE: Precomputed gaps for {len(crop_names)} crops x {len(available)} soil/state profiles.")
+
+
+def crop_row(crop_name):
+    key = str(crop_name).lower().strip()
+    row = _CROPS.get(key)
+    if row is None:
+        row = _CROPS.get(gazetteer.commodity_key(key))
+    return row
+
+
+def _soil_match(soil_type):
+    """First soil type that contains, or is contained in, the predicted label ('alluvial soil' -> 'alluvial')."""
+    search_soil = str(soil_type).lower().strip()
+    if search_soil in _SOIL_MATCHES:
+        return _SOIL_MATCHES[search_soil]
+    if len(_SOIL_MATCHES) >= _SOIL_MATCHES_LIMIT:
+        _SOIL_MATCHES.clear()
+    match = _SOIL_MATCHES[search_soil] = next((name for name in _SOIL_NAMES if search_soil in name or name in search_soil), None)
+    return match
+
+
+def source_column(soil_type, state):
+    """Returns (column, 'soil' | 'state' | 'default') for a soil label, falling back to the state average."""
+    soil_name = _soil_match(soil_type) if soil_type else None
+    if soil_name is not None:
+        return _SOURCES[('soil', soil_name)], 'soil'
+    column = _SOURCES.get(('state', str(state or '').upper()))
+    if column is not None:
+        return column, 'state'
+    return _SOURCES[DEFAULT_SOURCE], 'state'
+
+
+def lookup(crop_name, soil_type, state):
+    """Returns (n, p, k, source kind) in kg per acre, or None for an unknown crop."""
+    row = crop_row(crop_name)
+    if row is None or not _SOURCES:
+        return None
+    column, source = source_column(soil_type, state)
+    n, p, k = _GAPS[row, column]
+    return int(n), int(p), int(k), source
+
+
+def lookup_many(crop_names, soil_type, state):
+    """Vectorized lookup for several crops on one field. Unknown crops come back as None."""
+    if not _SOURCES:
+        return [None] * len(crop_names)
+    rows = [crop_row(crop_name) for crop_name in crop_names]
+    known = [row for row in rows if row is not None]
+    column, source = source_column(soil_type, state)
+    gaps = iter(_GAPS[known, column].tolist()) if known else iter(())
+    return [None if row is None else (*next(gaps), source) for row in rows]
@@ -0,0 +1,419 @@
+# gazetteer.py - Precomputed, fuzzy name resolution for states, districts and commodities
+
+import logging
+import re
+import threading
+import unicodedata
+from collections import Counter, namedtuple
+
+logger = logging.getLogger(__name__)
+
+Match = namedtuple('Match', ['id', 'name', 'state', 'score'])
+
+# Canonical commodity IDs and the names farmers (and data.gov.in) use for them.
+# IDs follow the crop names used by the recommendation and nutrient datasets.
+COMMODITY_SYNONYMS = {
+    'rice': ['rice', 'paddy', 'dhan', 'chawal', 'chaval'],
+    'wheat': ['wheat', 'gehun', 'gehu', 'gahu'],
+    'maize': ['maize', 'corn', 'makka', 'makki'],
+    'cotton': ['cotton', 'kapas', 'kapas cotton'],
+    'sugarcane': ['sugarcane', 'ganna', 'sugar cane'],
+    'potato': ['potato', 'aloo', 'alu', 'batata'],
+    'onion': ['onion', 'pyaz', 'pyaj', 'kanda'],
+    'tomato': ['tomato', 'tamatar'],
+    'chickpea': ['chickpea', 'chick pea', 'chana', 'gram', 'bengal gram', 'kabuli chana'],
+    'pigeonpeas': ['pigeonpeas', 'pigeon pea', 'arhar', 'tur', 'toor', 'red gram'],
+    'blackgram': ['blackgram', 'black gram', 'urad', 'urd', 'urd beans'],
+    'mungbean': ['mungbean', 'mung bean', 'green gram', 'moong', 'mung'],
+    'lentil': ['lentil', 'masur', 'masoor'],
+    'mothbeans': ['mothbeans', 'moth beans', 'moth', 'matki'],
+    'kidneybeans': ['kidneybeans', 'kidney beans', 'rajma'],
+    'mustard': ['mustard', 'sarson', 'rai'],
+    'soybean': ['soybean', 'soyabean', 'soya bean', 'soya'],
+    'groundnut': ['groundnut', 'ground nut', 'peanut', 'moongphali', 'mungfali'],
+    'sesame': ['sesame', 'sesamum', 'til', 'gingelly'],
+    'bajra': ['bajra', 'pearl millet', 'cumbu'],
+    'jowar': ['jowar', 'sorghum', 'jwar'],
+    'ragi': ['ragi', 'finger millet', 'nachni', 'mandua'],
+    'barley': ['barley', 'jau'],
+    'okra': ['okra', 'bhindi', 'ladies finger'],
+    'brinjal': ['brinjal', 'baingan', 'eggplant'],
+    'muskmelon': ['muskmelon', 'musk melon', 'karbuja', 'kharbuja'],
+    'watermelon': ['watermelon', 'water melon', 'tarbooj', 'tarbuj'],
+    'turmeric': ['turmeric', 'haldi'],
+    'coriander': ['coriander', 'dhaniya', 'dhania', 'dhanya'],
+}
+
+STATE_SYNONYMS = {
+    'odisha': ['orissa'],
+    'nct of delhi': ['delhi', 'new delhi'],
+    'uttrakhand': ['uttarakhand', 'uttaranchal'],
+    'jammu and kashmir': ['jammu kashmir', 'j and k', 'jk'],
+}
+
+# Parenthetical qualifiers in mandi names that must never become aliases on their own.
+_QUALIFIER_WORDS = {
+    'whole', 'common', 'loose', 'local', 'raw', 'dry', 'green', 'w', 'fresh', 'split',
+    'basmati', 'veg', 'leaves', 'white', 'red', 'raw ripe', 'calcutta'
+}
+
+_TRANSLITERATION_FOLDS = [
+    ('aa', 'a'), ('ee', 'i'), ('ii', 'i'), ('oo', 'u'), ('uu', 'u'),
+    ('ph', 'f'), ('bh', 'b'), ('dh', 'd'), ('gh', 'g'), ('jh', 'j'), ('kh', 'k'),
+    ('th', 't'), ('sh', 's'), ('ch', 'c'), ('w', 'v'), ('z', 'j'), ('q', 'k'), ('y', 'i'),
+]
+_DEVANAGARI_FOLDS = {'ँ': 'ं', '़': ''}  # chandrabindu -> anusvara, drop nukta
+# Devanagari romanized before folding, so 'पुणे' and 'Pune' share folded, skeleton and trigram keys.
+_DEVANAGARI_VOWELS = {
+    'अ': 'a', 'आ': 'aa', 'इ': 'i', 'ई': 'ii', 'उ': 'u', 'ऊ': 'uu', 'ऋ': 'ri',
+    'ए': 'e', 'ऐ': 'ai', 'ऑ': 'o', 'ओ': 'o', 'औ': 'au',
+}
+_DEVANAGARI_VOWEL_SIGNS = {
+    'ा': 'aa', 'ि': 'i', 'ी': 'ii', 'ु': 'u', 'ू': 'uu', 'ृ': 'ri',
+    'ॅ': 'e', 'े': 'e', 'ै': 'ai', 'ॉ': 'o', 'ो': 'o', 'ौ': 'au', '्': '',
+}
+_DEVANAGARI_CONSONANTS = {
+    'क': 'k', 'ख': 'kh', 'ग': 'g', 'घ': 'gh', 'ङ': 'n', 'च': 'ch', 'छ': 'chh', 'ज': 'j', 'झ': 'jh', 'ञ': 'n',
+    'ट': 't', 'ठ': 'th', 'ड': 'd', 'ढ': 'dh', 'ण': 'n', 'त': 't', 'थ': 'th', 'द': 'd', 'ध': 'dh', 'न': 'n',
+    'प': 'p', 'फ': 'ph', 'ब': 'b', 'भ': 'bh', 'म': 'm', 'य': 'y', 'र': 'r', 'ल': 'l', 'ळ': 'l', 'व': 'v',
+    'श': 'sh', 'ष': 'sh', 'स': 's', 'ह': 'h',
+}
+_DEVANAGARI_MARKS = {'ं': 'n', 'ः': 'h'}
+_REPEATED_CHAR = re.compile(r'(.)\1+')
+_NAME_PARTS = re.compile(r'[()/,]')
+_MIN_SKELETON_LENGTH = 4
+_VOWELS = set('aeiou')
+
+
+def normalize(text):
+    """Lower-cases, strips accents/punctuation and collapses whitespace. Keeps non-Latin scripts."""
+    text = unicodedata.normalize('NFKD', str(text or '')).lower()
+    chars = []
+    for ch in text:
+        ch = _DEVANAGARI_FOLDS.get(ch, ch)
+        category = unicodedata.category(ch)[0] if ch else 'M'
+        if category in 'LN':
+            chars.append(ch)
+        elif category == 'M':
+            # Drop accents on Latin letters but keep Devanagari vowel signs.
+            if ch and chars and not chars[-1].isascii():
+                chars.append(ch)
+        else:
+            chars.append(' ')
+    return ' '.join(''.join(chars).split())
+
+
+def transliterate(normalized):
+    """
+    Romanizes Devanagari in a normalized name ('पुणे' -> 'pune', 'पटना' -> 'patnaa'). A consonant keeps
+    its inherent 'a' unless a vowel sign or virama follows, it ends the word (after a single consonant),
+    or Hindi drops it between two voiced syllables. Other text passes through unchanged.
+    """
+    out = []
+    dropped = False
+    for i, ch in enumerate(normalized):
+        following = normalized[i + 1:i + 2]
+        if ch in _DEVANAGARI_CONSONANTS:
+            out.append(_DEVANAGARI_CONSONANTS[ch])
+            ends_conjunct = i > 0 and normalized[i - 1] == '्' and following in ('', ' ')
+            if following in _DEVANAGARI_CONSONANTS or following in _DEVANAGARI_VOWELS or following in _DEVANAGARI_MARKS or ends_conjunct:
+                # 'kaanapur' -> 'kaanpur': drop a medial 'a' whose next consonant carries its own vowel sign.
+                medial = i > 0 and normalized[i - 1] not in (' ', '्') and not dropped
+                if medial and following in _DEVANAGARI_CONSONANTS and normalized[i + 2:i + 3] in _DEVANAGARI_VOWEL_SIGNS and normalized[i + 2:i + 3] != '्':
+                    dropped = True
+                    continue
+                out.append('a')
+            dropped = False
+        elif ch == 'ं' and following in ('प', 'फ', 'ब', 'भ', 'म'):
+            out.append('m')
+        elif ch in _DEVANAGARI_VOWEL_SIGNS:
+            out.append(_DEVANAGARI_VOWEL_SIGNS[ch])
+        else:
+            out.append(_DEVANAGARI_VOWELS.get(ch) or _DEVANAGARI_MARKS.get(ch, ch))
+    return ''.join(out)
+
+
+def fold(normalized):
+    """Folds common romanization variants (aa/a, sh/s, w/v, doubled letters...) into one spelling."""
+    folded = transliterate(normalized).replace(' ', '')
+    for variant, replacement in _TRANSLITERATION_FOLDS:
+        folded = folded.replace(variant, replacement)
+    return _REPEATED_CHAR.sub(r'\1', folded)
+
+
+def skeleton(folded):
+    """Consonant skeleton of a folded name, so 'ahmedabad' and 'ahmadabad' collide."""
+    return folded[:1] + re.sub(r'[aeiou]', '', folded[1:])
+
+
+def _vowel_edits(folded, alias):
+    """
+    How many vowels must be swapped to turn one folded name into the other, or None when they differ
+    in anything else. 'calcuta' and 'calicut' share a skeleton but place their vowels differently.
+    """
+    if len(folded) != len(alias):
+        return None
+    edits = 0
+    for a, b in zip(folded, alias):
+        if a != b:
+            if a not in _VOWELS or b not in _VOWELS:
+                return None
+            edits += 1
+    return edits
+
+
+def _trigrams(folded):
+    padded = f"  {folded} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def name_variants(raw_name):
+    """
+    Splits names like 'Bajra(Pearl Millet/Cumbu)' or 'Vadodara(Baroda)' into their primary
+    name followed by every alternative spelling, all normalized.
+    """
+    primary = normalize(_NAME_PARTS.split(str(raw_name), 1)[0])
+    variants = [primary] if primary else []
+    for part in _NAME_PARTS.split(str(raw_name))[1:]:
+        part = normalize(part)
+        if part and part not in _QUALIFIER_WORDS and part not in variants:
+            variants.append(part)
+    full = normalize(raw_name)
+    if full and full not in variants:
+        variants.append(full)
+    return variants
+
+
+class _NameIndex:
+    """Exact, folded, skeleton and trigram lookups over a set of named entries."""
+
+    def __init__(self):
+        self.entries = {}       # id -> (display name, state)
+        self._exact = {}        # normalized alias -> set of ids
+        self._folded = {}       # folded alias -> set of ids
+        self._skeleton = {}     # skeleton -> {folded alias: set of ids}
+        self._trigrams = {}     # trigram -> set of alias numbers
+        self._aliases = []      # alias number -> (id, trigram count)
+
+    def add(self, entry_id, display_name, aliases, state=None):
+        self.entries.setdefault(entry_id, (display_name, state))
+        for alias in aliases:
+            alias = normalize(alias)
+            if not alias or entry_id in self._exact.get(alias, ()):
+                continue
+            folded = fold(alias)
+            self._exact.setdefault(alias, set()).add(entry_id)
+            self._folded.setdefault(folded, set()).add(entry_id)
+            if len(skeleton(folded)) >= _MIN_SKELETON_LENGTH:
+                self._skeleton.setdefault(skeleton(folded), {}).setdefault(folded, set()).add(entry_id)
+            grams = _trigrams(folded)
+            alias_number = len(self._aliases)
+            self._aliases.append((entry_id, len(grams)))
+            for gram in grams:
+                self._trigrams.setdefault(gram, set()).add(alias_number)
+
+    def alias_ids(self, alias):
+        return self._exact.get(normalize(alias), set())
+
+    def lookup(self, text, allowed=None, min_score=None, margin=0.1):
+        """
+        Returns (id, score) for the best match, or (None, 0.0). Trigram similarity is only tried with a
+        `min_score`, and its best entry must beat every other entry by `margin`.
+        """
+        normalized = normalize(text)
+        if not normalized:
+            return None, 0.0
+        folded = fold(normalized)
+
+        def _filter(ids):
+            return {i for i in ids if allowed is None or allowed(i)}
+
+        for ids, score in ((self._exact.get(normalized, ()), 1.0), (self._folded.get(folded, ()), 0.95)):
+            ids = _filter(ids)
+            if len(ids) == 1:
+                return next(iter(ids)), score
+            if ids:
+                return sorted(ids)[0], score
+
+        # Same consonants in the same order, with at most one vowel in three swapped ('bengaluru' -> 'bangalore').
+        skeleton_ids = set()
+        if len(skeleton(folded)) >= _MIN_SKELETON_LENGTH:
+            for alias, ids in self._skeleton.get(skeleton(folded), {}).items():
+                edits = _vowel_edits(folded, alias)
+                if edits is not None and edits <= len(folded) // 3:
+                    skeleton_ids |= _filter(ids)
+        if len(skeleton_ids) == 1:
+            return next(iter(skeleton_ids)), 0.9
+
+        if min_score is None:
+            return None, 0.0
+        grams = _trigrams(folded)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._trigrams.get(gram, ()))
+        scores = {}
+        for alias_number, common in shared.items():
+            entry_id, gram_count = self._aliases[alias_number]
+            if allowed is not None and not allowed(entry_id):
+                continue
+            scores[entry_id] = max(scores.get(entry_id, 0.0), 2.0 * common / (len(grams) + gram_count))
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        if not ranked or ranked[0][1] < min_score:
+            return None, 0.0
+        if len(ranked) > 1 and ranked[0][1] - ranked[1][1] < margin:
+            return None, 0.0
+        return ranked[0][0], round(ranked[0][1], 3)
+
+
+_STATES = _NameIndex()
+_DISTRICTS = _NameIndex()
+_COMMODITIES = _NameIndex()
+_RESOLVE_CACHE = {}
+_RESOLVE_CACHE_LIMIT = 20000
+_BUILD_LOCK = threading.Lock()
+
+
+def _cached(key, compute):
+    result = _RESOLVE_CACHE.get(key)
+    if result is None:
+        if len(_RESOLVE_CACHE) >= _RESOLVE_CACHE_LIMIT:
+            _RESOLVE_CACHE.clear()
+        result = _RESOLVE_CACHE[key] = compute()
+    return result
+
+
+def _add_commodity(raw_name, extra_aliases=()):
+    """Maps a commodity name onto an existing canonical ID via its variants, or creates a new one."""
+    variants = name_variants(raw_name)
+    if not variants:
+        return None
+    for variant in variants:
+        ids = _COMMODITIES.alias_ids(variant)
+        if len(ids) == 1:
+            commodity_id = next(iter(ids))
+            break
+    else:
+        commodity_id = variants[0]
+    aliases = list(variants)
+    for extra_alias in extra_aliases:
+        aliases.extend(name_variants(extra_alias))
+    _COMMODITIES.add(commodity_id, commodity_id, aliases)
+    return commodity_id
+
+
+def build(state_districts=None, district_to_state=None, locations=(), commodities=(), commodity_translations=None):
+    """
+    (Re)builds the gazetteer.
+    state_districts:        {"Gujarat": ["Ahmedabad", ...]}
+    district_to_state:      {"Ahmedabad": "GUJARAT"}
+    locations:              iterable of (state, district) pairs seen in mandi data or the centroid file
+    commodities:            iterable of raw mandi commodity names
+    commodity_translations: {"wheat": "गेहूं"} app crop names and their translations
+    """
+    global _STATES, _DISTRICTS, _COMMODITIES
+    states, districts, commodity_index = _NameIndex(), _NameIndex(), _NameIndex()
+
+    with _BUILD_LOCK:
+        _STATES, _DISTRICTS, _COMMODITIES = states, districts, commodity_index
+        _RESOLVE_CACHE.clear()
+
+        for canonical, aliases in STATE_SYNONYMS.items():
+            states.add(canonical, canonical.upper(), [canonical] + aliases)
+
+        def _state_id(state_name):
+            state_id, _ = states.lookup(state_name)
+            if state_id is None:
+                state_id = normalize(state_name)
+                states.add(state_id, state_id.upper(), [state_id])
+            return state_id
+
+        def _add_district(district_name, state_name):
+            state_id = _state_id(state_name)
+            variants = name_variants(district_name)
+            if not variants:
+                return
+            # Spelling variants within a state ('Ahmedabad' / 'Ahmadabad') share one entry.
+            existing_id, _ = districts.lookup(district_name, allowed=lambda i: i[0] == state_id)
+            district_id = existing_id or (state_id, variants[0])
+            districts.add(district_id, district_name, variants, state=states.entries[state_id][0])
+
+        for state_name, district_names in (state_districts or {}).items():
+            for district_name in district_names:
+                _add_district(district_name, state_name)
+        for district_name, state_name in (district_to_state or {}).items():
+            _add_district(district_name, state_name)
+        for state_name, district_name in locations:
+            if state_name and district_name:
+                _add_district(district_name, state_name)
+
+        for canonical, aliases in COMMODITY_SYNONYMS.items():
+            commodity_index.add(canonical, canonical, [canonical] + aliases)
+        for crop_name, translation in (commodity_translations or {}).items():
+            _add_commodity(crop_name, [translation] if translation else [])
+        for commodity_name in commodities:
+            _add_commodity(commodity_name)
+
+    logger.info(f"GAZETTEER: Indexed {len(states.entries)} states, {len(districts.entries)} districts and {len(commodity_index.entries)} commodities.")
+
+
+def resolve_state(text):
+    """Returns a Match whose id is the canonical state ID, or None."""
+    def _compute():
+        state_id, score = _STATES.lookup(text, min_score=0.75)
+        if state_id is None:
+            return False
+        return Match(state_id, _STATES.entries[state_id][0], _STATES.entries[state_id][0], score)
+    return _cached(('state', text), _compute) or None
+
+
+def state_key(text):
+    match = resolve_state(text)
+    return match.id if match else normalize(text)
+
+
+def resolve_district(text, state=None, fuzzy=True):
+    """
+    Returns a Match whose id is the district ID within its state, with the canonical
+    display name and (upper-case) state, or None. Restricted to `state` when given.
+    Without `fuzzy`, only exact, folded and vowel-swapped spellings match.
+    """
+    def _compute():
+        allowed = None
+        if state:
+            state_id = state_key(state)
+            allowed = lambda district_id: district_id[0] == state_id
+        district_id, score = _DISTRICTS.lookup(text, allowed=allowed, min_score=0.7 if fuzzy else None)
+        if district_id is None:
+            return False
+        name, district_state = _DISTRICTS.entries[district_id]
+        return Match(district_id[1], name, district_state, score)
+    return _cached(('district', text, state, fuzzy), _compute) or None
+
+
+def district_key(text, state=None, fuzzy=True):
+    match = resolve_district(text, state, fuzzy=fuzzy)
+    return match.id if match else normalize(text)
+
+
+def district_name(district_id, state):
+    """Display name for a district ID, falling back to the title-cased ID."""
+    entry = _DISTRICTS.entries.get((state_key(state), district_id))
+    return entry[0] if entry else str(district_id).title()
+
+
+def resolve_commodity(text, fuzzy=True):
+    """
+    Returns a Match whose id is the canonical commodity ID ('paddy' -> 'rice'), or None.
+    Without `fuzzy`, only exact, folded and vowel-swapped spellings match.
+    """
+    def _compute():
+        commodity_id, score = _COMMODITIES.lookup(text, min_score=0.75 if fuzzy else None)
+        if commodity_id is None:
+            return False
+        return Match(commodity_id, _COMMODITIES.entries[commodity_id][0], None, score)
+    return _cached(('commodity', text, fuzzy), _compute) or None
+
+
+def commodity_key(text, fuzzy=True):
+    match = resolve_commodity(text, fuzzy=fuzzy)
+    return match.id if match else normalize(text)
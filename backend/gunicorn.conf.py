@@ -0,0 +1,40 @@
+# gunicorn.conf.py - Preloading, fork-friendly gunicorn settings
+#
+# The app (datasets, gazetteer, pivots) is loaded once in the arbiter and forked into the
+# workers, so their read-only data stays in shared copy-on-write pages. Anything that
+# must not be shared across a fork (DB connections, model sessions, background threads)
+# is started per worker in post_fork.
+
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+wsgi_app = 'app:app'
+
+# GUNICORN_ASGI=1 serves asgi.py on uvicorn workers: the upstream-heavy endpoints run on an event
+# loop there, so `threads` no longer caps how many slow upstream calls a worker can wait on.
+if os.getenv('GUNICORN_ASGI') == '1':
+    wsgi_app = 'asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+
+# app.py reads this at import to defer per-worker services to post_fork.
+os.environ['GUNICORN_PRELOAD'] = '1' if preload_app else '0'
+
+
+def when_ready(server):
+    if preload_app:
+        # Move everything loaded so far out of the collector's reach. Otherwise the first
+        # collection in each worker writes to every object header and un-shares its page.
+        gc.collect()
+        gc.freeze()
+        server.log.info(f"Froze {gc.get_freeze_count()} preloaded objects before forking workers.")
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from app import start_worker_services
+        start_worker_services()
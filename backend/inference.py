@@ -0,0 +1,187 @@
+# inference.py - Optional in-process CPU inference for the soil and plant-health models
+#
+# Models are the Keras files at PLANT_HEALTH_MODEL_PATH / SOIL_TYPE_MODEL_PATH converted to ONNX, e.g.
+#   python -m tf2onnx.convert --keras plant_health.h5 --output plant_health.onnx
+# When onnxruntime or the converted files are missing, callers fall back to the remote vision API.
+
+import io
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import numpy as np
+from PIL import Image
+
+from config import (
+    INFERENCE_BACKEND, PLANT_HEALTH_MODEL_PATH, SOIL_TYPE_MODEL_PATH, PLANT_HEALTH_ONNX_PATH, SOIL_TYPE_ONNX_PATH,
+    PLANT_HEALTH_CLASS_LABELS, SOIL_TYPE_CLASS_LABELS, INFERENCE_IMAGE_SIZE, INFERENCE_INTRA_OP_THREADS,
+    INFERENCE_MAX_BATCH, INFERENCE_BATCH_WAIT_MS, INFERENCE_TIMEOUT_SECONDS, IMAGE_PREPROCESS_WORKERS
+)
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+CROP, SOIL = 'Crop', 'Soil'   # same mode names the remote vision endpoint uses
+
+_MODELS = {}
+_LOADED_PID = None
+_LOAD_LOCK = threading.Lock()
+_PREPROCESS_EXECUTOR = ThreadPoolExecutor(max_workers=IMAGE_PREPROCESS_WORKERS, thread_name_prefix='image_preprocess')
+
+
+def _onnx_path(explicit_path, model_path):
+    if explicit_path:
+        return explicit_path
+    if not model_path:
+        return None
+    return model_path if model_path.endswith('.onnx') else os.path.splitext(model_path)[0] + '.onnx'
+
+
+def preprocess(image_data):
+    """Decodes an image into the MobileNetV2 input range ([-1, 1], RGB, square)."""
+    with Image.open(io.BytesIO(image_data)) as img:
+        img = img.convert('RGB').resize((INFERENCE_IMAGE_SIZE, INFERENCE_IMAGE_SIZE), Image.BILINEAR)
+        pixels = np.asarray(img, dtype=np.float32)
+    return pixels / 127.5 - 1.0
+
+
+def _safe_preprocess(image_data):
+    try:
+        return preprocess(image_data)
+    except Exception as e:
+        logger.error(f"INFERENCE: Could not decode image: {e}")
+        return None
+
+
+class _Model:
+    """One ONNX session plus a micro-batcher that folds concurrent requests into a single run."""
+
+    def __init__(self, mode, path, labels):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = INFERENCE_INTRA_OP_THREADS
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        self.mode = mode
+        self.labels = labels
+        self.session = ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.channels_first = self.session.get_inputs()[0].shape[1] == 3
+        self._queue = queue.Queue()
+        threading.Thread(target=self._batch_worker, daemon=True, name=f"inference_{mode.lower()}").start()
+
+    def _batch_worker(self):
+        wait = INFERENCE_BATCH_WAIT_MS / 1000
+        while True:
+            batch = [self._queue.get()]
+            # Collect whatever else arrives within the wait window, up to the batch cap.
+            while len(batch) < INFERENCE_MAX_BATCH:
+                try:
+                    batch.append(self._queue.get(timeout=wait))
+                except queue.Empty:
+                    break
+            try:
+                probabilities = self.run(np.stack([pixels for pixels, _ in batch]))
+                for (_, future), row in zip(batch, probabilities):
+                    future.set_result(row)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+    def run(self, pixels):
+        """Runs a preprocessed NHWC batch and returns one probability row per image."""
+        if self.channels_first:
+            pixels = pixels.transpose(0, 3, 1, 2)
+        return self.session.run(None, {self.input_name: pixels})[0]
+
+    def submit(self, pixels):
+        future = Future()
+        self._queue.put((pixels, future))
+        return future
+
+    def to_result(self, probabilities):
+        index = int(np.argmax(probabilities))
+        label = self.labels.get(index, f"Class {index}")
+        result = {"prediction": label, "confidence": float(probabilities[index])}
+        if self.mode == CROP:
+            result["is_healthy"] = 'healthy' in label.lower()
+        return result
+
+
+def _load_models():
+    """Loads the sessions once per worker process (sessions and their threads don't survive a fork)."""
+    global _MODELS, _LOADED_PID
+    if _LOADED_PID == os.getpid():
+        return _MODELS
+    with _LOAD_LOCK:
+        if _LOADED_PID == os.getpid():
+            return _MODELS
+        models = {}
+        if ort is not None and INFERENCE_BACKEND != 'remote':
+            for mode, path, labels in (
+                (CROP, _onnx_path(PLANT_HEALTH_ONNX_PATH, PLANT_HEALTH_MODEL_PATH), PLANT_HEALTH_CLASS_LABELS),
+                (SOIL, _onnx_path(SOIL_TYPE_ONNX_PATH, SOIL_TYPE_MODEL_PATH), SOIL_TYPE_CLASS_LABELS),
+            ):
+                if not path or not os.path.exists(path):
+                    continue
+                try:
+                    models[mode] = _Model(mode, path, labels)
+                    logger.info(f"INFERENCE: Loaded local {mode.lower()} model from '{path}'.")
+                except Exception as e:
+                    logger.error(f"INFERENCE: Could not load '{path}': {e}")
+        elif INFERENCE_BACKEND == 'local':
+            logger.error("INFERENCE: INFERENCE_BACKEND is 'local' but onnxruntime is not installed.")
+        _MODELS, _LOADED_PID = models, os.getpid()
+        return _MODELS
+
+
+def warm_up():
+    """Loads the local models and runs one dummy batch through each so the first request isn't slow."""
+    for model in _load_models().values():
+        try:
+            model.run(np.zeros((1, INFERENCE_IMAGE_SIZE, INFERENCE_IMAGE_SIZE, 3), dtype=np.float32))
+        except Exception as e:
+            logger.error(f"INFERENCE: Warm-up failed for the {model.mode.lower()} model: {e}")
+
+
+def available(mode):
+    return mode in _load_models()
+
+
+def classify_many(mode, images):
+    """
+    Classifies a list of raw images with the local model as micro-batched requests.
+    Returns one result dict per image, or None when no local model is loaded for `mode`.
+    """
+    model = _load_models().get(mode)
+    if model is None:
+        return None
+    futures = []
+    results = [None] * len(images)
+    # Decoding and resizing run concurrently; the batcher then sees the images together.
+    decoded = _PREPROCESS_EXECUTOR.map(_safe_preprocess, images) if len(images) > 1 else map(_safe_preprocess, images)
+    for i, pixels in enumerate(decoded):
+        if pixels is None:
+            results[i] = {"error": "The image could not be read."}
+        else:
+            futures.append((i, model.submit(pixels)))
+    for i, future in futures:
+        try:
+            results[i] = model.to_result(future.result(timeout=INFERENCE_TIMEOUT_SECONDS))
+        except FutureTimeoutError:
+            results[i] = {"error": "The local model timed out."}
+        except Exception as e:
+            logger.error(f"INFERENCE: Local {mode.lower()} model failed: {e}")
+            results[i] = {"error": "The local model failed."}
+    return results
+
+
+def classify(mode, image_data):
+    """Single-image form of classify_many; None when the local model isn't available."""
+    results = classify_many(mode, [image_data])
+    return results[0] if results else None
@@ -0,0 +1,202 @@
+# intent_parser.py - Local intent and slot parsing for formulaic chatbot queries
+
+import logging
+import re
+import threading
+from collections import Counter, deque, namedtuple
+
+import gazetteer
+from config import INTENT_MIN_CONFIDENCE
+
+logger = logging.getLogger(__name__)
+
+Intent = namedtuple('Intent', ['name', 'slots', 'confidence', 'lang'])
+
+_DEVANAGARI = re.compile(r'[ऀ-ॿ]')
+_HINDI_DIGITS = str.maketrans('०१२३४५६७८९', '0123456789')
+_TOKEN = re.compile(r'(?:[^\W\d_]|[ऀ-ॿ])+|\d+(?:\.\d+)?')
+_AREA = re.compile(r'(\d+(?:\.\d+)?)\s*(?:acres?|acr|ekad|ekar|एकड़|एकड)', re.IGNORECASE)
+
+_PRICE_WORDS = {
+    'price', 'prices', 'rate', 'rates', 'bhav', 'bhaav', 'bhao', 'daam', 'dam', 'kimat', 'keemat', 'mandi',
+    'भाव', 'दाम', 'कीमत', 'क़ीमत', 'मंडी', 'रेट',
+}
+_REVENUE_WORDS = {
+    'revenue', 'income', 'earn', 'earning', 'earnings', 'kamai', 'aamdani', 'profit',
+    'कमाई', 'आय', 'आमदनी', 'मुनाफा', 'मुनाफ़ा',
+}
+_REPORT_WORDS = {'report', 'reports', 'रिपोर्ट'}
+_LATEST_WORDS = {'latest', 'last', 'recent', 'newest', 'pichli', 'pichla', 'aakhri', 'akhiri', 'पिछली', 'पिछला', 'आखिरी', 'नवीनतम', 'ताज़ा', 'ताजा'}
+
+# Questions that need reasoning, comparison or forecasting go to the model.
+_MODEL_WORDS = {
+    'why', 'should', 'compare', 'comparison', 'vs', 'versus', 'better', 'best', 'forecast', 'predict',
+    'tomorrow', 'next', 'trend', 'increase', 'decrease', 'sell', 'hold',
+    'क्यों', 'तुलना', 'बेहतर', 'सबसे', 'कल', 'अगले', 'बेचूं', 'बेचना',
+}
+
+# Never treated as (part of) a crop or district name.
+_STOP_WORDS = _PRICE_WORDS | _REVENUE_WORDS | _REPORT_WORDS | _LATEST_WORDS | {
+    'what', 'whats', 'is', 'the', 'of', 'in', 'at', 'for', 'a', 'an', 'me', 'my', 'tell', 'show', 'give',
+    'get', 'check', 'current', 'today', 'todays', 'please', 'pls', 'how', 'much', 'will', 'i', 'from',
+    'per', 'quintal', 'acre', 'acres', 'acr', 'ekad', 'ekar', 'estimate', 'estimated', 'total', 'and', 'on', 'to',
+    'summary', 'now', 'abhi',
+    'kya', 'hai', 'ka', 'ki', 'ke', 'mein', 'me', 'batao', 'bataiye', 'aaj', 'kitna', 'kitni',
+    'क्या', 'है', 'का', 'की', 'के', 'में', 'बताओ', 'बताइए', 'आज', 'कितना', 'कितनी', 'मेरी', 'मेरा', 'दिखाओ', 'एकड़', 'एकड',
+    'से', 'अभी',
+}
+_MAX_TOKENS = 25
+_MAX_SPAN = 3
+
+
+def _tokens(message):
+    return [token.lower() for token in _TOKEN.findall(message.translate(_HINDI_DIGITS))]
+
+
+def _find_slots(tokens):
+    """
+    Greedy longest-span scan for crop and district names. Returns ({crop_id: Match}, {district_key: Match},
+    positions of the tokens they consumed). Spans are resolved strictly: exact, folded or vowel-swapped
+    spellings only, no trigram guessing, so ordinary words don't turn into places.
+    """
+    crops, districts, consumed = {}, {}, set()
+    i = 0
+    while i < len(tokens):
+        for span in range(min(_MAX_SPAN, len(tokens) - i), 0, -1):
+            words = tokens[i:i + span]
+            if words[0] in _STOP_WORDS or words[-1] in _STOP_WORDS or words[0][0].isdigit():
+                continue
+            text = " ".join(words)
+            crop = gazetteer.resolve_commodity(text, fuzzy=False)
+            district = gazetteer.resolve_district(text, fuzzy=False)
+            # A span that is exactly a crop name stays a crop ('mango', 'onion'); otherwise the better match wins.
+            if crop and (crop.score >= 0.95 or not district or crop.score >= district.score):
+                crops.setdefault(crop.id, crop)
+            elif district:
+                districts.setdefault((district.state, district.id), district)
+            else:
+                continue
+            consumed.update(range(i, i + span))
+            i += span
+            break
+        else:
+            i += 1
+    return crops, districts, consumed
+
+
+def parse(message):
+    """
+    Returns an Intent for mandi price, revenue estimate and latest report questions,
+    or None when the message should go to the model.
+    """
+    if not message or message.startswith("CMD::"):
+        return None
+    lang = 'hi' if _DEVANAGARI.search(message) else 'en'
+    tokens = _tokens(message)
+    if not tokens or len(tokens) > _MAX_TOKENS:
+        return None
+    words = set(tokens)
+    if words & _MODEL_WORDS:
+        return None
+
+    if words & _REPORT_WORDS and words & _LATEST_WORDS:
+        return Intent('latest_report', {}, 1.0, lang)
+
+    area_match = _AREA.search(message.translate(_HINDI_DIGITS))
+    wants_revenue = bool(words & _REVENUE_WORDS) or (area_match is not None and bool(words & _PRICE_WORDS))
+    wants_price = bool(words & _PRICE_WORDS)
+    if not (wants_revenue or wants_price):
+        return None
+
+    crops, districts, consumed = _find_slots(tokens)
+    # Several crops or places means several lookups; the model handles those.
+    if len(crops) != 1 or len(districts) != 1:
+        return None
+    # Any other word may change the question ('going up', 'last year'), so only filler may be left over.
+    area_number = area_match.group(1) if area_match else None
+    if any(token not in _STOP_WORDS and token != area_number for position, token in enumerate(tokens) if position not in consumed):
+        return None
+    crop, district = next(iter(crops.values())), next(iter(districts.values()))
+    slots = {"crop": crop.id, "district": district.name, "state": district.state}
+    confidence = min(crop.score, district.score)
+
+    if wants_revenue:
+        if area_match is None:
+            return None
+        slots["area"] = float(area_match.group(1))
+        intent = Intent('revenue_estimate', slots, confidence, lang)
+    else:
+        intent = Intent('mandi_price', slots, confidence, lang)
+    return intent if intent.confidence >= INTENT_MIN_CONFIDENCE else None
+
+
+def render(intent, result, crop_label=None):
+    """Fills the reply template for an intent with its tool result."""
+    hindi = intent.lang == 'hi'
+    if isinstance(result, dict) and "error" in result:
+        if hindi:
+            return f"क्षमा करें, **{intent.slots.get('district')}** में **{crop_label or intent.slots.get('crop')}** का मंडी भाव अभी उपलब्ध नहीं है।"
+        return result["error"]
+    crop = crop_label or result.get("crop")
+    price = result.get("average_mandi_price")
+
+    if intent.name == 'mandi_price':
+        if hindi:
+            reply = f"**{result['location']}** में **{crop}** का औसत मंडी भाव **₹{price}/क्विंटल** है।"
+        else:
+            reply = f"The average mandi price for **{crop}** in **{result['location']}** is **₹{price}/quintal**."
+    else:
+        revenue = f"{result.get('total_estimated_revenue', 0):,}"
+        area = f"{result.get('area_acres', 0):g}"
+        if hindi:
+            reply = f"**{result['location']}** में **{area} एकड़** **{crop}** से अनुमानित आय लगभग **₹{revenue}** है (औसत मंडी भाव ₹{price}/क्विंटल)।"
+        else:
+            reply = f"For **{area} acres** of **{crop}** in **{result['location']}**, the estimated revenue is about **₹{revenue}** at an average mandi price of ₹{price}/quintal."
+
+    if result.get("stale_date"):
+        reply += f"\n\n_अंतिम उपलब्ध डेटा: {result['stale_date']}_" if hindi else f"\n\n_Last available data from {result['stale_date']}._"
+    elif result.get("note") and not hindi:
+        reply += f"\n\n_{result['note']}_"
+    return reply
+
+
+# --- Fast-path statistics ---
+
+_STATS_LOCK = threading.Lock()
+_COUNTS = Counter()
+_LATENCIES = {"fast_path": deque(maxlen=500), "model": deque(maxlen=500)}
+
+
+def record(path, elapsed, intent_name=None):
+    """Records one answered message. `path` is 'fast_path' or 'model'."""
+    with _STATS_LOCK:
+        _COUNTS[path] += 1
+        if intent_name:
+            _COUNTS[f"intent:{intent_name}"] += 1
+        _LATENCIES[path].append(elapsed)
+
+
+def _latency_summary(samples):
+    if not samples:
+        return {"count": 0, "avg_ms": None, "p50_ms": None, "p95_ms": None}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "avg_ms": round(1000 * sum(ordered) / len(ordered), 1),
+        "p50_ms": round(1000 * ordered[len(ordered) // 2], 1),
+        "p95_ms": round(1000 * ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+    }
+
+
+def stats():
+    with _STATS_LOCK:
+        total = _COUNTS["fast_path"] + _COUNTS["model"]
+        return {
+            "total_messages": total,
+            "fast_path_hits": _COUNTS["fast_path"],
+            "model_calls": _COUNTS["model"],
+            "hit_rate": round(_COUNTS["fast_path"] / total, 3) if total else 0.0,
+            "by_intent": {key.split(":", 1)[1]: count for key, count in _COUNTS.items() if key.startswith("intent:")},
+            "latency": {path: _latency_summary(samples) for path, samples in _LATENCIES.items()},
+        }
+
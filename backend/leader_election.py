@@ -0,0 +1,108 @@
+# leader_election.py - Per-host leader election over an flock()ed file with a heartbeat
+
+import json
+import logging
+import os
+import socket
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines run a single process anyway.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class FileLeaderLock:
+    """
+    Whoever holds an exclusive flock on `path` is the leader. The kernel drops the lock when
+    the holder exits or crashes, so a follower's next try_acquire() takes over. The leader
+    rewrites the file with a heartbeat so followers and admins can see who leads and spot
+    a leader that is alive but stuck.
+    """
+
+    def __init__(self, path, heartbeat_seconds):
+        self.path = path
+        self.heartbeat_seconds = heartbeat_seconds
+        self._fd = None
+        self._acquired_at = None
+        if hasattr(os, 'register_at_fork'):
+            # A forked child (e.g. a process pool) must not keep the lock alive after the leader dies.
+            os.register_at_fork(after_in_child=self._drop_inherited)
+
+    @property
+    def is_leader(self):
+        return self._fd is not None
+
+    def _drop_inherited(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+    def try_acquire(self):
+        """Non-blocking. Returns True if this process is (now) the leader."""
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            self._fd, self._acquired_at = -1, time.time()
+            return True
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd, self._acquired_at = fd, time.time()
+        self.heartbeat()
+        logger.info(f"LEADER: Process {os.getpid()} acquired '{self.path}'.")
+        return True
+
+    def heartbeat(self):
+        if self._fd is None or self._fd < 0:
+            return
+        record = json.dumps({"pid": os.getpid(), "host": socket.gethostname(), "acquired_at": self._acquired_at, "heartbeat_at": time.time()})
+        try:
+            os.ftruncate(self._fd, 0)
+            os.pwrite(self._fd, record.encode('utf-8'), 0)
+        except OSError as e:
+            logger.error(f"LEADER: Heartbeat write failed: {e}")
+
+    def sleep(self, seconds):
+        """Sleeps in heartbeat-sized steps so the heartbeat stays fresh during long waits."""
+        deadline = time.monotonic() + seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, self.heartbeat_seconds))
+            self.heartbeat()
+
+    def release(self):
+        if self._fd is not None and self._fd >= 0:
+            os.ftruncate(self._fd, 0)
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+        self._fd = None
+
+    def status(self):
+        """The current leader as recorded in the lock file, plus whether its heartbeat is stale."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                record = json.loads(f.read() or 'null')
+        except (OSError, ValueError):
+            record = None
+        if not record:
+            return {"leader": None, "this_process_is_leader": self.is_leader, "pid": os.getpid()}
+        age = time.time() - record.get("heartbeat_at", 0)
+        return {
+            "leader": record,
+            "heartbeat_age_seconds": round(age, 1),
+            "stale": age > 3 * self.heartbeat_seconds,
+            "this_process_is_leader": self.is_leader,
+            "pid": os.getpid(),
+        }
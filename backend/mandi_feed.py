@@ -0,0 +1,311 @@
+# mandi_feed.py - Paged, streaming ingestion of data.gov.in mandi records
+
+import codecs
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import gazetteer
+import cassette
+from config import (
+    DATA_GOV_IN_API_KEY, DATA_GOV_IN_RESOURCE_ID, DATA_GOV_IN_PAGE_SIZE,
+    DATA_GOV_IN_MAX_WORKERS, DATA_GOV_IN_MIN_REQUEST_INTERVAL, DATA_GOV_IN_BASE_URL
+)
+
+logger = logging.getLogger(__name__)
+
+DATA_GOV_IN_URL = f"{DATA_GOV_IN_BASE_URL}/{DATA_GOV_IN_RESOURCE_ID}"
+_HTTP = cassette.CassetteSession()
+REQUEST_HEADERS = { 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36' }
+
+_RECORDS_ARRAY_START = re.compile(r'"records"\s*:\s*\[')
+_HEADER_FIELD = re.compile(r'"(total|count|limit|offset)"\s*:\s*"?(\d+)')
+_JSON_DECODER = json.JSONDecoder()
+_CHUNK_SIZE = 64 * 1024
+
+
+def _get_value_from_record(record, keys_to_try):
+    """Helper to get a value from a record trying multiple possible keys."""
+    for key in keys_to_try:
+        if key in record:
+            return record[key]
+    return ''
+
+
+class PriceIndex:
+    """
+    Running modal-price aggregates keyed by canonical (district, commodity) IDs from the gazetteer.
+    Records are folded in one at a time, so the raw API payload never has to be held in memory.
+    """
+
+    def __init__(self, state=None):
+        self.state = state
+        self._totals = {}
+        self._lock = threading.Lock()
+        self.record_count = 0
+        self.complete = True
+
+    def __len__(self):
+        return len(self._totals)
+
+    def _key(self, district, commodity, state=None):
+        return (gazetteer.district_key(district, state or self.state, fuzzy=False), gazetteer.commodity_key(commodity, fuzzy=False))
+
+    def _add_totals(self, key, price_total, price_count):
+        with self._lock:
+            totals = self._totals.setdefault(key, [0, 0])
+            totals[0] += price_total
+            totals[1] += price_count
+            self.record_count += price_count
+
+    def add_record(self, record):
+        if not isinstance(record, dict):
+            return
+        district = str(_get_value_from_record(record, ['district', 'District'])).strip()
+        commodity = str(_get_value_from_record(record, ['commodity', 'Commodity'])).strip()
+        modal_price_str = _get_value_from_record(record, ['modal_price', 'Modal Price', 'Modal_Price'])
+        if not district or not commodity:
+            return
+        if not (modal_price_str and str(modal_price_str).replace('.', '', 1).isdigit()):
+            return
+
+        record_state = _get_value_from_record(record, ['state', 'State']) or None
+        self._add_totals(self._key(district, commodity, record_state), int(float(modal_price_str)), 1)
+
+    def add_rows(self, rows):
+        """Merges serialized [district, commodity, price_total, price_count] rows, re-resolving their names."""
+        for district, commodity, price_total, price_count in rows:
+            self._add_totals(self._key(district, commodity), price_total, price_count)
+
+    def merge(self, other):
+        for key, (price_total, price_count) in other.items():
+            self._add_totals(key, price_total, price_count)
+
+    def get(self, district_id, commodity_id):
+        """Returns (price_total, price_count) for canonical IDs, or None."""
+        totals = self._totals.get((district_id, commodity_id))
+        return tuple(totals) if totals else None
+
+    def items(self):
+        with self._lock:
+            return [(key, tuple(totals)) for key, totals in self._totals.items()]
+
+    def to_rows(self):
+        return [[district, commodity, total, count] for (district, commodity), (total, count) in self.items()]
+
+    @classmethod
+    def from_rows(cls, rows, state=None):
+        index = cls(state)
+        index.add_rows(rows)
+        return index
+
+    @classmethod
+    def from_records(cls, records, state=None):
+        index = cls(state)
+        for record in records:
+            index.add_record(record)
+        return index
+
+
+class _RateLimiter:
+    """Spaces out request starts across all fetcher threads."""
+
+    def __init__(self, min_interval):
+        self._min_interval = min_interval
+        self._next_allowed = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Claims the next request slot and returns how long to wait for it, in seconds."""
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_allowed - now
+            self._next_allowed = max(now, self._next_allowed) + self._min_interval
+        return max(0.0, delay)
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+rate_limiter = _RateLimiter(DATA_GOV_IN_MIN_REQUEST_INTERVAL)
+
+
+def iter_json_records(byte_chunks, header=None):
+    """
+    Incrementally parses a data.gov.in response body and yields the objects of its
+    "records" array one at a time. Scalar paging fields seen before the array
+    (total, count, limit, offset) are written into `header` if a dict is given.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buf, pos, in_array = "", 0, False
+
+    for chunk in byte_chunks:
+        buf = buf[pos:] + decoder.decode(chunk)
+        pos = 0
+
+        if not in_array:
+            match = _RECORDS_ARRAY_START.search(buf)
+            if not match:
+                continue
+            if header is not None:
+                for field, value in _HEADER_FIELD.findall(buf[:match.start()]):
+                    header[field] = int(value)
+            pos, in_array = match.end(), True
+
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buf):
+                break
+            if buf[pos] == ']':
+                return
+            try:
+                record, pos = _JSON_DECODER.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # The record is split across chunks; wait for more data.
+                break
+            yield record
+
+    if in_array:
+        raise ValueError("Response ended before the records array was closed.")
+
+
+def page_params(state, api_date_str, offset):
+    return {
+        "api-key": DATA_GOV_IN_API_KEY,
+        "format": "json",
+        "limit": str(DATA_GOV_IN_PAGE_SIZE),
+        "offset": str(offset),
+        "filters[state]": state.title(),
+        "filters[arrival_date]": api_date_str
+    }
+
+
+def index_page(state, byte_chunks):
+    """Streams one page body into a page-local PriceIndex. Returns (header, record_count, page_index)."""
+    header, count, page_index = {}, 0, PriceIndex(state)
+    for record in iter_json_records(byte_chunks, header):
+        page_index.add_record(record)
+        count += 1
+    return header, count, page_index
+
+
+def _fetch_page(state, api_date_str, offset):
+    """
+    Fetches one page and streams its records into a page-local PriceIndex, so a page
+    that fails halfway never leaves partial totals behind. Returns (header, record_count, page_index).
+    """
+    rate_limiter.wait()
+    with _HTTP.get(DATA_GOV_IN_URL, params=page_params(state, api_date_str, offset), headers=REQUEST_HEADERS, timeout=20, stream=True) as response:
+        response.raise_for_status()
+        return index_page(state, response.iter_content(chunk_size=_CHUNK_SIZE))
+
+
+def _fetch_page_or_error(state, api_date_str, offset):
+    try:
+        return _fetch_page(state, api_date_str, offset)
+    except Exception as e:
+        return e
+
+
+def _fetch_pages_into(state, index, offsets, attempts=2):
+    """
+    Part of page_plan(): fetches `offsets`, offering failed pages again, and merges each page into
+    `index` once it has arrived whole. Returns the record count per offset, None for pages that failed.
+    """
+    counts, pending = {}, offsets
+    for attempt in range(1, attempts + 1):
+        if not pending:
+            break
+        results = yield pending
+        failed = []
+        for offset, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.warning(f"LIVE API FETCH: Page at offset {offset} for '{state.title()}' failed (attempt {attempt}/{attempts}): {result}")
+                failed.append(offset)
+            else:
+                _, counts[offset], page_index = result
+                index.merge(page_index)
+        pending = failed
+    return [counts.get(offset) for offset in offsets]
+
+
+def page_plan(state, for_date):
+    """
+    The paging behind fetch_state_prices, without the transport, so the async views drive it too.
+    Yields lists of page offsets, whose pages may be fetched concurrently, and must be sent one result
+    per offset: the page's (header, record_count, page_index), or the exception fetching it raised.
+    Returns, through StopIteration, what fetch_state_prices returns.
+    """
+    if not DATA_GOV_IN_API_KEY:
+        logger.warning("LIVE API FETCH SKIPPED: DATA_GOV_IN_API_KEY not set.")
+        return None
+
+    api_date_str = for_date.strftime('%Y-%m-%d')
+    page_size = DATA_GOV_IN_PAGE_SIZE
+
+    logger.info(f"LIVE API FETCH: Requesting resource '{DATA_GOV_IN_RESOURCE_ID}' for state '{state.title()}' on date '{api_date_str}'...")
+    first_page, = yield [0]
+    if isinstance(first_page, requests.exceptions.HTTPError):
+        logger.error(f"HTTP error fetching live price data: {first_page}")
+        return None
+    if isinstance(first_page, Exception):
+        logger.error(f"General error fetching live price data for date {for_date}: {first_page}", exc_info=first_page)
+        return None
+
+    header, first_count, index = first_page
+    fetched, failed_pages = first_count, 0
+    total = header.get('total')
+
+    if total is not None and total > first_count:
+        counts = yield from _fetch_pages_into(state, index, list(range(page_size, total, page_size)))
+        fetched += sum(c for c in counts if c)
+        failed_pages = sum(1 for c in counts if c is None)
+    elif total is None and first_count >= page_size:
+        # No total in the response header: walk pages until a short one comes back.
+        offset = page_size
+        while True:
+            count, = yield from _fetch_pages_into(state, index, [offset])
+            if count is None:
+                failed_pages += 1
+                break
+            fetched += count
+            if count < page_size:
+                break
+            offset += page_size
+
+    if failed_pages:
+        index.complete = False
+        logger.error(f"LIVE API FETCH: {failed_pages} page(s) for '{state.title()}' could not be fetched; data is incomplete.")
+
+    if not fetched:
+        logger.info(f"LIVE API FETCH: No records for '{state.title()}' on '{api_date_str}'.")
+        return index
+
+    logger.info(f"LIVE API FETCH: Streamed {fetched} records (of {total if total is not None else 'unknown'}) into {len(index)} price entries.")
+    return index
+
+
+def fetch_state_prices(state, for_date):
+    """
+    Fetches every mandi record for a state on a date, page by page, and streams them
+    into a PriceIndex. The first page reports the total record count; the remaining
+    pages are then pulled concurrently within the configured rate limit.
+    Returns an empty index if the day has no arrivals, and None if the fetch failed.
+    """
+    api_date_str = for_date.strftime('%Y-%m-%d')
+    plan = page_plan(state, for_date)
+    with ThreadPoolExecutor(max_workers=max(1, DATA_GOV_IN_MAX_WORKERS)) as executor:
+        try:
+            offsets = next(plan)
+            while True:
+                offsets = plan.send(list(executor.map(lambda offset: _fetch_page_or_error(state, api_date_str, offset), offsets)))
+        except StopIteration as done:
+            return done.value
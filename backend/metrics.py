@@ -0,0 +1,234 @@
+# metrics.py - In-process latency histograms and counters, rendered as Prometheus text or JSON
+
+import bisect
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from config import METRICS_ENABLED, UPSTREAM_NAMES
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans a fast DB lookup up to a slow Gemini or data.gov.in call.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_METRICS = {}
+_COLLECTORS = []     # callables returning [(name, help, {labels tuple: value})] gauges read at scrape time
+_LOCK = threading.Lock()
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, one series per label combination."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}   # labels tuple -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *labels):
+        if not METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += 1
+            series[-1] += seconds
+
+    def _quantile(self, counts, total, q):
+        """Upper bound of the bucket holding the q-th observation (what histogram_quantile would bracket)."""
+        if not total:
+            return None
+        target, seen = q * total, 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return None  # beyond the largest bucket
+
+    def series(self):
+        with self._lock:
+            return {labels: list(values) for labels, values in self._series.items()}
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def series(self):
+        with self._lock:
+            return dict(self._values)
+
+
+def _register(metric):
+    with _LOCK:
+        return _METRICS.setdefault(metric.name, metric)
+
+
+def histogram(name, help_text, label_names):
+    return _register(Histogram(name, help_text, label_names))
+
+
+def counter(name, help_text, label_names):
+    return _register(Counter(name, help_text, label_names))
+
+
+def register_collector(collect_fn):
+    """Registers a callable polled at scrape time for gauges such as pool usage or cache sizes."""
+    _COLLECTORS.append(collect_fn)
+
+
+HTTP_LATENCY = histogram('http_request_duration_seconds', 'Flask request latency by route.', ('route', 'method', 'status'))
+UPSTREAM_LATENCY = histogram('upstream_request_duration_seconds', 'Outbound HTTP latency by upstream service.', ('upstream', 'outcome'))
+DB_LATENCY = histogram('db_query_duration_seconds', 'PostgreSQL statement latency by calling function.', ('query',))
+CACHE_REQUESTS = counter('cache_requests_total', 'Memoized service lookups by cache and result.', ('cache', 'result'))
+
+
+# --- Flask routes ---
+
+def init_app(app):
+    """Times every request; the route label is the URL rule, so IDs in paths don't explode the series."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_LATENCY.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+        return response
+
+
+# --- Outbound HTTP ---
+
+def upstream_name(url):
+    host = urlsplit(url).netloc or 'unknown'
+    return UPSTREAM_NAMES.get(host, host)
+
+
+class InstrumentedSession(requests.Session):
+    """A requests.Session that records latency and outcome of every call per upstream host."""
+
+    def request(self, method, url, *args, **kwargs):
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = super().request(method, url, *args, **kwargs)
+            outcome = f"{response.status_code // 100}xx"
+            return response
+        finally:
+            UPSTREAM_LATENCY.observe(time.perf_counter() - started, upstream_name(url), outcome)
+
+
+# --- Memoized services ---
+
+def count_cache(cache_name, hit):
+    CACHE_REQUESTS.inc(cache_name, 'hit' if hit else 'miss')
+
+
+# --- Rendering ---
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _collected():
+    gauges = []
+    for collect_fn in _COLLECTORS:
+        try:
+            gauges.extend(collect_fn())
+        except Exception as e:
+            logger.error(f"METRICS: Collector {getattr(collect_fn, '__name__', collect_fn)} failed: {e}")
+    return gauges
+
+
+def render_prometheus():
+    """Prometheus text exposition format (version 0.0.4) for this worker process."""
+    lines = []
+    for metric in list(_METRICS.values()):
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for labels, values in sorted(metric.series().items()):
+            if metric.kind == 'counter':
+                lines.append(f"{metric.name}{_label_text(metric.label_names, labels)} {values}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets, values):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{metric.name}_bucket{_label_text(metric.label_names, labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{metric.name}_bucket{_label_text(metric.label_names, labels, le)} {values[-2]}")
+            lines.append(f"{metric.name}_count{_label_text(metric.label_names, labels)} {values[-2]}")
+            lines.append(f"{metric.name}_sum{_label_text(metric.label_names, labels)} {values[-1]:.6f}")
+    for name, help_text, series in _collected():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in sorted(series.items()):
+            lines.append(f"{name}{_label_text([key for key, _ in labels], [val for _, val in labels])} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot():
+    """The same data as JSON for the admin dashboard, with averages and bucket-bounded percentiles."""
+    result = {"pid": os.getpid(), "generated_at": time.time(), "histograms": {}, "counters": {}, "gauges": {}}
+    for metric in list(_METRICS.values()):
+        rows = []
+        for labels, values in metric.series().items():
+            row = dict(zip(metric.label_names, labels))
+            if metric.kind == 'counter':
+                row["value"] = values
+            else:
+                count, total = values[-2], values[-1]
+                counts = values[:len(metric.buckets)]
+                row.update({
+                    "count": count,
+                    "avg_ms": round(total / count * 1000, 1) if count else None,
+                    "p50_ms": _ms(metric._quantile(counts, count, 0.5)),
+                    "p95_ms": _ms(metric._quantile(counts, count, 0.95)),
+                    "p99_ms": _ms(metric._quantile(counts, count, 0.99)),
+                })
+            rows.append(row)
+        result["histograms" if metric.kind == 'histogram' else "counters"][metric.name] = rows
+    for name, _, series in _collected():
+        result["gauges"][name] = [{**dict(labels), "value": value} for labels, value in series.items()]
+    return result
+
+
+def _ms(bound):
+    return None if bound is None else round(bound * 1000, 1)
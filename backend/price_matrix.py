@@ -0,0 +1,136 @@
+# price_matrix.py - Per-state district x commodity price pivots and the shared crop yield table
+
+import logging
+import threading
+
+import numpy as np
+
+import gazetteer
+
+logger = logging.getLogger(__name__)
+
+# Average yield in quintals per acre, keyed by canonical commodity ID.
+CROP_YIELD_QPA = {'rice': 22, 'wheat': 20, 'maize': 25, 'cotton': 8, 'chickpea': 10}
+DEFAULT_YIELD_QPA = 15
+
+SOURCE_NONE, SOURCE_LIVE, SOURCE_HISTORICAL, SOURCE_STATE_AVG = 0, 1, 2, 3
+SOURCE_NAMES = {SOURCE_LIVE: 'live', SOURCE_HISTORICAL: 'historical', SOURCE_STATE_AVG: 'state_average'}
+
+_PIVOTS = {}   # state ID -> StatePivot
+_LOCK = threading.Lock()
+
+
+def yield_qpa(crop):
+    """Yield per acre for a crop name in any spelling the gazetteer knows ('Paddy' -> rice)."""
+    key = str(crop).lower().strip()
+    if key in CROP_YIELD_QPA:
+        return CROP_YIELD_QPA[key]
+    return CROP_YIELD_QPA.get(gazetteer.commodity_key(key), DEFAULT_YIELD_QPA)
+
+
+class StatePivot:
+    """
+    Prices for every district x commodity of one state. Each cell holds the live rolling-window
+    average when there is one, otherwise the historical district average, otherwise the state average.
+    """
+
+    def __init__(self, state, live_index, historical_prices):
+        self.state = state
+        self.state_id = gazetteer.state_key(state)
+        self.live_index = live_index
+
+        live = {key: round(total / count) for key, (total, count) in (live_index.items() if live_index else []) if count}
+        historical, state_avg = {}, {}
+        for (state_id, district_id, commodity_id), price in historical_prices.items():
+            if state_id != self.state_id:
+                continue
+            if district_id == '__state_avg__':
+                state_avg[commodity_id] = price
+            else:
+                historical[(district_id, commodity_id)] = price
+
+        self.districts = sorted({district for district, _ in live} | {district for district, _ in historical})
+        self.commodities = sorted({commodity for _, commodity in live} | {commodity for _, commodity in historical} | set(state_avg))
+        self.district_pos = {district: i for i, district in enumerate(self.districts)}
+        self.commodity_pos = {commodity: j for j, commodity in enumerate(self.commodities)}
+
+        self.prices = np.full((len(self.districts), len(self.commodities)), np.nan)
+        self.sources = np.zeros(self.prices.shape, dtype=np.int8)
+        # State averages fill every district first; district history and then live data overwrite them.
+        for commodity, price in state_avg.items():
+            j = self.commodity_pos[commodity]
+            self.prices[:, j], self.sources[:, j] = price, SOURCE_STATE_AVG
+        for source, cells in ((SOURCE_HISTORICAL, historical), (SOURCE_LIVE, live)):
+            for (district, commodity), price in cells.items():
+                i, j = self.district_pos[district], self.commodity_pos[commodity]
+                self.prices[i, j], self.sources[i, j] = price, source
+
+        self.yields = np.array([yield_qpa(commodity) for commodity in self.commodities], dtype=float)
+
+    def revenue(self, area):
+        """Estimated revenue for every cell in one vectorized pass."""
+        return self.prices * self.yields[None, :] * float(area)
+
+    def _cell(self, i, j, revenue):
+        price = self.prices[i, j]
+        if np.isnan(price):
+            return None
+        return {
+            "average_mandi_price": int(price),
+            "total_estimated_revenue": int(round(revenue[i, j])),
+            "estimated_yield_qpa": int(self.yields[j]),
+            "source": SOURCE_NAMES[int(self.sources[i, j])],
+        }
+
+    def district_label(self, district_id):
+        return gazetteer.district_name(district_id, self.state)
+
+    def best_districts(self, crop, area=1.0, limit=None):
+        """Every district with a price for one crop, highest price first."""
+        j = self.commodity_pos.get(gazetteer.commodity_key(crop))
+        if j is None:
+            return None
+        revenue = self.revenue(area)
+        column = self.prices[:, j]
+        order = [i for i in np.argsort(-column, kind='stable') if not np.isnan(column[i])]
+        rows = [{"district": self.district_label(self.districts[i]), **self._cell(i, j, revenue)} for i in order[:limit]]
+        return rows
+
+    def district_crops(self, district, area=1.0):
+        """Every crop priced in one district, highest estimated revenue first."""
+        i = self.district_pos.get(gazetteer.district_key(district, self.state))
+        if i is None:
+            return None
+        revenue = self.revenue(area)
+        row = revenue[i]
+        order = [j for j in np.argsort(-np.nan_to_num(row, nan=-1.0), kind='stable') if not np.isnan(row[j])]
+        return [{"crop": self.commodities[j].capitalize(), **self._cell(i, j, revenue)} for j in order]
+
+    def matrix(self, area=1.0):
+        """The full pivot; missing cells are None."""
+        revenue = self.revenue(area)
+        return {
+            "districts": [self.district_label(district) for district in self.districts],
+            "crops": [commodity.capitalize() for commodity in self.commodities],
+            "prices": [[None if np.isnan(price) else int(price) for price in row] for row in self.prices],
+            "revenue": [[None if np.isnan(value) else int(round(value)) for value in row] for row in revenue],
+            "sources": [[SOURCE_NAMES.get(int(source)) for source in row] for row in self.sources],
+        }
+
+
+def get_pivot(state, live_index, historical_prices):
+    """
+    Returns the pivot for a state, rebuilding it only when the price store hands back a
+    new window index (i.e. after a refresh).
+    """
+    state_id = gazetteer.state_key(state)
+    pivot = _PIVOTS.get(state_id)
+    if pivot is not None and pivot.live_index is live_index:
+        return pivot
+    with _LOCK:
+        pivot = _PIVOTS.get(state_id)
+        if pivot is None or pivot.live_index is not live_index:
+            pivot = StatePivot(state, live_index, historical_prices)
+            _PIVOTS[state_id] = pivot
+            logger.info(f"PRICE MATRIX: Built {len(pivot.districts)} x {len(pivot.commodities)} pivot for '{state}'.")
+    return pivot
@@ -0,0 +1,224 @@
+# price_store.py - Rolling multi-day mandi price store with delta refresh
+
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from config import PRICE_CACHE_DIR, PRICE_HISTORY_DAYS, PRICE_AVERAGE_WINDOW_DAYS, PRICE_REFRESH_INTERVAL_HOURS
+from mandi_feed import PriceIndex
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%d'
+
+_STORES = {}          # state -> (file mtime, {day: entry})
+_WINDOW_INDEXES = {}  # state -> ((file mtime, window start), merged PriceIndex)
+_STATE_LOCKS = {}
+_LOCK = threading.Lock()
+
+
+def _store_path(state):
+    return os.path.join(PRICE_CACHE_DIR, f"{state.lower()}_cache.json")
+
+
+def _state_lock(state):
+    with _LOCK:
+        return _STATE_LOCKS.setdefault(state.lower(), threading.Lock())
+
+
+def _arrival_day(arrival_date, default_day):
+    """data.gov.in reports arrival dates as dd/mm/yyyy."""
+    try:
+        return datetime.strptime(str(arrival_date), '%d/%m/%Y').strftime(DATE_FORMAT)
+    except ValueError:
+        return default_day
+
+
+def _parse_legacy_cache(state, data):
+    """Folds single-snapshot cache files into day buckets keyed by arrival date."""
+    fetched_at = datetime.fromisoformat(data["timestamp"]) if data.get("timestamp") else datetime.min
+    fetched_day = fetched_at.strftime(DATE_FORMAT) if data.get("timestamp") else None
+
+    if "prices" in data:
+        if not fetched_day:
+            return {}
+        return {fetched_day: {"fetched_at": fetched_at, "complete": True, "index": PriceIndex.from_rows(data["prices"], state)}}
+
+    records = data.get("records") or []
+    if isinstance(records, dict):
+        records = records.get("records", [])
+
+    days = {}
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        day = _arrival_day(record.get('arrival_date'), fetched_day)
+        if not day:
+            continue
+        entry = days.setdefault(day, {"fetched_at": fetched_at, "complete": True, "index": PriceIndex(state)})
+        entry["index"].add_record(record)
+    return days
+
+
+def load_days(state):
+    """
+    Returns the day buckets held for a state as {'YYYY-MM-DD': {fetched_at, complete, index}}.
+    The file is only re-read when it changes on disk.
+    """
+    filepath = _store_path(state)
+    try:
+        mtime = os.path.getmtime(filepath)
+    except OSError:
+        return {}
+
+    cached = _STORES.get(state.lower())
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        with open(filepath, 'r') as f:
+            data = json.load(f)
+
+        if "days" in data:
+            days = {
+                day: {
+                    "fetched_at": datetime.fromisoformat(entry["fetched_at"]),
+                    "complete": entry.get("complete", True),
+                    "index": PriceIndex.from_rows(entry.get("prices", []), state)
+                }
+                for day, entry in data["days"].items()
+            }
+        else:
+            days = _parse_legacy_cache(state, data)
+    except Exception as e:
+        logger.error(f"PRICE STORE: Failed to load '{filepath}': {e}")
+        return {}
+
+    _STORES[state.lower()] = (mtime, days)
+    logger.info(f"PRICE STORE: Loaded {len(days)} day(s) of prices for '{state}'.")
+    return days
+
+
+def _save_days(state, days):
+    os.makedirs(PRICE_CACHE_DIR, exist_ok=True)
+    filepath = _store_path(state)
+    data_to_save = {
+        "timestamp": datetime.now().isoformat(),
+        "days": {
+            day: {"fetched_at": entry["fetched_at"].isoformat(), "complete": entry["complete"], "prices": entry["index"].to_rows()}
+            for day, entry in sorted(days.items())
+        }
+    }
+    # Write to a temporary file first so readers never see a half-written store.
+    tmp_path = f"{filepath}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data_to_save, f)
+    os.replace(tmp_path, filepath)
+    _STORES[state.lower()] = (os.path.getmtime(filepath), days)
+
+
+def last_updated(state):
+    """Modification time of a state's store file, or None if it has never been written."""
+    try:
+        return os.path.getmtime(_store_path(state))
+    except OSError:
+        return None
+
+
+def _is_final(day, entry):
+    """A day is final once a complete fetch was made after the day had ended."""
+    return entry["complete"] and entry["fetched_at"].strftime(DATE_FORMAT) > day
+
+
+def dates_to_fetch(state, now=None, refresh_interval=None):
+    """
+    Lists the dates in the retention window that still need fetching, most recent first.
+    Unfinished days are refetched once `refresh_interval` (default PRICE_REFRESH_INTERVAL_HOURS) has passed.
+    """
+    now = now or datetime.now()
+    days = load_days(state)
+    refresh_interval = refresh_interval or timedelta(hours=PRICE_REFRESH_INTERVAL_HOURS)
+
+    pending = []
+    for offset in range(PRICE_HISTORY_DAYS):
+        day = (now - timedelta(days=offset)).strftime(DATE_FORMAT)
+        entry = days.get(day)
+        if entry is None or (not _is_final(day, entry) and now - entry["fetched_at"] >= refresh_interval):
+            pending.append(day)
+    return pending
+
+
+def latest_dates(state, now=None):
+    """
+    The pending dates a request may wait for: today, then yesterday in case today has no
+    arrivals yet. Older dates are left for a background backfill.
+    """
+    now = now or datetime.now()
+    recent = {(now - timedelta(days=offset)).strftime(DATE_FORMAT) for offset in range(2)}
+    return [day for day in dates_to_fetch(state, now) if day in recent]
+
+
+def refresh_state(state, fetch_fn, now=None, refresh_interval=None, latest_only=False):
+    """
+    Fetches only the dates the store has not fully ingested, replaces those day
+    buckets (so re-running a refresh is idempotent) and drops days that fell out
+    of the retention window. Returns the number of dates fetched, or None when the
+    upstream failed before any pending date could be fetched.
+    With `latest_only`, only latest_dates() are fetched, stopping at the first date with arrivals.
+    """
+    now = now or datetime.now()
+    with _state_lock(state):
+        pending = latest_dates(state, now) if latest_only else dates_to_fetch(state, now, refresh_interval)
+        if not pending:
+            return 0
+
+        days = dict(load_days(state))
+        fetched = 0
+        for day in pending:
+            price_index = fetch_fn(state, datetime.strptime(day, DATE_FORMAT))
+            if price_index is None:
+                # The upstream is failing; don't keep hammering it for older dates.
+                break
+            days[day] = {"fetched_at": now, "complete": price_index.complete, "index": price_index}
+            fetched += 1
+            if latest_only and len(price_index):
+                break
+
+        oldest_day = (now - timedelta(days=PRICE_HISTORY_DAYS - 1)).strftime(DATE_FORMAT)
+        retained = {day: entry for day, entry in days.items() if day >= oldest_day}
+
+        if fetched or len(retained) != len(days):
+            try:
+                _save_days(state, retained)
+            except Exception as e:
+                logger.error(f"PRICE STORE: Failed to save store for '{state}': {e}")
+
+        if not fetched:
+            logger.warning(f"PRICE STORE: Refresh of '{state}' failed; none of {len(pending)} pending date(s) could be fetched.")
+            return None
+        logger.info(f"PRICE STORE: Refreshed {fetched} of {len(pending)} pending date(s) for '{state}'.")
+        return fetched
+
+
+def window_index(state, now=None):
+    """Returns one PriceIndex merging the last PRICE_AVERAGE_WINDOW_DAYS days of arrivals."""
+    now = now or datetime.now()
+    days = load_days(state)
+    if not days:
+        return PriceIndex(state)
+
+    window_start = (now - timedelta(days=PRICE_AVERAGE_WINDOW_DAYS - 1)).strftime(DATE_FORMAT)
+    cache_key = (_STORES.get(state.lower(), (None,))[0], window_start)
+    cached = _WINDOW_INDEXES.get(state.lower())
+    if cached and cached[0] == cache_key:
+        return cached[1]
+
+    merged = PriceIndex(state)
+    for day, entry in days.items():
+        if day >= window_start:
+            merged.merge(entry["index"])
+
+    _WINDOW_INDEXES[state.lower()] = (cache_key, merged)
+    return merged
@@ -0,0 +1,271 @@
+# profiling.py - On-demand profiling of single requests, stored as pstats or collapsed stacks
+#
+# A request is profiled when an admin sends "X-Profile: deterministic" (cProfile, saved as .pstats)
+# or "X-Profile: sampling" (a stack sampler, saved as flamegraph-ready .collapsed lines), or when
+# PROFILE_SAMPLE_RATE picks it. The response carries X-Profile-Id; the admin API serves the results.
+
+import cProfile
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+from config import (
+    PROFILE_TOKEN, PROFILE_DIR, PROFILE_MAX_FILES, PROFILE_SAMPLE_INTERVAL_MS,
+    PROFILE_SAMPLE_RATE, PROFILE_SAMPLE_MODE, PROFILE_ROUTES, PROFILE_USER_IDS
+)
+
+logger = logging.getLogger(__name__)
+
+MODES = {'deterministic': 'deterministic', 'cprofile': 'deterministic', '1': 'deterministic', 'true': 'deterministic',
+         'sampling': 'sampling', 'sample': 'sampling'}
+EXTENSIONS = {'deterministic': 'pstats', 'sampling': 'collapsed'}
+# Steps broken out in every profile's summary; every function in the DB helper module counts as well.
+FOCUS_FUNCTIONS = {('services', 'get_dashboard_data'), ('services', 'get_crop_recommendations')}
+FOCUS_MODULES = {'database'}
+_PROFILE_ID = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9a-f]{8}$')
+
+# cProfile can only run in one thread at a time on newer Pythons; a concurrent request falls back to sampling.
+_DETERMINISTIC_LOCK = threading.Lock()
+
+
+def _frame_label(filename, function):
+    return f"{os.path.splitext(os.path.basename(filename))[0]}.{function}"
+
+
+def _is_focus(label):
+    module, _, function = label.partition('.')
+    return (module, function) in FOCUS_FUNCTIONS or (module in FOCUS_MODULES and function != '<module>')
+
+
+class _StackSampler:
+    """Records the stack of one thread every `interval` seconds from a helper thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}    # 'outer;...;inner' -> samples
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='profile_sampler')
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                frames.append((frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+            if not frames:
+                continue
+            key = ';'.join(_frame_label(*code) for code in reversed(frames))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+
+class RequestProfile:
+    """One running profile; `finish()` stops it and writes the result and its summary to PROFILE_DIR."""
+
+    def __init__(self, mode, trigger):
+        self.mode = mode
+        self.trigger = trigger
+        self.started = time.perf_counter()
+        self._profiler = None
+        self._sampler = None
+        if mode == 'deterministic':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._sampler = _StackSampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL_MS / 1000)
+            self._sampler.start()
+
+    def _stop(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+            _DETERMINISTIC_LOCK.release()
+        else:
+            self._sampler.stop()
+
+    def _breakdown(self, elapsed):
+        steps = []
+        if self._profiler is not None:
+            for (filename, _, function), (_, calls, _, cumulative, _) in pstats.Stats(self._profiler).stats.items():
+                label = _frame_label(filename, function)
+                if _is_focus(label):
+                    steps.append({"function": label, "calls": calls, "cumulative_ms": round(cumulative * 1000, 2)})
+        else:
+            per_sample = elapsed / self._sampler.samples if self._sampler.samples else 0
+            totals = {}
+            for stack, count in self._sampler.stacks.items():
+                # Inclusive time: a stack counts once for every focus function on it.
+                for label in {label for label in stack.split(';') if _is_focus(label)}:
+                    totals[label] = totals.get(label, 0) + count
+            steps = [{"function": label, "samples": count, "cumulative_ms": round(count * per_sample * 1000, 2)} for label, count in totals.items()]
+        return sorted(steps, key=lambda step: step["cumulative_ms"], reverse=True)
+
+    def finish(self, route, method, path, status, user_id=None):
+        elapsed = time.perf_counter() - self.started
+        self._stop()
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        summary = {
+            "id": profile_id,
+            "mode": self.mode,
+            "trigger": self.trigger,
+            "route": route,
+            "method": method,
+            "path": path,
+            "status": status,
+            "user_id": user_id,
+            "duration_ms": round(elapsed * 1000, 2),
+            "captured_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "breakdown": self._breakdown(elapsed),
+        }
+        if self._sampler is not None:
+            summary["samples"] = self._sampler.samples
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{profile_id}.{EXTENSIONS[self.mode]}")
+            if self._profiler is not None:
+                self._profiler.dump_stats(path)
+            else:
+                with open(path, 'w', encoding='utf-8') as f:
+                    for stack, count in sorted(self._sampler.stacks.items()):
+                        f.write(f"{stack} {count}\n")
+            with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), 'w', encoding='utf-8') as f:
+                json.dump(summary, f)
+            _prune()
+        except OSError as e:
+            logger.error(f"PROFILING: Could not store profile {profile_id}: {e}")
+            return None
+        logger.info(f"PROFILING: Stored {self.mode} profile {profile_id} of {method} {path} ({summary['duration_ms']} ms).")
+        return profile_id
+
+
+def start(mode, trigger):
+    """Starts profiling the current thread. A deterministic profile already running elsewhere downgrades this one to sampling."""
+    if mode == 'deterministic' and not _DETERMINISTIC_LOCK.acquire(blocking=False):
+        mode = 'sampling'
+    try:
+        return RequestProfile(mode, trigger)
+    except ValueError as e:   # another profiler (e.g. a debugger) owns the hook
+        if mode == 'deterministic':
+            _DETERMINISTIC_LOCK.release()
+        logger.warning(f"PROFILING: Could not start a {mode} profile: {e}")
+        return None
+
+
+def requested_mode(headers, path, is_admin, user_id):
+    """(mode, trigger) if this request should be profiled, else None."""
+    header = headers.get('X-Profile')
+    if header:
+        allowed = is_admin or (PROFILE_TOKEN and hmac.compare_digest(headers.get('X-Profile-Token', '').encode(), PROFILE_TOKEN.encode()))
+        mode = MODES.get(header.strip().lower())
+        return (mode, 'header') if allowed and mode else None
+    if PROFILE_SAMPLE_RATE <= 0 or path not in PROFILE_ROUTES:
+        return None
+    if PROFILE_USER_IDS and str(user_id) not in PROFILE_USER_IDS:
+        return None
+    if random.random() < PROFILE_SAMPLE_RATE:
+        return MODES.get(PROFILE_SAMPLE_MODE, 'sampling'), 'sampled'
+    return None
+
+
+def init_app(app):
+    """Starts a profile before the view when one was asked for, and stores it once the response is ready."""
+    from flask import g, request, session
+
+    @app.before_request
+    def _start_profile():
+        wanted = requested_mode(request.headers, request.path, 'admin_logged_in' in session, session.get('user_id'))
+        if wanted:
+            g.request_profile = start(*wanted)
+
+    @app.after_request
+    def _finish_profile(response):
+        profile = g.pop('request_profile', None)
+        if profile is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            profile_id = profile.finish(route, request.method, request.path, response.status_code, session.get('user_id'))
+            if profile_id:
+                response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    @app.teardown_request
+    def _abandon_profile(error=None):
+        profile = g.pop('request_profile', None)
+        if profile is not None:   # after_request never ran, e.g. the view raised
+            profile.finish(request.url_rule.rule if request.url_rule else 'unmatched', request.method, request.path, 500)
+
+
+# --- Stored profiles ---
+
+def _summary_paths():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    names = [name for name in os.listdir(PROFILE_DIR) if name.endswith('.json')]
+    return sorted(names, key=lambda name: (os.path.getmtime(os.path.join(PROFILE_DIR, name)), name), reverse=True)
+
+
+def _prune():
+    for name in _summary_paths()[PROFILE_MAX_FILES:]:
+        profile_id = name[:-len('.json')]
+        for extension in ('json', *EXTENSIONS.values()):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, f"{profile_id}.{extension}"))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(limit=50):
+    """Summaries of the newest stored profiles, without their breakdowns."""
+    profiles = []
+    for name in _summary_paths()[:limit]:
+        summary = get_profile(name[:-len('.json')])
+        if summary:
+            summary.pop("breakdown", None)
+            profiles.append(summary)
+    return profiles
+
+
+def get_profile(profile_id):
+    """A stored profile's summary, or None when the ID is unknown or malformed."""
+    if not _PROFILE_ID.match(profile_id or ''):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def data_path(profile):
+    """Path of the raw .pstats or .collapsed file behind a summary from get_profile()."""
+    return os.path.join(PROFILE_DIR, f"{profile['id']}.{EXTENSIONS[profile['mode']]}")
+
+
+def render_text(profile, limit=40):
+    """A human-readable top list: pstats sorted by cumulative time, or the heaviest sampled stacks."""
+    path = data_path(profile)
+    if profile["mode"] == 'deterministic':
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+    with open(path, 'r', encoding='utf-8') as f:
+        stacks = [line.rsplit(' ', 1) for line in f if line.strip()]
+    stacks.sort(key=lambda item: int(item[1]), reverse=True)
+    return '\n'.join(f"{int(count):>6}  {stack}" for stack, count in stacks[:limit]) + '\n'
@@ -0,0 +1,193 @@
+# refresh_scheduler.py - Demand- and change-rate-driven refresh schedule for the per-state price stores
+
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import gazetteer
+import price_store
+from config import (
+    PRICE_CACHE_DIR, PRICE_REFRESH_INTERVAL_HOURS, REFRESH_MIN_INTERVAL_MINUTES, REFRESH_MAX_INTERVAL_HOURS,
+    REFRESH_DEMAND_REFERENCE, REFRESH_DEMAND_HALF_LIFE_HOURS
+)
+
+logger = logging.getLogger(__name__)
+
+DEMAND_DIR = os.path.join(PRICE_CACHE_DIR, 'demand')
+SCHEDULE_PATH = os.path.join(PRICE_CACHE_DIR, 'refresh_schedule.json')
+_DEMAND_FLUSH_SECONDS = 60
+_CHANGE_RATE_ALPHA = 0.3
+
+_DECAY_PER_SECOND = math.log(2) / (REFRESH_DEMAND_HALF_LIFE_HOURS * 3600)
+_DEMAND = {}          # state ID -> (decayed lookup count, as of timestamp)
+_DEMAND_LOCK = threading.Lock()
+_LAST_FLUSH = 0.0
+
+
+def _decayed(score, as_of, now):
+    return score * math.exp(-_DECAY_PER_SECOND * max(0.0, now - as_of))
+
+
+# --- Demand, recorded in every worker ---
+
+def record_lookup(state):
+    """Counts one price lookup for a state. Counts decay with REFRESH_DEMAND_HALF_LIFE_HOURS."""
+    global _LAST_FLUSH
+    if not state:
+        return
+    state_id = gazetteer.state_key(state)
+    now = time.time()
+    with _DEMAND_LOCK:
+        score, as_of = _DEMAND.get(state_id, (0.0, now))
+        _DEMAND[state_id] = (_decayed(score, as_of, now) + 1.0, now)
+        should_flush = now - _LAST_FLUSH >= _DEMAND_FLUSH_SECONDS
+        if should_flush:
+            _LAST_FLUSH = now
+            snapshot = dict(_DEMAND)
+    if should_flush:
+        _flush_demand(snapshot)
+
+
+def _flush_demand(snapshot):
+    """Each worker publishes its counts to its own file; the refresh leader sums them."""
+    try:
+        os.makedirs(DEMAND_DIR, exist_ok=True)
+        path = os.path.join(DEMAND_DIR, f"{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({state_id: list(entry) for state_id, entry in snapshot.items()}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.error(f"REFRESH SCHEDULER: Could not publish demand counts: {e}")
+
+
+def host_demand(now=None):
+    """Decayed lookup counts per state ID across every worker on this host."""
+    now = now or time.time()
+    with _DEMAND_LOCK:
+        totals = {state_id: _decayed(score, as_of, now) for state_id, (score, as_of) in _DEMAND.items()}
+    own_file = f"{os.getpid()}.json"
+    try:
+        names = os.listdir(DEMAND_DIR)
+    except OSError:
+        names = []
+    stale_after = 8 * REFRESH_DEMAND_HALF_LIFE_HOURS * 3600
+    for name in names:
+        if not name.endswith('.json') or name == own_file:
+            continue
+        path = os.path.join(DEMAND_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > stale_after:
+                os.remove(path)  # a long-gone worker; its counts have decayed to nothing
+                continue
+            with open(path, 'r') as f:
+                for state_id, (score, as_of) in json.load(f).items():
+                    totals[state_id] = totals.get(state_id, 0.0) + _decayed(score, as_of, now)
+        except (OSError, ValueError, TypeError):
+            continue
+    return totals
+
+
+# --- Schedule, run by the refresh leader ---
+
+class RefreshScheduler:
+    """
+    Keeps the states in a heap ordered by their next due time. A state's interval is the base
+    refresh interval scaled down by recent demand and by how often its data actually changed
+    on past refreshes, clamped to [REFRESH_MIN_INTERVAL_MINUTES, REFRESH_MAX_INTERVAL_HOURS].
+    """
+
+    def __init__(self, states):
+        self.states = {gazetteer.state_key(state): state for state in states}
+        now = time.time()
+        # Existing store files count as refreshes, so a restart doesn't refetch every state at once.
+        self.last_refreshed = {state_id: price_store.last_updated(state) or 0.0 for state_id, state in self.states.items()}
+        self.change_rate = {state_id: 0.5 for state_id in self.states}
+        self.signatures = {}
+        self.failed_at = {}   # state_id -> time of the last failed refresh, until one succeeds
+        self.demand = {}
+        self._heap = []
+        self._reschedule(now)
+
+    def interval(self, state_id):
+        demand_weight = 0.25 + math.log2(1 + self.demand.get(state_id, 0.0) / REFRESH_DEMAND_REFERENCE)
+        change_weight = 0.5 + self.change_rate[state_id]
+        seconds = PRICE_REFRESH_INTERVAL_HOURS * 3600 / (demand_weight * change_weight)
+        return min(max(seconds, REFRESH_MIN_INTERVAL_MINUTES * 60), REFRESH_MAX_INTERVAL_HOURS * 3600)
+
+    def _due(self, state_id):
+        if state_id in self.failed_at:
+            # Retry a failed state after the minimum interval rather than a full one.
+            return self.failed_at[state_id] + REFRESH_MIN_INTERVAL_MINUTES * 60
+        return self.last_refreshed[state_id] + self.interval(state_id)
+
+    def _reschedule(self, now):
+        self.demand = host_demand(now)
+        self._heap = [(self._due(state_id), state_id) for state_id in self.states]
+        heapq.heapify(self._heap)
+
+    def next_due(self, now=None):
+        """Returns (seconds until the next refresh, state name), with fresh demand figures applied."""
+        now = now or time.time()
+        self._reschedule(now)
+        due, state_id = self._heap[0]
+        return max(0.0, due - now), self.states[state_id]
+
+    def record_refresh(self, state, signature, now=None):
+        """
+        Marks a state refreshed. `signature` identifies the data now served, so refreshes that
+        change nothing lower the state's change rate. Pass None after a failed refresh: the
+        change rate and last refresh time stay as they were and the state is retried after
+        REFRESH_MIN_INTERVAL_MINUTES.
+        """
+        now = now or time.time()
+        state_id = gazetteer.state_key(state)
+        if signature is None:
+            # A failed refresh says nothing about how often the data changes.
+            self.failed_at[state_id] = now
+            return
+        previous = self.signatures.get(state_id)
+        if previous is not None:
+            changed = 1.0 if signature != previous else 0.0
+            self.change_rate[state_id] = (1 - _CHANGE_RATE_ALPHA) * self.change_rate[state_id] + _CHANGE_RATE_ALPHA * changed
+        self.signatures[state_id] = signature
+        self.last_refreshed[state_id] = now
+        self.failed_at.pop(state_id, None)
+
+    def snapshot(self, now=None):
+        now = now or time.time()
+        rows = []
+        for due, state_id in sorted(self._heap):
+            rows.append({
+                "state": self.states[state_id],
+                "recent_lookups": round(self.demand.get(state_id, 0.0), 1),
+                "change_rate": round(self.change_rate[state_id], 3),
+                "interval_minutes": round(self.interval(state_id) / 60, 1),
+                "last_refreshed": self.last_refreshed[state_id] or None,
+                "last_failed": self.failed_at.get(state_id),
+                "due_in_minutes": round((due - now) / 60, 1),
+            })
+        return {"generated_at": now, "pid": os.getpid(), "states": rows}
+
+    def publish(self):
+        """Writes the schedule where any worker can serve it."""
+        try:
+            os.makedirs(PRICE_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{SCHEDULE_PATH}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, SCHEDULE_PATH)
+        except OSError as e:
+            logger.error(f"REFRESH SCHEDULER: Could not publish the schedule: {e}")
+
+
+def published_schedule():
+    try:
+        with open(SCHEDULE_PATH, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,83 @@
+# report_export.py - Streaming NDJSON and CSV exports of a user's saved reports
+
+import csv
+import io
+import itertools
+import json
+import logging
+
+import database
+from config import REPORT_EXPORT_ITERSIZE, REPORT_EXPORT_CHUNK_BYTES
+
+logger = logging.getLogger(__name__)
+
+# report_data is fetched as text so the JSONB document is copied into the output as-is,
+# never decoded into Python objects and encoded again.
+NDJSON_COLUMNS = "id, latitude::float8 AS latitude, longitude::float8 AS longitude, saved_at, report_data::text AS report_json"
+
+CSV_FIELDS = ['id', 'saved_at', 'latitude', 'longitude', 'state', 'district', 'soil_type', 'top_crop', 'recommended_crops', 'lang']
+CSV_COLUMNS = (
+    "id, saved_at, latitude, longitude, state, district, soil_type, top_crop, "
+    "array_to_string(ARRAY(SELECT jsonb_array_elements_text(CASE WHEN jsonb_typeof(report_data->'recommendations'->'recommended_crops') = 'array' "
+    "THEN report_data->'recommendations'->'recommended_crops' ELSE '[]'::jsonb END)), '; ') AS recommended_crops, lang"
+)
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _chunked(lines):
+    """
+    Joins small lines into chunks of about REPORT_EXPORT_CHUNK_BYTES for fewer, larger writes.
+    The first line is sent on its own so the client sees bytes as soon as the first fetch returns.
+    """
+    buffer, size, first = [], 0, True
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if first or size >= REPORT_EXPORT_CHUNK_BYTES:
+            first = False
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def _guarded(user_id, chunks):
+    """Headers are already sent once streaming starts, so a failure can only be logged and end the body."""
+    count = 0
+    try:
+        for chunk in chunks:
+            yield chunk
+            count += 1
+    except Exception as e:
+        logger.error(f"REPORT EXPORT: Stream for user {user_id} failed after {count} chunk(s): {e}")
+
+
+def _ndjson_lines(user_id):
+    for row in database.iter_user_reports(user_id, NDJSON_COLUMNS, itersize=REPORT_EXPORT_ITERSIZE):
+        saved_at = row['saved_at'].isoformat() if row['saved_at'] else None
+        meta = json.dumps({"id": row['id'], "latitude": row['latitude'], "longitude": row['longitude'], "saved_at": saved_at})
+        # Splice the stored document in as the last key instead of re-serializing it.
+        yield f'{meta[:-1]}, "report_data": {row["report_json"]}}}\n'
+
+
+def _csv_row(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def _csv_lines(user_id):
+    for row in database.iter_user_reports(user_id, CSV_COLUMNS, itersize=REPORT_EXPORT_ITERSIZE):
+        yield _csv_row([row['saved_at'].isoformat() if field == 'saved_at' and row['saved_at'] else row[field] for field in CSV_FIELDS])
+
+
+def stream_reports(user_id, export_format):
+    """Returns an iterator of text chunks for the given format ('ndjson' or 'csv')."""
+    if export_format == 'csv':
+        # The header row goes out on its own so the download starts before the first fetch.
+        return _guarded(user_id, itertools.chain([_csv_row(CSV_FIELDS)], _chunked(_csv_lines(user_id))))
+    return _guarded(user_id, _chunked(_ndjson_lines(user_id)))
@@ -0,0 +1,86 @@
+# report_sync.py - Bulk ingestion of reports collected offline by field agents
+
+import hashlib
+import json
+import logging
+
+import database
+from config import REPORT_SYNC_MAX_BATCH
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 128
+
+
+def _default_key(report_data):
+    """Content hash, so a resend of an unkeyed report is still recognised as the same report."""
+    canonical = json.dumps(report_data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return "sha256:" + hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _validate(item):
+    """Returns (idempotency_key, latitude, longitude, report_data) or raises ValueError."""
+    if not isinstance(item, dict):
+        raise ValueError("Each item must be an object.")
+    report_data = item.get('report_data')
+    if not isinstance(report_data, dict):
+        raise ValueError("'report_data' must be an object.")
+    location = report_data.get('location') or {}
+    try:
+        latitude, longitude = float(location.get('latitude')), float(location.get('longitude'))
+    except (TypeError, ValueError):
+        raise ValueError("'report_data.location' needs numeric latitude and longitude.")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("Coordinates are out of range.")
+
+    key = item.get('idempotency_key')
+    if key is None:
+        key = _default_key(report_data)
+    elif not isinstance(key, str) or not key.strip() or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"'idempotency_key' must be a non-empty string of at most {MAX_KEY_LENGTH} characters.")
+    return key.strip(), latitude, longitude, report_data
+
+
+def sync_reports(user_id, items):
+    """
+    Validates a batch and stores every valid report in one transaction.
+    Returns (response body, status) with one result per item, in request order.
+    """
+    if not isinstance(items, list) or not items:
+        return {"success": False, "error": "'reports' must be a non-empty list."}, 400
+    if len(items) > REPORT_SYNC_MAX_BATCH:
+        return {"success": False, "error": f"A sync can contain at most {REPORT_SYNC_MAX_BATCH} reports."}, 413
+
+    results, rows, seen = [], [], set()
+    for index, item in enumerate(items):
+        try:
+            key, latitude, longitude, report_data = _validate(item)
+        except ValueError as e:
+            results.append({"index": index, "idempotency_key": item.get('idempotency_key') if isinstance(item, dict) else None, "status": "invalid", "error": str(e)})
+            continue
+        results.append({"index": index, "idempotency_key": key})
+        if key not in seen:
+            seen.add(key)
+            rows.append((key, latitude, longitude, json.dumps(report_data)))
+
+    stored = {}
+    if rows:
+        stored, code = database.save_reports_bulk(user_id, rows)
+        if stored is None:
+            return {"success": False, "error": "Database error while syncing reports."}, code
+
+    counts = {"created": 0, "duplicate": 0, "invalid": 0}
+    created_keys = set()
+    for result in results:
+        if result.get("status") == "invalid":
+            counts["invalid"] += 1
+            continue
+        report_id, created = stored.get(result["idempotency_key"], (None, False))
+        # A key repeated inside one batch is created once; later copies are duplicates of it.
+        is_new = created and result["idempotency_key"] not in created_keys
+        if is_new:
+            created_keys.add(result["idempotency_key"])
+        result.update({"status": "created" if is_new else "duplicate", "report_id": report_id})
+        counts[result["status"]] += 1
+
+    return {"success": True, "summary": counts, "results": results}, 200
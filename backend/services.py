@@ -1,10 +1,8 @@
 import pandas as pd
-import requests
 import json
 import logging
 import io
 import os
-import re
 import numpy as np
 #import tensorflow as tf
 from PIL import Image
@@ -12,19 +10,41 @@ from PIL import Image
 #from tensorflow.keras.applications.mobilenet_v2 import preprocess_input # type: ignore
 from sklearn.metrics.pairwise import cosine_similarity
 from datetime import datetime, timedelta
-import inspect
 import time
+import functools
 import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import database
 from config import (
-    DATA_GOV_IN_API_KEY, OPENWEATHERMAP_API_KEY, 
-    GEMINI_API_KEY, GEMINI_API_URL,
-    RECOMMEND_DATA_PATH, MACRO_NUTRIENT_DATA_PATH
+    OPENWEATHERMAP_API_KEY,
+    GEMINI_API_KEY, GEMINI_API_URL, OPENWEATHERMAP_API_URL, OPEN_METEO_ARCHIVE_URL, PRICE_REFRESHER_ENABLED,
+    RECOMMEND_DATA_PATH, MACRO_NUTRIENT_DATA_PATH,
+    CHAT_MAX_TOOL_ROUNDS, CHAT_TOOL_TIMEOUT_SECONDS, CHAT_TOOL_MAX_WORKERS, CHAT_FAST_PATH_ENABLED,
+    IMAGE_PREPROCESS_WORKERS, VISION_UPLOAD_MAX_SIDE, VISION_API_BATCHING, INFERENCE_BACKEND,
+    REFRESHER_LOCK_PATH, REFRESHER_HEARTBEAT_SECONDS, REFRESHER_ELECTION_RETRY_SECONDS,
+    REFRESH_MIN_INTERVAL_MINUTES, PRICE_STALE_AFTER_HOURS, PRICE_STALE_GRACE_HOURS,
+    FORECAST_CACHE_TTL_SECONDS, FORECAST_STALE_GRACE_SECONDS, HISTORICAL_WEATHER_TTL_HOURS, HISTORICAL_WEATHER_STALE_GRACE_HOURS
 )
 from utils import get_indian_state_from_gps
+import gazetteer
+import mandi_feed
+import price_store
+import spatial_index
+import conversation_store
+import intent_parser
+import fertilizer_table
+import price_matrix
+import inference
+import shared_data
+import leader_election
+import refresh_scheduler
+import swr_cache
+import metrics
+import cassette
+from mandi_feed import PriceIndex
 import base64
 import os
-from tool_registry import TOOL_FUNCTIONS
+import tool_runtime
 from tools import get_tools_schema
 
 CROP_API_URL = os.getenv('CROP_API_URL')
@@ -67,24 +87,54 @@ CROP_TRANSLATIONS_HI = {
 
 logger = logging.getLogger(__name__)
 
-cache = type('dummy_cache', (), {'memoize': lambda self, timeout=None: lambda f: f})()
+_MEMO_CALL = threading.local()   # set when a memoized call had to run its function
+
+class _AppCache:
+    """
+    Stands in for the app's Flask-Caching object, which only arrives through init_cache() after this
+    module has been imported and its @cache.memoize decorators have run. Until then calls go straight through.
+    """
+
+    def __init__(self):
+        self.backend = None
+
+    def memoize(self, timeout=None):
+        def decorator(func):
+            memoized = {}
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                backend = self.backend
+                if backend is None:
+                    return func(*args, **kwargs)
+                if id(backend) not in memoized:
+                    @functools.wraps(func)
+                    def compute(*args, **kwargs):
+                        _MEMO_CALL.missed = True
+                        return func(*args, **kwargs)
+                    memoized[id(backend)] = backend.memoize(timeout=timeout)(compute)
+                _MEMO_CALL.missed = False
+                result = memoized[id(backend)](*args, **kwargs)
+                metrics.count_cache(func.__name__, hit=not _MEMO_CALL.missed)
+                return result
+            return wrapper
+        return decorator
+
+cache = _AppCache()
+_HTTP = cassette.CassetteSession()
 def init_cache(app_cache):
-    global cache
-    cache = app_cache
+    cache.backend = app_cache
 
 _PLANT_HEALTH_MODEL, _SOIL_TYPE_MODEL, _RECOMMEND_DF, _MANDI_DF = None, None, None, None
+# Recommendation data as compact arrays; the features are memory-mapped and shared by all workers.
+_RECOMMEND_FEATURES, _RECOMMEND_LABELS, _RECOMMEND_SOILS = None, None, None
+_SOIL_MASKS = {}
+_SOIL_MASKS_LIMIT = 256   # keyed by predicted or user-supplied soil labels, so capped
 _STATE_MACRO_NUTRIENTS, _CROP_NUTRIENTS_DF, _SOIL_NUTRIENTS_DF = {}, None, None
 _APP_CONTEXT_STRING = "",
 _DISTRICT_TO_STATE_MAP = {}
 _HISTORICAL_PRICES = {}
-PRICE_CACHE_DIR = "price_data_cache"
-
-CROP_ALIASES = {'rice': 'rice|paddy',
-                'wheat': 'wheat',
-                'maize': 'maize|corn',
-                'cotton': 'cotton',
-                'sugarcane': 'sugarcane',
-                'potato': 'potato'}
+_HISTORICAL_PRICE_DATES = {}
 
 '''def load_ml_models():
     global _PLANT_HEALTH_MODEL, _SOIL_TYPE_MODEL
@@ -102,7 +152,7 @@ CROP_ALIASES = {'rice': 'rice|paddy',
             logger.error(f"Error loading soil type model: {e}")'''
 
 def load_datasets():
-    global _PLANT_HEALTH_MODEL, _SOIL_TYPE_MODEL, _RECOMMEND_DF, _STATE_MACRO_NUTRIENTS, _CROP_NUTRIENTS_DF, _SOIL_NUTRIENTS_DF, _MANDI_DF, _APP_CONTEXT_STRING, _DISTRICT_TO_STATE_MAP, _HISTORICAL_PRICES
+    global _PLANT_HEALTH_MODEL, _SOIL_TYPE_MODEL, _RECOMMEND_DF, _RECOMMEND_FEATURES, _RECOMMEND_LABELS, _RECOMMEND_SOILS, _STATE_MACRO_NUTRIENTS, _CROP_NUTRIENTS_DF, _SOIL_NUTRIENTS_DF, _MANDI_DF, _APP_CONTEXT_STRING, _DISTRICT_TO_STATE_MAP, _HISTORICAL_PRICES, _HISTORICAL_PRICE_DATES
 
     try:
         #if PLANT_HEALTH_MODEL_PATH and os.path.exists(PLANT_HEALTH_MODEL_PATH): _PLANT_HEALTH_MODEL = tf.keras.models.load_model(PLANT_HEALTH_MODEL_PATH)
@@ -113,6 +163,11 @@ def load_datasets():
             _RECOMMEND_DF.columns = [ col.strip().lower().replace(' ', '_') for col in _RECOMMEND_DF.columns ]
             if 'soil_type' in _RECOMMEND_DF.columns: _RECOMMEND_DF['soil_type'] = _RECOMMEND_DF['soil_type'].str.lower().str.strip()
             if 'label' in _RECOMMEND_DF.columns: _RECOMMEND_DF['label'] = _RECOMMEND_DF['label'].str.lower().str.strip()
+            _RECOMMEND_FEATURES = shared_data.publish_array('recommend_features', _RECOMMEND_DF[RECOMMEND_FEATURES].to_numpy(dtype=float))
+            _RECOMMEND_LABELS = _RECOMMEND_DF['label'].to_numpy(dtype=object)
+            _RECOMMEND_SOILS = _RECOMMEND_DF['soil_type'].fillna('').to_numpy(dtype=object)
+            _SOIL_MASKS.clear()
+            _RECOMMEND_DF = None  # everything the recommender needs is in the arrays above
         
         if MACRO_NUTRIENT_DATA_PATH and os.path.exists(MACRO_NUTRIENT_DATA_PATH):
             macro_df = pd.read_csv(MACRO_NUTRIENT_DATA_PATH)
@@ -122,6 +177,14 @@ def load_datasets():
         
         if os.path.exists('data/soil_nutrients.csv'): _SOIL_NUTRIENTS_DF = pd.read_csv('data/soil_nutrients.csv'); _SOIL_NUTRIENTS_DF['soil_type'] = _SOIL_NUTRIENTS_DF['soil_type'].str.lower().str.strip()
         
+        if os.path.exists('data/app_context.txt'):
+            with open('data/app_context.txt', 'r', encoding='utf-8') as f: _APP_CONTEXT_STRING = f.read()
+        if os.path.exists('data/district_to_state.json'):
+            with open('data/district_to_state.json', 'r', encoding='utf-8') as f: _DISTRICT_TO_STATE_MAP = {k.lower(): v for k, v in json.load(f).items()}
+        state_districts = {}
+        if os.path.exists('data/state_districts.json'):
+            with open('data/state_districts.json', 'r', encoding='utf-8') as f: state_districts = json.load(f)
+
         static_mandi_path = os.path.join('data', 'mandi_prices.csv')
         if os.path.exists(static_mandi_path):
             try:
@@ -130,7 +193,7 @@ def load_datasets():
                 _MANDI_DF.columns = [col.replace('_x0020_', ' ').strip().lower() for col in _MANDI_DF.columns]
 
                 _MANDI_DF['modal price'] = pd.to_numeric(_MANDI_DF['modal price'], errors='coerce')
-                _MANDI_DF.dropna(subset=['modal price'], inplace=True)
+                _MANDI_DF.dropna(subset=['modal price', 'state', 'district', 'commodity'], inplace=True)
                 
                 # Correctly parse the 'arrival_date' column
                 if 'arrival_date' in _MANDI_DF.columns:
@@ -139,37 +202,46 @@ def load_datasets():
                     _MANDI_DF['arrival_date'] = "an earlier date"
                 
                 logger.info("SUCCESS: Mandi Price CSV loaded and columns cleaned.")
+            except Exception as e:
+                logger.error(f"CRITICAL ERROR loading or parsing static mandi CSV '{static_mandi_path}': {e}")
+                _MANDI_DF = None
+
+        # Every district and commodity name we know of resolves to one canonical ID.
+        gazetteer.build(
+            state_districts=state_districts,
+            district_to_state=_DISTRICT_TO_STATE_MAP,
+            locations=list(_MANDI_DF[['state', 'district']].drop_duplicates().itertuples(index=False) if _MANDI_DF is not None else ()) + spatial_index.district_locations(),
+            commodities=_MANDI_DF['commodity'].dropna().unique() if _MANDI_DF is not None else (),
+            commodity_translations=CROP_TRANSLATIONS_HI
+        )
+        fertilizer_table.build(_CROP_NUTRIENTS_DF, _SOIL_NUTRIENTS_DF, _STATE_MACRO_NUTRIENTS)
 
-                normalization_map = {
-                    alias.lower().strip(): standard_name 
-                    for standard_name, aliases in CROP_ALIASES.items() 
-                    for alias in aliases.split('|')
-                }
+        if _MANDI_DF is not None:
+            # Map each distinct name once, then group on the canonical IDs.
+            location_pairs = _MANDI_DF[['state', 'district']].drop_duplicates()
+            state_ids = {state: gazetteer.state_key(state) for state in location_pairs['state'].unique()}
+            district_ids = {(state, district): gazetteer.district_key(district, state, fuzzy=False) for state, district in location_pairs.itertuples(index=False)}
+            commodity_ids = {commodity: gazetteer.commodity_key(commodity, fuzzy=False) for commodity in _MANDI_DF['commodity'].unique()}
 
-                _MANDI_DF['commodity'] = _MANDI_DF['commodity'].str.lower().str.strip()
-                _MANDI_DF['commodity'] = _MANDI_DF['commodity'].replace(normalization_map)
+            _MANDI_DF['district'] = [district_ids[pair] for pair in zip(_MANDI_DF['state'], _MANDI_DF['district'])]
+            _MANDI_DF['state'] = _MANDI_DF['state'].map(state_ids)
+            _MANDI_DF['commodity'] = _MANDI_DF['commodity'].map(commodity_ids)
 
-                _MANDI_DF['state'] = _MANDI_DF['state'].str.lower().str.strip()
-                _MANDI_DF['district'] = _MANDI_DF['district'].str.lower().str.strip()
+            district_groups = _MANDI_DF.groupby(['state', 'district', 'commodity']).agg(price=('modal price', 'mean'), latest=('arrival_date', 'max'))
+            for index, row in district_groups.iterrows():
+                _HISTORICAL_PRICES[index] = round(row['price'])
+                _HISTORICAL_PRICE_DATES[index] = row['latest'] if pd.notna(row['latest']) else None
 
-                district_groups = _MANDI_DF.groupby(['state', 'district', 'commodity'])['modal price'].mean()
-                for index, avg_price in district_groups.items():
-                    _HISTORICAL_PRICES[index] = round(avg_price)
+            state_groups = _MANDI_DF.groupby(['state', 'commodity']).agg(price=('modal price', 'mean'), latest=('arrival_date', 'max'))
+            for (state, commodity), row in state_groups.iterrows():
+                _HISTORICAL_PRICES[(state, '__state_avg__', commodity)] = round(row['price'])
+                _HISTORICAL_PRICE_DATES[(state, '__state_avg__', commodity)] = row['latest'] if pd.notna(row['latest']) else None
 
-                state_groups = _MANDI_DF.groupby(['state', 'commodity'])['modal price'].mean()
-                for index, avg_price in state_groups.items():
-                    state, commodity = index
-                    _HISTORICAL_PRICES[(state, '__state_avg__', commodity)] = round(avg_price)
+            logger.info(f"SUCCESS: Pre-computed {len(_HISTORICAL_PRICES)} historical price averages.")
 
-                logger.info(f"SUCCESS: Pre-computed {len(_HISTORICAL_PRICES)} historical price averages.")
-
-            except Exception as e:
-                logger.error(f"CRITICAL ERROR loading or parsing static mandi CSV '{static_mandi_path}': {e}")
-        
-        if os.path.exists('data/app_context.txt'):
-            with open('data/app_context.txt', 'r', encoding='utf-8') as f: _APP_CONTEXT_STRING = f.read()
-        if os.path.exists('data/district_to_state.json'):
-            with open('data/district_to_state.json', 'r', encoding='utf-8') as f: _DISTRICT_TO_STATE_MAP = {k.lower(): v for k, v in json.load(f).items()}
+        # Only the derived tables are used at request time; dropping the raw frames keeps
+        # them out of every worker's memory.
+        _MANDI_DF, _CROP_NUTRIENTS_DF, _SOIL_NUTRIENTS_DF = None, None, None
 
     except Exception as e:
         logger.error(f"Failed to load data: {e}", exc_info=True)
@@ -179,72 +251,172 @@ def load_all_data():
     load_datasets()
 
 def find_state_from_district(district: str) -> str:
-    state = _DISTRICT_TO_STATE_MAP.get(district.lower().strip())
-    if state:
-        logger.info(f"Internal search: Found state '{state}' for district '{district}'.")
-        return state
+    match = gazetteer.resolve_district(district)
+    if match:
+        logger.info(f"Internal search: Found state '{match.state}' for district '{district}' (matched '{match.name}', score {match.score}).")
+        return match.state
     else:
         logger.warning(f"Internal search: Could not find a state for district '{district}'.")
         return None
 
-def analyze_crop_health(image_data):
-    # We now use CROP_API_URL, which will point to our unified endpoint
-    if not CROP_API_URL:
+LOCAL_MODEL_UNAVAILABLE = {"error": "The local vision model is not available."}
+
+def local_analysis_result(result):
+    """
+    A local model result as served, or None to fall back to the remote vision service.
+    With INFERENCE_BACKEND='local' there is no fallback: a missing model or a failure is the answer.
+    """
+    if INFERENCE_BACKEND == 'local':
+        return result or dict(LOCAL_MODEL_UNAVAILABLE)
+    if result is None or "error" in result:
+        return None
+    return result
+
+def _local_analysis(mode, image_data):
+    """In-process model result, or None to fall back to the remote vision service."""
+    return local_analysis_result(inference.classify(mode, image_data))
+
+def _remote_analysis(api_url, mode, image_data):
+    # CROP_API_URL and SOIL_API_URL point to the same unified endpoint; the mode selects the model.
+    if not api_url:
         return {"error": "Vision service URL is not configured."}
     
     b64_image = base64.b64encode(image_data).decode('utf-8')
     # The payload now sends the image AND the mode
-    payload = {"data": [f"data:image/jpeg;base64,{b64_image}", "Crop"]}
+    payload = {"data": [f"data:image/jpeg;base64,{b64_image}", mode]}
 
     try:
-        response = requests.post(CROP_API_URL, json=payload, timeout=60)
+        response = _HTTP.post(api_url, json=payload, timeout=60)
         response.raise_for_status()
         return response.json().get("data", [{}])[0]
     except Exception as e:
-        logger.error(f"Error calling Vision API for Crop: {e}")
+        logger.error(f"Error calling Vision API for {mode}: {e}")
         return {"error": "The AI vision service is currently unavailable."}
 
-def analyze_soil_type(image_data):
-    # We now use SOIL_API_URL, which will ALSO point to our unified endpoint
-    if not SOIL_API_URL:
-        return {"error": "Vision service URL is not configured."}
+def analyze_crop_health(image_data):
+    return _local_analysis(inference.CROP, image_data) or _remote_analysis(CROP_API_URL, inference.CROP, image_data)
 
-    b64_image = base64.b64encode(image_data).decode('utf-8')
-    # The payload now sends the image AND the mode
-    payload = {"data": [f"data:image/jpeg;base64,{b64_image}", "Soil"]}
+def analyze_soil_type(image_data):
+    return _local_analysis(inference.SOIL, image_data) or _remote_analysis(SOIL_API_URL, inference.SOIL, image_data)
 
+def _prepare_upload(image_data):
+    """Downscales and re-encodes an image as JPEG so batched uploads stay small."""
     try:
-        response = requests.post(SOIL_API_URL, json=payload, timeout=60)
-        response.raise_for_status()
-        return response.json().get("data", [{}])[0]
+        with Image.open(io.BytesIO(image_data)) as img:
+            img = img.convert('RGB')
+            img.thumbnail((VISION_UPLOAD_MAX_SIDE, VISION_UPLOAD_MAX_SIDE))
+            buffer = io.BytesIO()
+            img.save(buffer, format='JPEG', quality=90)
+            return buffer.getvalue()
     except Exception as e:
-        logger.error(f"Error calling Vision API for Soil: {e}")
-        return {"error": "The AI vision service is currently unavailable."}
+        logger.error(f"Could not preprocess an uploaded image: {e}")
+        return None
+
+def _remote_analysis_many(api_url, mode, images):
+    """
+    One batched request when the vision endpoint accepts list inputs (VISION_API_BATCHING),
+    otherwise one request per image, all in flight at once.
+    """
+    if VISION_API_BATCHING and api_url:
+        b64_images = [f"data:image/jpeg;base64,{base64.b64encode(image_data).decode('utf-8')}" for image_data in images]
+        try:
+            response = _HTTP.post(api_url, json={"data": [b64_images, [mode] * len(images)]}, timeout=60)
+            response.raise_for_status()
+            results = response.json().get("data", [[]])[0]
+            if isinstance(results, list) and len(results) == len(images):
+                return results
+            logger.error(f"Vision API returned {len(results) if isinstance(results, list) else 'no'} results for a batch of {len(images)}.")
+        except Exception as e:
+            logger.error(f"Error calling Vision API for a {mode} batch: {e}")
+    with ThreadPoolExecutor(max_workers=max(1, min(IMAGE_PREPROCESS_WORKERS, len(images)))) as executor:
+        return list(executor.map(lambda image_data: _remote_analysis(api_url, mode, image_data), images))
+
+def disease_advice_prompt(disease_name):
+    return (
+        f"You are an expert agronomist creating a concise guide for an Indian farmer whose crop has **{disease_name}**."
+        f"Follow these rules STRICTLY:\n"
+        f"1. The ENTIRE response MUST be under 350 words.\n"
+        f"2. Use simple, direct language. Avoid jargon.\n"
+        f"3. Focus ONLY on the most critical, actionable steps for treatment and prevention.\n"
+        f"4. Structure the output using this exact format: **Description:** ... ## **Symptoms:** ... ## **Treatment:** ... ## **Prevention:** ...\n"
+        f"5. Under Treatment and Prevention, use a simple numbered list (e.g., 1., 2., 3.) for the key actions."
+    )
+
+def _aggregate_plot(results):
+    """Per-plot verdict from several leaf images: each disease with its image count and mean confidence."""
+    diseases, healthy, failed = {}, 0, 0
+    for result in results:
+        if "error" in result:
+            failed += 1
+        elif result.get("is_healthy"):
+            healthy += 1
+        else:
+            stats = diseases.setdefault(result.get("prediction"), {"images": 0, "confidence_total": 0.0})
+            stats["images"] += 1
+            stats["confidence_total"] += float(result.get("confidence") or 0)
+    ranked = sorted(diseases.items(), key=lambda item: (-item[1]["images"], -item[1]["confidence_total"]))
+    return {
+        "is_healthy": not diseases and healthy > 0,
+        "prediction": ranked[0][0] if ranked else ("Healthy" if healthy else None),
+        "healthy_images": healthy,
+        "failed_images": failed,
+        "diseases": [{"name": name, "images": stats["images"], "avg_confidence": round(stats["confidence_total"] / stats["images"], 4)} for name, stats in ranked],
+    }
+
+def analyze_crop_images(plots):
+    """
+    Multi-image crop health analysis. `plots` maps plot ID -> list of raw images.
+    All images go to the model as one batch, predictions are aggregated per plot and
+    each distinct disease gets a single advice request.
+    """
+    order = [(plot_id, image_data) for plot_id, images in plots.items() for image_data in images]
+    images = [image_data for _, image_data in order]
+
+    results = inference.classify_many(inference.CROP, images) or [None] * len(images)
+    pending = [i for i, result in enumerate(results) if result is None or "error" in result]
+    if INFERENCE_BACKEND == 'local':
+        results = [local_analysis_result(result) for result in results]
+    elif pending:
+        # Whatever the local model couldn't handle goes to the vision service, downscaled first.
+        with ThreadPoolExecutor(max_workers=max(1, min(IMAGE_PREPROCESS_WORKERS, len(pending)))) as executor:
+            uploads = list(executor.map(_prepare_upload, [images[i] for i in pending]))
+        readable = [(i, upload) for i, upload in zip(pending, uploads) if upload is not None]
+        for i in pending:
+            results[i] = {"error": "The image could not be read."}
+        if readable:
+            remote_results = _remote_analysis_many(CROP_API_URL, inference.CROP, [upload for _, upload in readable])
+            for (i, _), result in zip(readable, remote_results):
+                results[i] = result
+
+    per_plot = {plot_id: {"images": []} for plot_id in plots}
+    for (plot_id, _), result in zip(order, results):
+        per_plot[plot_id]["images"].append(result)
+    for plot in per_plot.values():
+        plot["summary"] = _aggregate_plot(plot["images"])
+
+    distinct_diseases = sorted({disease["name"] for plot in per_plot.values() for disease in plot["summary"]["diseases"] if disease["name"]})
+    advice = {}
+    if distinct_diseases:
+        # Bounded like the upload pool above, so one request can't open a Gemini call per disease at once.
+        with ThreadPoolExecutor(max_workers=max(1, min(IMAGE_PREPROCESS_WORKERS, len(distinct_diseases)))) as executor:
+            advice = dict(zip(distinct_diseases, executor.map(lambda disease: _get_cached_report_advice(disease_advice_prompt(disease)), distinct_diseases)))
+
+    return {"plots": per_plot, "advice": advice, "images_analyzed": len(images)}
 
 def list_my_reports(user_id):
     """
     Fetches a list of all saved reports for a given user ID.
     """
-    reports_data, _ = database.get_user_reports(user_id)
-    if not reports_data.get("success") or not reports_data.get("reports"):
+    reports = database.get_user_report_summaries(user_id, limit=5)
+    if not reports:
         return "You have no saved reports. You can create one from the 'Analyze Field' page."
     
     formatted_reports = []
-    for report in reports_data["reports"][:5]:
+    for report in reports:
         try:
-            report_data = report.get('report_data', {})
-            if isinstance(report_data, str):
-                report_data = json.loads(report_data)
-
-            saved_at_date = report.get('saved_at')
-            if saved_at_date:
-                report_date = saved_at_date.strftime('%b %d, %Y')
-            else:
-                report_date = datetime.fromisoformat(report_data.get('generated_at')).strftime('%b %d, %Y')
-
             formatted_reports.append({
                 "report_id": report['id'], 
-                "date": report_date,
+                "date": report['saved_at'].strftime('%b %d, %Y'),
             })
         except Exception as e:
             logger.error(f"Error parsing a report for the chatbot: {e}")
@@ -262,20 +434,24 @@ def get_specific_report(user_id, report_id: int):
     Fetches a single user report by its ID and returns a clean,
     Markdown-formatted summary.
     """
-    report_record = database.get_report_by_id(user_id, report_id)
+    report_record = database.get_report_summary_by_id(user_id, report_id)
     if not report_record:
         return f"Error: I could not find a report with the ID {report_id}."
-        
+    return _format_report_summary(report_id, report_record)
+
+def _format_report_summary(report_id, report_record, lang='en'):
     try:
-        report_data = report_record['report_data']
-        if isinstance(report_data, str):
-            report_data = json.loads(report_data)
-            
-        loc = report_data.get('location', {})
-        soil = report_data.get('soil_analysis', {})
-        recs = report_data.get('recommendations', {})
-        
         date_obj = report_record['saved_at']
+        if lang == 'hi':
+            soil_type = report_record.get('soil_type')
+            crops_str = ', '.join(CROP_TRANSLATIONS_HI.get(str(crop).lower(), crop) for crop in report_record.get('recommended_crops') or []) or 'उपलब्ध नहीं'
+            return (
+                f"**रिपोर्ट #{report_id} का सारांश**\n"
+                f"- **तारीख:** {date_obj.strftime('%d/%m/%Y')}\n"
+                f"- **स्थान:** {report_record.get('district') or 'उपलब्ध नहीं'}, {report_record.get('state') or 'उपलब्ध नहीं'}\n"
+                f"- **मिट्टी का प्रकार:** {SOIL_TRANSLATIONS_HI.get(str(soil_type).lower(), soil_type) if soil_type else 'उपलब्ध नहीं'}\n"
+                f"- **शीर्ष अनुशंसित फसलें:** {crops_str}"
+            )
         day = date_obj.day
         if 4 <= day <= 20 or 24 <= day <= 30:
             suffix = "th"
@@ -283,13 +459,13 @@ def get_specific_report(user_id, report_id: int):
             suffix = ["st", "nd", "rd"][day % 10 - 1]
         formatted_date = date_obj.strftime(f'%B {day}{suffix}, %Y')
 
-        crops_str = ', '.join(recs.get('recommended_crops', ['N/A']))
+        crops_str = ', '.join(report_record.get('recommended_crops') or ['N/A'])
         
         summary = (
             f"**Summary for Report #{report_id}**\n"
             f"- **Date:** {formatted_date}\n"
-            f"- **Location:** {loc.get('district', 'N/A')}, {loc.get('state', 'N/A')}\n"
-            f"- **Soil Type:** {soil.get('prediction', 'N/A')}\n"
+            f"- **Location:** {report_record.get('district') or 'N/A'}, {report_record.get('state') or 'N/A'}\n"
+            f"- **Soil Type:** {report_record.get('soil_type') or 'N/A'}\n"
             f"- **Top Recommended Crops:** {crops_str}"
         )
         return summary
@@ -297,121 +473,180 @@ def get_specific_report(user_id, report_id: int):
         logger.error(f"Error reading report data for chatbot summary: {e}")
         return f"Error: Could not read the data for report ID {report_id}."
 
-@cache.memoize(timeout=7200)
+FORECAST_CACHE = swr_cache.SWRCache('forecast', FORECAST_CACHE_TTL_SECONDS, FORECAST_STALE_GRACE_SECONDS)
+HISTORICAL_WEATHER_CACHE = swr_cache.SWRCache('historical_weather', HISTORICAL_WEATHER_TTL_HOURS * 3600, HISTORICAL_WEATHER_STALE_GRACE_HOURS * 3600)
+
+def default_forecast():
+    return {"current": {"temperature": "N/A", "humidity": "N/A", "description": "N/A"}, "forecast": []}
+
+def forecast_key(latitude, longitude, lang):
+    """Cache key of a forecast (~100 m cell), or None for unusable coordinates."""
+    try:
+        return (round(float(latitude), 3), round(float(longitude), 3), lang)
+    except (TypeError, ValueError):
+        return None
+
 def get_forecast_data(latitude, longitude, lang='en'):
     """
     Fetches forecast data from OpenWeatherMap, correctly passing the language parameter.
+    Past FORECAST_CACHE_TTL_SECONDS the cached forecast is served with is_stale set while it refreshes.
     """
-    default = {"current": {"temperature": "N/A", "humidity": "N/A", "description": "N/A"}, "forecast": []}
-    if not OPENWEATHERMAP_API_KEY:
-        return default
+    key = forecast_key(latitude, longitude, lang)
+    if not OPENWEATHERMAP_API_KEY or key is None:
+        return default_forecast()
 
-    url = f"https://api.openweathermap.org/data/2.5/forecast?lat={latitude}&lon={longitude}&appid={OPENWEATHERMAP_API_KEY}&units=metric&lang={lang}"
-    
+    forecast, is_stale = FORECAST_CACHE.get(key, lambda: fetch_forecast(latitude, longitude, lang))
+    if forecast is None:
+        return default_forecast()
+    return {**forecast, "is_stale": is_stale}
+
+def forecast_url(latitude, longitude, lang):
+    return f"{OPENWEATHERMAP_API_URL}?lat={latitude}&lon={longitude}&appid={OPENWEATHERMAP_API_KEY}&units=metric&lang={lang}"
+
+def fetch_forecast(latitude, longitude, lang):
+    """One OpenWeatherMap forecast call; None on failure so the error isn't cached."""
     try:
-        data = requests.get(url, timeout=10).json()
-
-        if 'list' not in data or not data['list']:
-            return default
-
-        current = {
-            "temperature": data['list'][0]['main']['temp'],
-            "humidity": data['list'][0]['main']['humidity'],
-            "description": data['list'][0]['weather'][0]['description']
-        }
-
-        daily = {}
-        for item in data['list']:
-            date = datetime.fromtimestamp(item['dt']).strftime('%Y-%m-%d')
-            if date not in daily:
-                daily[date] = {'max': [], 'min': [], 'icons': {}}
-            daily[date]['max'].append(item['main']['temp_max'])
-            daily[date]['min'].append(item['main']['temp_min'])
-            daily[date]['icons'][item['weather'][0]['icon']] = daily[date]['icons'].get(item['weather'][0]['icon'], 0) + 1
-            
-        forecast = [{"day_name": datetime.strptime(d, '%Y-%m-%d').strftime('%a'), "temp_max": max(v['max']), "temp_min": min(v['min']), "icon": max(v['icons'], key=v['icons'].get)} for d, v in sorted(daily.items()) if d != datetime.now().strftime('%Y-%m-%d')][:5]
-        
-        return {"current": current, "forecast": forecast}
-        
+        return parse_forecast(_HTTP.get(forecast_url(latitude, longitude, lang), timeout=10).json())
     except Exception as e:
         logger.error(f"Error fetching forecast from OpenWeatherMap: {e}")
-        return default
+        return None
+
+def parse_forecast(data):
+    """Current conditions and the next five days from an OpenWeatherMap forecast payload; None if it has no entries."""
+    if 'list' not in data or not data['list']:
+        return None
+
+    current = {
+        "temperature": data['list'][0]['main']['temp'],
+        "humidity": data['list'][0]['main']['humidity'],
+        "description": data['list'][0]['weather'][0]['description']
+    }
+
+    daily = {}
+    for item in data['list']:
+        date = datetime.fromtimestamp(item['dt']).strftime('%Y-%m-%d')
+        if date not in daily:
+            daily[date] = {'max': [], 'min': [], 'icons': {}}
+        daily[date]['max'].append(item['main']['temp_max'])
+        daily[date]['min'].append(item['main']['temp_min'])
+        daily[date]['icons'][item['weather'][0]['icon']] = daily[date]['icons'].get(item['weather'][0]['icon'], 0) + 1
+        
+    forecast = [{"day_name": datetime.strptime(d, '%Y-%m-%d').strftime('%a'), "temp_max": max(v['max']), "temp_min": min(v['min']), "icon": max(v['icons'], key=v['icons'].get)} for d, v in sorted(daily.items()) if d != datetime.now().strftime('%Y-%m-%d')][:5]
+    
+    return {"current": current, "forecast": forecast}
 
 def get_weather_data(lat, lon, lang='en'): 
     return get_forecast_data(lat, lon, lang=lang).get('current', {})
 
 def get_historical_weather_summary(lat, lon, lang='en'):
-    default = {"kharif_avg_temp": 28, "rabi_avg_temp": 22, "kharif_total_rainfall": 800, "rabi_total_rainfall": 150, "note": "Could not retrieve historical data."}
+    """
+    Seasonal temperature and rainfall over the past year, cached per ~1 km cell. Past
+    HISTORICAL_WEATHER_TTL_HOURS the cached summary is served with is_stale set while it refreshes.
+    """
+    key = historical_weather_key(lat, lon, lang)
+    if key is None:
+        return default_historical_weather()
+
+    summary, is_stale = HISTORICAL_WEATHER_CACHE.get(key, lambda: fetch_historical_weather(key[0], key[1], lang))
+    if summary is None:
+        return default_historical_weather()
+    return {**summary, "is_stale": is_stale}
+
+def default_historical_weather():
+    return {"kharif_avg_temp": 28, "rabi_avg_temp": 22, "kharif_total_rainfall": 800, "rabi_total_rainfall": 150, "note": "Could not retrieve historical data."}
+
+def historical_weather_key(lat, lon, lang):
+    """Cache key of a historical summary (~1 km cell), or None for unusable coordinates."""
     try:
-        end, start = datetime.now(), datetime.now() - timedelta(days=365)
-        params = {"latitude": lat, "longitude": lon, "start_date": start.strftime('%Y-%m-%d'), "end_date": end.strftime('%Y-%m-%d'), "daily": "temperature_2m_mean,precipitation_sum"}
-        res = requests.get("https://archive-api.open-meteo.com/v1/archive", params=params, timeout=20).json()['daily']
-        df = pd.DataFrame(res)
-        df['time'] = pd.to_datetime(df['time'])
-        
-        kharif = df[df.time.dt.month.isin([6,7,8,9,10])]
-        rabi = df[df.time.dt.month.isin([11,12,1,2,3,4])]
-        
-        kharif_rain = kharif.precipitation_sum.sum()
-        rabi_rain = rabi.precipitation_sum.sum()
-        data_note = None
+        return (round(float(lat), 2), round(float(lon), 2), lang)
+    except (TypeError, ValueError):
+        return None
 
-        if kharif_rain < 100 or rabi_rain < 50:
-            if lang == 'hi':
-                data_note = "ध्यान दें: इस स्थान के लिए ऐतिहासिक वर्षा डेटा अधूरा हो सकता है, जो सिफारिश की सटीकता को प्रभावित कर सकता है।"
-            else:
-                data_note = "Note: Historical rainfall data may be incomplete for this specific location, which can affect recommendation accuracy."
-                    
-        return {
-            "kharif_avg_temp": kharif.temperature_2m_mean.mean(), 
-            "rabi_avg_temp": rabi.temperature_2m_mean.mean(), 
-            "kharif_total_rainfall": kharif_rain, 
-            "rabi_total_rainfall": rabi_rain,
-            "note": data_note
-        }
-    except Exception:
-        return default
+def historical_weather_params(lat, lon):
+    end, start = datetime.now(), datetime.now() - timedelta(days=365)
+    return {"latitude": lat, "longitude": lon, "start_date": start.strftime('%Y-%m-%d'), "end_date": end.strftime('%Y-%m-%d'), "daily": "temperature_2m_mean,precipitation_sum"}
 
-def get_crop_recommendations(state, soil_results, weather, historical, last_crop, lang='en'):
-    if _RECOMMEND_DF is None or _RECOMMEND_DF.empty: 
-        return {"recommended_crops": [], "considerations": "Recommendation data unavailable."}
-    
-    soil_type_prediction = soil_results.get("prediction", "unknown").lower()
-    
-    search_term = "clay" if "clay" in soil_type_prediction else soil_type_prediction.split(' ')[0]
-    
-    soil_filtered_df = _RECOMMEND_DF[_RECOMMEND_DF['soil_type'].str.contains(search_term, case=False, na=False)].copy()
-    
-    if soil_filtered_df.empty: 
-        return {"recommended_crops": [], "considerations": f"No crop data for detected soil type: {soil_results.get('prediction')}."}
+def fetch_historical_weather(lat, lon, lang):
+    """One Open-Meteo archive call; None on failure so the error isn't cached."""
+    try:
+        res = _HTTP.get(OPEN_METEO_ARCHIVE_URL, params=historical_weather_params(lat, lon), timeout=20).json()['daily']
+        return summarise_historical_weather(res, lang)
+    except Exception as e:
+        logger.error(f"Error fetching historical weather from Open-Meteo: {e}")
+        return None
+
+def summarise_historical_weather(daily, lang):
+    """Kharif and rabi averages from the "daily" block of an Open-Meteo archive response."""
+    df = pd.DataFrame(daily)
+    df['time'] = pd.to_datetime(df['time'])
     
-    is_kharif = 5 <= datetime.now().month <= 10
+    kharif = df[df.time.dt.month.isin([6,7,8,9,10])]
+    rabi = df[df.time.dt.month.isin([11,12,1,2,3,4])]
     
+    kharif_rain = kharif.precipitation_sum.sum()
+    rabi_rain = rabi.precipitation_sum.sum()
+    data_note = None
+
+    if kharif_rain < 100 or rabi_rain < 50:
+        if lang == 'hi':
+            data_note = "ध्यान दें: इस स्थान के लिए ऐतिहासिक वर्षा डेटा अधूरा हो सकता है, जो सिफारिश की सटीकता को प्रभावित कर सकता है।"
+        else:
+            data_note = "Note: Historical rainfall data may be incomplete for this specific location, which can affect recommendation accuracy."
+                
+    return {
+        "kharif_avg_temp": kharif.temperature_2m_mean.mean(), 
+        "rabi_avg_temp": rabi.temperature_2m_mean.mean(), 
+        "kharif_total_rainfall": kharif_rain, 
+        "rabi_total_rainfall": rabi_rain,
+        "note": data_note
+    }
+
+RECOMMEND_FEATURES = ['n', 'p', 'k', 'temperature', 'humidity', 'ph', 'rainfall']
+
+def soil_search_term(soil_prediction):
+    """The word used to match a predicted soil label against the recommendation dataset."""
+    soil_type_prediction = str(soil_prediction or "unknown").lower()
+    return "clay" if "clay" in soil_type_prediction else soil_type_prediction.split(' ')[0]
+
+def soil_candidates(search_term):
+    """(feature matrix, labels) of the dataset rows for one soil search term; empty arrays if none match."""
+    search_term = search_term.lower()
+    mask = _SOIL_MASKS.get(search_term)
+    if mask is None:
+        if len(_SOIL_MASKS) >= _SOIL_MASKS_LIMIT:
+            _SOIL_MASKS.clear()
+        mask = _SOIL_MASKS[search_term] = np.array([search_term in soil for soil in _RECOMMEND_SOILS], dtype=bool)
+    return _RECOMMEND_FEATURES[mask], _RECOMMEND_LABELS[mask]
+
+def is_kharif_season(today=None):
+    return 5 <= (today or datetime.now()).month <= 10
+
+def climate_target_vector(state, weather, historical, is_kharif):
+    """The N, P, K, temperature, humidity, pH, rainfall vector a field is scored against."""
     temp = historical.get('kharif_avg_temp', 28) if is_kharif else historical.get('rabi_avg_temp', 22)
-    
     rain_total = historical.get('kharif_total_rainfall', 800) if is_kharif else historical.get('rabi_total_rainfall', 150)
-    
     rain_monthly = ((np.clip(rain_total, 300, 1500) / 5) if is_kharif else (np.clip(rain_total, 300, 1500) / 6))
-    
-    nutrients = _STATE_MACRO_NUTRIENTS.get(state.upper(), {'N': 60, 'P': 45, 'K': 45})
-    
-    target_vector = np.array([nutrients.get('N', 60), nutrients.get('P', 45), nutrients.get('K', 45), temp, weather.get('humidity', 65), 6.5, rain_monthly])
-    
-    dataset_vectors = soil_filtered_df[['n', 'p', 'k', 'temperature', 'humidity', 'ph', 'rainfall']].values
-    
-    soil_filtered_df['similarity'] = cosine_similarity([target_vector], dataset_vectors)[0]
-    
-    strong_matches_df = soil_filtered_df[soil_filtered_df['similarity'] > 0.90]
-    
-    if not strong_matches_df.empty:
-        recs = strong_matches_df.sort_values(by='similarity', ascending=False)['label'].unique().tolist()
+    nutrients = _STATE_MACRO_NUTRIENTS.get(str(state).upper(), {'N': 60, 'P': 45, 'K': 45})
+    try:
+        humidity = float(weather.get('humidity', 65))
+    except (TypeError, ValueError):
+        humidity = 65  # the forecast fallback reports "N/A"
+    return np.array([nutrients.get('N', 60), nutrients.get('P', 45), nutrients.get('K', 45), temp, humidity, 6.5, rain_monthly], dtype=float)
+
+def rank_crops(similarities, labels, last_crop, lang='en'):
+    """Turns one field's similarity scores against `labels` into the recommendation response."""
+    order = np.argsort(-similarities, kind='stable')
+    strong = order[similarities[order] > 0.90]
+
+    if strong.size:
+        recs = list(dict.fromkeys(labels[strong].tolist()))
         if lang == 'hi':
             considerations = "आपकी मिट्टी के प्रकार और क्षेत्रीय जलवायु पर आधारित।"
         else:
             considerations = "Based on your soil type and regional climate."
 
     else:
-        recs = soil_filtered_df.sort_values(by='similarity', ascending=False)['label'].unique().tolist()
+        recs = list(dict.fromkeys(labels[order].tolist()))
         if lang == 'hi':
             considerations = "आपकी जलवायु असामान्य है। सिफारिशें मुख्य रूप से आपकी मिट्टी के प्रकार पर आधारित हैं।"
         else:
@@ -423,30 +658,93 @@ def get_crop_recommendations(state, soil_results, weather, historical, last_crop
     final_recs = [c for c in recs if c.lower() != last_crop.lower()] if last_crop else recs
     return {"recommended_crops": [c.capitalize() for c in (final_recs or recs)][:5], "considerations": considerations}
 
-
-def get_fertilizer_plan_for_crop(crop_name, soil_type, state, lang='en', short_advice=False):
-    if _CROP_NUTRIENTS_DF is None or _SOIL_NUTRIENTS_DF is None: return None
-    crop_req_row = _CROP_NUTRIENTS_DF[_CROP_NUTRIENTS_DF['crop'] == crop_name.lower().strip()]
-    if crop_req_row.empty: return None
-    crop_req = crop_req_row.iloc[0]
-    search_soil = soil_type.lower().strip()
-    soil_nutrients_row = _SOIL_NUTRIENTS_DF[_SOIL_NUTRIENTS_DF['soil_type'].apply(lambda x: search_soil in x or x in search_soil)]
+def get_crop_recommendations(state, soil_results, weather, historical, last_crop, lang='en'):
+    if _RECOMMEND_FEATURES is None or not len(_RECOMMEND_FEATURES): 
+        return {"recommended_crops": [], "considerations": "Recommendation data unavailable."}
+    
+    dataset_vectors, labels = soil_candidates(soil_search_term(soil_results.get("prediction", "unknown")))
+    
+    if not len(labels): 
+        return {"recommended_crops": [], "considerations": f"No crop data for detected soil type: {soil_results.get('prediction')}."}
     
-    # This logic for determining the note remains the same
-    if not soil_nutrients_row.empty:
-        available, note_en = soil_nutrients_row.iloc[0], f"based on average values for **{soil_type.title()}**."
+    target_vector = climate_target_vector(state, weather, historical, is_kharif_season())
+    
+    similarities = cosine_similarity([target_vector], dataset_vectors)[0]
+    
+    return rank_crops(similarities, labels, last_crop, lang)
+
+def field_advice_prompt(state, soil_prediction, recommended_crops, lang='en'):
+    """Prompt for the two-point action plan that closes a field analysis report."""
+    if lang == 'hi':
+        return (
+            f"आप एक विशेषज्ञ कृषि सलाहकार हैं। {state} में {soil_prediction} मिट्टी वाले किसान को यह उगाने की सलाह दी गई है: {', '.join(recommended_crops)}। "
+            f"एक 2-बिंदु वाली कार्य योजना बनाएं। कोई भी परिचयात्मक या संवादात्मक पाठ न लिखें। "
+            f"प्रत्येक बिंदु का एक शीर्षक और एक विवरण होना चाहिए। "
+            f"आउटपुट को सख्ती से इस प्रकार प्रारूपित करें: **शीर्षक 1:** विवरण 1 ## **शीर्षक 2:** विवरण 2"
+        )
+    return (
+        f"You are an expert farming advisor. A farmer in {state} with {soil_prediction} soil "
+        f"has been recommended to grow: {', '.join(recommended_crops)}. "
+        f"Generate a 2-point action plan. DO NOT write any introductory or conversational text. "
+        f"Each point must have a title and a description. "
+        f"Format the output strictly as follows: **Title 1:** Description 1 ## **Title 2:** Description 2"
+    )
+
+def field_report(latitude, longitude, state, district, weather, historical_weather, soil_analysis, recommendation_data, lang='en'):
+    """The field analysis report as returned to the browser, still without its AI advice."""
+    return {
+        "location": {"latitude": latitude, "longitude": longitude, "state": state, "district": district}, 
+        "weather": weather,
+        "historical_weather": historical_weather, 
+        "soil_analysis": soil_analysis,
+        "recommendations": recommendation_data,
+        "generated_at": datetime.now().isoformat(),
+        "lang": lang
+    }
+
+
+def get_fertilizer_plan_for_crop(crop_name, soil_type, state, lang='en', short_advice=False, include_advice=True):
+    gaps = fertilizer_table.lookup(crop_name, soil_type, state)
+    if gaps is None: return None
+    plan, prompt = _build_fertilizer_plan(crop_name, soil_type, state, gaps, lang, short_advice)
+    if include_advice:
+        plan['ai_application_advice'] = _get_cached_report_advice(prompt)
+    return plan
+
+def get_fertilizer_plans_for_report(report_summary, lang=None, include_advice=False):
+    """
+    Plans for every recommended crop of a report summary in one pass over the precomputed
+    gap table. Returns None if the report lacks crop, state or soil data.
+    """
+    crops = report_summary.get("recommended_crops") or []
+    state, soil_type = report_summary.get("state"), report_summary.get("soil_type")
+    if not all([crops, state, soil_type]): return None
+    lang = lang or report_summary.get('lang') or 'en'
+
+    plans, prompts = [], []
+    for crop_name, gaps in zip(crops, fertilizer_table.lookup_many(crops, soil_type, state)):
+        if gaps is None: continue
+        plan, prompt = _build_fertilizer_plan(crop_name, soil_type, state, gaps, lang)
+        plans.append(plan)
+        prompts.append(prompt)
+
+    if include_advice and plans:
+        with ThreadPoolExecutor(max_workers=min(4, len(plans))) as executor:
+            for plan, advice in zip(plans, executor.map(_get_cached_report_advice, prompts)):
+                plan['ai_application_advice'] = advice
+    return plans
+
+def _build_fertilizer_plan(crop_name, soil_type, state, gaps, lang='en', short_advice=False):
+    """Returns the plan and the Gemini prompt for its application advice."""
+    n, p, k, source = gaps
+    if source == 'soil':
+        note_en = f"based on average values for **{soil_type.title()}**."
         note_hi = f"**{soil_type.title()}** के औसत मूल्यों पर आधारित।"
     else:
-        available_dict = _STATE_MACRO_NUTRIENTS.get(state.upper(), {'N': 60, 'P': 45, 'K': 45})
-        available = pd.Series(available_dict).rename({'N':'n_avg', 'P':'p_avg', 'K':'k_avg'})
         note_en = f"based on average soil data for **{state.title()}**."
         note_hi = f"**{state.title()}** के औसत मिट्टी डेटा पर आधारित।"
 
     note = note_hi if lang == 'hi' else note_en
-
-    n = max(0, round((crop_req['n_req'] - available.get('n_avg', 0)) / 2.471))
-    p = max(0, round((crop_req['p_req'] - available.get('p_avg', 0)) / 2.471))
-    k = max(0, round((crop_req['k_req'] - available.get('k_avg', 0)) / 2.471))
     plan = {"crop": crop_name.capitalize(), "n_needed": n, "p_needed": p, "k_needed": k}
 
     if short_advice:
@@ -483,133 +781,76 @@ def get_fertilizer_plan_for_crop(crop_name, soil_type, state, lang='en', short_a
                 f"**Title 1:** Description with * bullet points. ## **Title 2:** Description with * bullet points."
             )
 
-    plan['ai_application_advice'] = get_gemini_report_advice(prompt)
-    return plan
+    return plan, prompt
+
+_ADVICE_CACHE = {}
+_ADVICE_CACHE_LIMIT = 512
+
+def _get_cached_report_advice(prompt):
+    """Application advice only depends on its prompt, so identical plans share one Gemini call."""
+    advice = _ADVICE_CACHE.get(prompt)
+    if advice is None:
+        advice = get_gemini_report_advice(prompt)
+        if not any(item.get("title") in ("Error", "AI Advice Not Available") for item in advice):
+            if len(_ADVICE_CACHE) >= _ADVICE_CACHE_LIMIT:
+                _ADVICE_CACHE.clear()
+            _ADVICE_CACHE[prompt] = advice
+    return advice
 
 def _fetch_live_price_data(state, for_date):
     """
-    Fetches ALL records for a given state for a SPECIFIC date using the CORRECTED resource_id and date format.
+    Fetches ALL records for a given state for a SPECIFIC date, paging through the full
+    result set, and returns them aggregated into a PriceIndex (or None).
     """
-    if not DATA_GOV_IN_API_KEY:
-        logger.warning("LIVE API FETCH SKIPPED: DATA_GOV_IN_API_KEY not set.")
-        return None
-    try:
-        api_date_str = for_date.strftime('%Y-%m-%d')
-        
-        params = {
-            "api-key": DATA_GOV_IN_API_KEY,
-            "format": "json",
-            "limit": "2000",
-            "filters[state]": state.title(),
-            "filters[arrival_date]": api_date_str
-        }
-        
-        headers = { 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36' }
-
-        correct_resource_id = '9ef84268-d588-465a-a308-a864a43d0070'
-        
-        logger.info(f"LIVE API FETCH: Requesting data with resource_id '{correct_resource_id}' for state '{state.title()}' on date '{api_date_str}'...")
-        
-        response = requests.get(f"https://api.data.gov.in/resource/{correct_resource_id}", params=params, headers=headers, timeout=20)
-        
-        response.raise_for_status()
-        
-        data = response.json()
-        records = data.get("records", [])
-        
-        logger.info(f"LIVE API FETCH: Successfully got {len(records)} records.")
-        return records
-        
-    except requests.exceptions.HTTPError as http_err:
-        logger.error(f"HTTP error fetching live price data: {http_err} - Response: {response.text}")
-        return None
-    except Exception as e:
-        logger.error(f"General error fetching live price data for date {for_date}: {e}", exc_info=True)
-        return None
+    return mandi_feed.fetch_state_prices(state, for_date)
 
-def _get_value_from_record(record, keys_to_try):
-    """Helper to get a value from a record trying multiple possible keys."""
-    for key in keys_to_try:
-        if key in record:
-            return record[key]
-    return '' 
-
-def _parse_and_average_prices(records, crop, district):
+def _parse_and_average_prices(price_index, crop, district, state=None):
     """
-    Parses records, now robustly checking for different possible key names and
-    validating that each record is a dictionary before processing.
+    Resolves the requested district and crop to canonical IDs and reads their
+    aggregated modal price straight out of a PriceIndex.
+    Legacy raw record lists are folded into an index first.
     """
+    if isinstance(price_index, dict):
+        price_index = price_index.get("records", list(price_index.values()))
 
-    if isinstance(records, dict):
-        records = list(records.values())
+    if isinstance(price_index, list):
+        price_index = PriceIndex.from_records(price_index, state)
 
-    if not isinstance(records, list) or not records:
+    if not isinstance(price_index, PriceIndex) or not len(price_index):
         return None, None
-        
-    first_dict_record = next((r for r in records if isinstance(r, dict)), None)
-    if first_dict_record:
-        logger.info(f"DEBUG: Keys in first valid record from API: {list(first_dict_record.keys())}")
-    else:
-        logger.warning("DEBUG: The records list does not contain any valid dictionary objects.")
 
-    crop_pattern = CROP_ALIASES.get(crop.lower(), crop.lower())
-    district_clean = district.lower().strip()
-
-    filtered_records = []
-    for r in records:
-        if isinstance(r, dict):
-            if (re.search(district_clean, str(_get_value_from_record(r, ['district', 'District'])).lower()) and
-                re.search(crop_pattern, str(_get_value_from_record(r, ['commodity', 'Commodity'])).lower())):
-                filtered_records.append(r)
-    
-    logger.info(f"PARSING: Found {len(filtered_records)} records after filtering for district='{district}' and crop='{crop}'.")
-
-    if not filtered_records:
+    totals = price_index.get(gazetteer.district_key(district, state), gazetteer.commodity_key(crop))
+    if not totals or not totals[1]:
+        logger.info(f"PARSING: No priced records for district='{district}' and crop='{crop}'.")
         return None, None
 
-    prices = []
-    for r in filtered_records:
-        modal_price_str = _get_value_from_record(r, ['modal_price', 'Modal Price', 'Modal_Price'])
-        if modal_price_str and str(modal_price_str).replace('.', '', 1).isdigit():
-            prices.append(int(float(modal_price_str)))
-    
-    if prices:
-        avg_price = round(sum(prices) / len(prices))
-        note = f"Using live market data for {district.title()}."
-        logger.info(f"SUCCESS: Calculated average price of {avg_price} from {len(prices)} valid price records.")
-        return avg_price, note
-    
-    logger.warning(f"PARSING FAILED: Found {len(filtered_records)} records but none had a valid modal price.")
-    return None, None
+    price_total, price_count = totals
+    avg_price = round(price_total / price_count)
+    note = f"Using live market data for {district.title()}."
+    logger.info(f"SUCCESS: Calculated average price of {avg_price} from {price_count} valid price records.")
+    return avg_price, note
 
 def _read_price_from_csv_fallback(state, crop, district=None):
-    if not _HISTORICAL_PRICES or _MANDI_DF is None:
+    if not _HISTORICAL_PRICES:
         return None, None, None
 
-    state_clean = state.lower().strip()
-    district_clean = district.lower().strip()
-    crop_clean = crop.lower().strip()
-    
-    stale_date = "a prior date"
+    state_id = gazetteer.state_key(state)
+    district_id = gazetteer.district_key(district, state)
+    crop_id = gazetteer.commodity_key(crop)
 
-    district_record = _MANDI_DF[(_MANDI_DF['state'] == state_clean) & (_MANDI_DF['district'] == district_clean) & (_MANDI_DF['commodity'] == crop_clean)]
-    if not district_record.empty and 'arrival_date' in district_record.columns:
-        stale_date = district_record.iloc[0]['arrival_date']
-
-    price = _HISTORICAL_PRICES.get((state_clean, district_clean, crop_clean))
+    key = (state_id, district_id, crop_id)
+    price = _HISTORICAL_PRICES.get(key)
     
     if price:
         note = f"Using historical data for {district.title()}."
-        return price, note, stale_date
+        return price, note, _HISTORICAL_PRICE_DATES.get(key) or "a prior date"
         
-    price = _HISTORICAL_PRICES.get((state_clean, '__state_avg__', crop_clean))
+    key = (state_id, '__state_avg__', crop_id)
+    price = _HISTORICAL_PRICES.get(key)
 
     if price:
         note = f"Could not find data for {district.title()}, using state-level historical average."
-        state_record = _MANDI_DF[(_MANDI_DF['state'] == state_clean) & (_MANDI_DF['commodity'] == crop_clean)]
-        if not state_record.empty and 'arrival_date' in state_record.columns:
-            stale_date = state_record.iloc[0]['arrival_date']
-        return price, note, stale_date
+        return price, note, _HISTORICAL_PRICE_DATES.get(key) or "a prior date"
 
     return None, None, None
 
@@ -628,82 +869,58 @@ def get_chatbot_mandi_price(district: str, crop: str):
     else:
         return {"error": f"Sorry, I have no historical price data for {crop} in {district}."}
 
-def _save_to_local_cache(state, records_list):
+def _fetch_price_data(state, district, crop):
     """
-    Saves the live API response data to a local JSON file in the new format,
-    always including a timestamp.
+    Price for one crop from the rolling price store. A store older than PRICE_STALE_AFTER_HOURS is
+    still served, flagged is_stale, for PRICE_STALE_GRACE_HOURS while one background refresh runs;
+    only a missing price or a store past its grace makes the request wait for data.gov.in.
     """
-    try:
-        if not os.path.exists(PRICE_CACHE_DIR):
-            os.makedirs(PRICE_CACHE_DIR)
-        
-        # Construct the dictionary to be saved
-        data_to_save = {
-            "timestamp": datetime.now().isoformat(),
-            "records": records_list
-        }
-        
-        filepath = os.path.join(PRICE_CACHE_DIR, f"{state.lower()}_cache.json")
-        with open(filepath, 'w') as f:
-            json.dump(data_to_save, f)
-            
-        logger.info(f"Successfully saved {len(records_list)} records to local cache: {filepath}")
-    except Exception as e:
-        logger.error(f"Failed to save data to local cache: {e}")
-
-# In services.py, modify _load_from_local_cache
+    price_data, fallback = stored_price_data(state, district, crop)
+    if price_data:
+        return price_data
+    # The request only waits for the latest arrivals; older missing dates are backfilled behind it.
+    refreshed = price_store.refresh_state(state, _fetch_live_price_data, latest_only=True)
+    queue_price_backfill(state)
+    return price_data_after_refresh(state, district, crop, refreshed, fallback)
 
-def _load_from_local_cache(state):
-    """Loads and validates data from a local JSON cache file."""
-    try:
-        filepath = os.path.join(PRICE_CACHE_DIR, f"{state.lower()}_cache.json")
-        if not os.path.exists(filepath):
-            return None # No cache file exists
-
-        with open(filepath, 'r') as f:
-            data = json.load(f)
-
-        cache_timestamp_str = data.get("timestamp")
-        if not cache_timestamp_str:
-            logger.warning(f"Local cache file for '{state}' is old format (no timestamp). Ignoring.")
-            return None
-
-        cache_time = datetime.fromisoformat(cache_timestamp_str)
-        if (datetime.now() - cache_time).total_seconds() > (12 * 3600):
-            logger.warning(f"Local cache file '{filepath}' is older than 12 hours. Ignoring it.")
-            return None
-        
-        logger.info(f"Successfully loaded {len(data['records'])} records from a valid local cache file.")
-        return data.get("records")
-        
-    except Exception as e:
-        logger.error(f"Failed to load data from local cache: {e}")
-        return None
+def queue_price_backfill(state):
+    """Fetches every date the store is missing on the background refresh pool."""
+    return swr_cache.refresh_in_background(('price_store', state.lower()), lambda: price_store.refresh_state(state, _fetch_live_price_data))
 
-@cache.memoize(timeout=14400)
-def _fetch_price_data(state, district, crop):
+def stored_price_data(state, district, crop):
+    """
+    (price data, None) when the store can answer without waiting for data.gov.in, else
+    (None, the expired store price or None) for price_data_after_refresh to fall back on.
+    """
+    refresh_scheduler.record_lookup(state)
     logger.info(f"--- FETCHING PRICE for '{crop}' in '{district}, {state}' ---")
-    
-    cached_records = _load_from_local_cache(state)
-    if cached_records:
-        avg_price, note = _parse_and_average_prices(cached_records, crop, district)
-        if avg_price:
-            logger.info("Serving price from recent local file cache.")
-            return {"price": avg_price, "note": note, "is_stale": False, "stale_date": None}
-
-    today = datetime.now()
-    yesterday = today - timedelta(days=1)
-    
-    live_records = _fetch_live_price_data(state, today)
-    if not live_records:
-        live_records = _fetch_live_price_data(state, yesterday)
-    
-    if live_records:
-        _save_to_local_cache(state, live_records) 
-        avg_price, note = _parse_and_average_prices(live_records, crop, district)
-        if avg_price:
+
+    updated_at = price_store.last_updated(state)
+    age_hours = (time.time() - updated_at) / 3600 if updated_at else float('inf')
+    stale_date = datetime.fromtimestamp(updated_at).strftime('%Y-%m-%d %H:%M') if updated_at else None
+
+    window_prices = price_store.window_index(state)
+    avg_price, note = _parse_and_average_prices(window_prices, crop, district, state) if window_prices else (None, None)
+    if avg_price and age_hours < PRICE_STALE_AFTER_HOURS:
+        logger.info("Serving price from the rolling local price store.")
+        return {"price": avg_price, "note": note, "is_stale": False, "stale_date": None}, None
+    if avg_price and age_hours < PRICE_STALE_AFTER_HOURS + PRICE_STALE_GRACE_HOURS:
+        queue_price_backfill(state)
+        logger.info("Serving stale price from the local price store while it refreshes.")
+        return {"price": avg_price, "note": note, "is_stale": True, "stale_date": stale_date}, None
+    # Past its grace period, but if the upstream is failing the store is still the best source.
+    return None, ({"price": avg_price, "note": note, "is_stale": True, "stale_date": stale_date} if avg_price else None)
+
+def price_data_after_refresh(state, district, crop, refreshed, fallback):
+    """The freshly fetched price, else the expired store price, else the built-in CSV."""
+    if refreshed:
+        live_price, live_note = _parse_and_average_prices(price_store.window_index(state), crop, district, state)
+        if live_price:
             logger.info("Serving price from live API fetch.")
-            return {"price": avg_price, "note": note, "is_stale": False, "stale_date": None}
+            return {"price": live_price, "note": live_note, "is_stale": False, "stale_date": None}
+
+    if fallback:
+        return fallback
 
     logger.warning("All data sources failed. Falling back to static built-in CSV.")
     avg_price, note, stale_date = _read_price_from_csv_fallback(state, crop, district)
@@ -714,10 +931,13 @@ def _fetch_price_data(state, district, crop):
 
 
 def get_mandi_prices(state, district, crop, area=1.0, lang='en'): # <-- Add lang
-    price_data = _fetch_price_data(state, district, crop)
+    return mandi_price_report(_fetch_price_data(state, district, crop), state, district, crop, area, lang)
+
+def mandi_price_report(price_data, state, district, crop, area=1.0, lang='en'):
+    """Adds yield and revenue to a price lookup and localises its note."""
     if "error" in price_data: return price_data
     price = price_data.get("price")
-    yield_qpa = {'rice': 22, 'wheat': 20, 'maize': 25, 'cotton': 8, 'chickpea': 10}.get(crop.lower(), 15)
+    yield_qpa = price_matrix.yield_qpa(crop)
     revenue = (yield_qpa * float(area)) * price if price else 0
     
     note = price_data.get("note")
@@ -751,10 +971,9 @@ def get_mandi_price(district: str, crop: str, state: str = None):
     if "error" in price_data:
         return price_data
 
-    # Return a rich dictionary with all the necessary info for formatting
+    # Return a rich dictionary with all the necessary info for formatting; label_price_result adds the display names.
     return {
-        "crop": crop.capitalize(),
-        "location": f"{district.title()}, {state.title()}",
+        "state": state,
         "average_mandi_price": price_data.get("price"),
         "note": price_data.get("note"),
         "is_stale": price_data.get("is_stale"),
@@ -776,18 +995,62 @@ def get_revenue_estimate(district: str, crop: str, area: float, state: str = Non
         return price_data
         
     price = price_data.get("price")
-    yield_qpa = {'rice': 22, 'wheat': 20, 'maize': 25, 'cotton': 8, 'chickpea': 10}.get(crop.lower(), 15)
+    yield_qpa = price_matrix.yield_qpa(crop)
     revenue = (yield_qpa * float(area)) * price if price else 0
     
     return {
-        "crop": crop.capitalize(),
-        "location": f"{district.title()}, {state.title()}",
+        "state": state,
         "average_mandi_price": price,
         "total_estimated_revenue": round(revenue),
         "area_acres": float(area),
         "note": price_data.get("note")
     }
 
+def label_price_result(result, args):
+    """Adds the crop and location display names from this caller's own arguments to a (possibly cached) price result."""
+    labelled = {"crop": args["crop"].capitalize(), "location": f"{args['district'].title()}, {result['state'].title()}"}
+    labelled.update((key, value) for key, value in result.items() if key != "state")
+    return labelled
+
+def _state_price_pivot(state):
+    window_prices = price_store.window_index(state)
+    return price_matrix.get_pivot(state, window_prices if len(window_prices) else None, _HISTORICAL_PRICES)
+
+def get_price_matrix(state, crop=None, district=None, area=1.0):
+    """
+    Regional price comparison from the state's district x commodity pivot:
+    a crop across districts, all crops in a district, one cell, or the whole matrix.
+    """
+    state_match = gazetteer.resolve_state(state) if state else None
+    if not state_match:
+        return {"error": f"I couldn't identify the state '{state}'."}
+    refresh_scheduler.record_lookup(state_match.name)
+    pivot = _state_price_pivot(state_match.name)
+    if not pivot.districts:
+        return {"error": f"No market data available for {state_match.name.title()}."}
+
+    result = {"state": state_match.name.title(), "area_acres": float(area)}
+    if crop and not district:
+        rows = pivot.best_districts(crop, area)
+        if rows is None:
+            return {"error": f"No market data for '{crop}' in {state_match.name.title()}."}
+        result.update({"crop": crop.capitalize(), "districts": rows})
+    elif district and not crop:
+        rows = pivot.district_crops(district, area)
+        if rows is None:
+            return {"error": f"No market data for the district '{district}' in {state_match.name.title()}."}
+        result.update({"district": pivot.district_label(gazetteer.district_key(district, state_match.name)), "crops": rows})
+    elif crop and district:
+        rows = pivot.district_crops(district, area) or []
+        crop_label = gazetteer.commodity_key(crop).capitalize()
+        cell = next((row for row in rows if row["crop"] == crop_label), None)
+        if cell is None:
+            return {"error": f"No market data for '{crop}' in {district.title()}."}
+        result.update({"crop": crop.capitalize(), "district": pivot.district_label(gazetteer.district_key(district, state_match.name)), **cell})
+    else:
+        result.update(pivot.matrix(area))
+    return result
+
 def get_dashboard_price_summary(state, district, lang='en'): # <-- Add lang
     summary = {"labels": [], "prices": [], "note": ""}
     key_crops = ['Rice', 'Wheat', 'Maize', 'Cotton']
@@ -814,44 +1077,153 @@ def get_dashboard_price_summary(state, district, lang='en'): # <-- Add lang
     summary["labels"] = translated_labels # Use the translated labels
     return summary
 
+ADVICE_NOT_CONFIGURED = {"title": "AI Advice Not Available", "description": "The AI service is not configured."}
+ADVICE_ERROR = {"title": "Error", "description": "Sorry, an error occurred while contacting the AI for advice."}
+GEMINI_HEADERS = {"Content-Type": "application/json"}
+
 def get_gemini_report_advice(prompt):
     """
     Gets advice from the Gemini API and parses it into a structured list.
     """
     if not GEMINI_API_KEY or not GEMINI_API_URL:
-        return [{"title": "AI Advice Not Available", "description": "The AI service is not configured."}]
+        return [dict(ADVICE_NOT_CONFIGURED)]
         
-    headers = {"Content-Type": "application/json"}
     data = {"contents": [{"parts": [{"text": prompt}]}]}
     
     try:
-        response = requests.post(f"{GEMINI_API_URL}?key={GEMINI_API_KEY}", headers=headers, json=data, timeout=30)
+        response = _HTTP.post(f"{GEMINI_API_URL}?key={GEMINI_API_KEY}", headers=GEMINI_HEADERS, json=data, timeout=30)
         response.raise_for_status()
-        raw_text = response.json()["candidates"][0]["content"]["parts"][0]["text"]
+        return parse_report_advice(response.json())
+    except Exception as e:
+        logger.error(f"Error contacting or parsing Gemini API response: {e}")
+        return [dict(ADVICE_ERROR)]
 
-        advice_parts = []
-        sections = raw_text.strip().split('##')
+def parse_report_advice(response_json):
+    """Splits the model's "**Title:** description ## ..." answer into advice items."""
+    raw_text = response_json["candidates"][0]["content"]["parts"][0]["text"]
 
-        for section in sections:
-            if ':**' in section:
-                title_part, description_part = section.split(':**', 1)
-                title = title_part.replace('**', '').strip()
-                description = description_part.strip()
-                advice_parts.append({"title": title, "description": description})
-        
-        return advice_parts if advice_parts else [{"title": "AI Advice", "description": raw_text}]
+    advice_parts = []
+    sections = raw_text.strip().split('##')
 
+    for section in sections:
+        if ':**' in section:
+            title_part, description_part = section.split(':**', 1)
+            title = title_part.replace('**', '').strip()
+            description = description_part.strip()
+            advice_parts.append({"title": title, "description": description})
+    
+    return advice_parts if advice_parts else [{"title": "AI Advice", "description": raw_text}]
+
+_TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=CHAT_TOOL_MAX_WORKERS, thread_name_prefix='drishti_tool')
+
+def run_tool_calls(tool_calls, user_id):
+    """
+    Runs all function calls from one model response concurrently. Each call gets its own
+    CHAT_TOOL_TIMEOUT_SECONDS; a failed or slow tool yields an error result instead of failing the turn.
+    """
+    futures = [
+        (tool_call.get("name"), _TOOL_EXECUTOR.submit(TOOL_RUNTIME.call, tool_call.get("name"), tool_call.get("args"), user_id))
+        for tool_call in tool_calls
+    ]
+
+    deadline = time.monotonic() + CHAT_TOOL_TIMEOUT_SECONDS
+    results = []
+    for tool_name, future in futures:
+        try:
+            results.append(future.result(timeout=max(0, deadline - time.monotonic())))
+        except FutureTimeoutError:
+            logger.warning(f"CHAT TOOL: '{tool_name}' timed out after {CHAT_TOOL_TIMEOUT_SECONDS}s.")
+            results.append({"error": f"The '{tool_name}' lookup took too long. Please try again."})
+        except Exception as e:
+            logger.error(f"CHAT TOOL: '{tool_name}' failed: {e}", exc_info=True)
+            results.append({"error": f"The '{tool_name}' lookup failed."})
+    return results
+
+def _report_options_reply(tool_name, reports):
+    options = []
+    for report in reports:
+        report_id = report.get('report_id')
+        label = f"Report #{report_id} from {report.get('date')}"
+        # Create a precise, machine-readable command instead of a sentence
+        if tool_name == 'create_fertilizer_plan':
+            command = f"CMD::CREATE_FERTILIZER_PLAN::{report_id}"
+        else: # This handles 'list_my_reports'
+            command = f"CMD::GET_REPORT_DETAILS::{report_id}"
+        options.append({"label": label, "payload": {"message": command}})
+    return {"type": "options", "content": "Of course. Please select one of your saved reports:", "options": options}
+
+def _answer_intent(intent, user_id):
+    """Runs the tool behind a locally parsed intent and renders its reply. Returns None to defer to the model."""
+    slots = intent.slots
+    try:
+        if intent.name == 'latest_report':
+            report_record = database.get_latest_report_summary(user_id)
+            if not report_record:
+                if intent.lang == 'hi':
+                    return "आपकी कोई सहेजी हुई रिपोर्ट नहीं है। आप 'Analyze Field' पेज से एक रिपोर्ट बना सकते हैं।"
+                return "You have no saved reports. You can create one from the 'Analyze Field' page."
+            return _format_report_summary(report_record['id'], report_record, lang=intent.lang)
+
+        result = TOOL_RUNTIME.call('get_mandi_price' if intent.name == 'mandi_price' else 'get_revenue_estimate', slots)
     except Exception as e:
-        logger.error(f"Error contacting or parsing Gemini API response: {e}")
-        return [{"title": "Error", "description": "Sorry, an error occurred while contacting the AI for advice."}]
+        logger.error(f"CHAT FAST PATH: '{intent.name}' failed, deferring to the model: {e}")
+        return None
 
-def get_drishti_response(user_message, user_id, conversation_history=[]):
+    crop_label = CROP_TRANSLATIONS_HI.get(slots["crop"]) if intent.lang == 'hi' else None
+    return intent_parser.render(intent, result, crop_label=crop_label)
 
-    AVAILABLE_TOOLS = {
-        func_name: globals()[func_name]
-        for func_name in TOOL_FUNCTIONS
-        if func_name in globals()
-    }
+def get_drishti_response(user_message, user_id, session_key=None):
+
+    conversation = conversation_store.load(user_id, session_key)
+    started_at = time.perf_counter()
+
+    local_reply = local_chat_reply(user_message, user_id, session_key, conversation, started_at)
+    if local_reply:
+        return local_reply
+
+    if not GEMINI_API_KEY or not GEMINI_API_URL:
+        return {"type": "text", "content": "Chatbot AI service is not configured."}
+
+    api_url = f"{GEMINI_API_URL}?key={GEMINI_API_KEY}"
+    gemini_history, payload = chat_model_payload(conversation, user_message)
+
+    try:
+        response = _HTTP.post(api_url, headers=GEMINI_HEADERS, json=payload, timeout=90)
+        response.raise_for_status()
+        candidate = response.json().get('candidates', [{}])[0]
+
+        # --- Step 4: Run every tool the model asked for, then hand all results back in one follow-up ---
+        for tool_round in range(1, CHAT_MAX_TOOL_ROUNDS + 1):
+            tool_calls = model_tool_calls(candidate)
+            if not tool_calls:
+                break
+
+            tool_outputs = run_tool_calls(tool_calls, user_id)
+            options_reply = tool_options_reply(tool_calls, tool_outputs)
+            if options_reply:
+                return options_reply
+
+            follow_up_payload = chat_follow_up_payload(gemini_history, payload, tool_calls, tool_outputs, tool_round)
+            follow_up_response = _HTTP.post(api_url, headers=GEMINI_HEADERS, json=follow_up_payload, timeout=90)
+            follow_up_response.raise_for_status()
+            candidate = follow_up_response.json().get('candidates', [{}])[0]
+
+        return finish_chat_reply(candidate, user_message, user_id, session_key, conversation, started_at)
+
+    except Exception as e:
+        logger.error(f"FATAL error in Gemini API call: {e}", exc_info=True)
+        return {"type": "text", "content": "A critical error occurred while contacting the AI assistant."}
+
+def local_chat_reply(user_message, user_id, session_key, conversation, started_at):
+    """The reply to a fast-path intent or a CMD:: button, or None when the model has to answer."""
+    # Formulaic questions are answered locally without a model round trip.
+    intent = intent_parser.parse(user_message) if CHAT_FAST_PATH_ENABLED else None
+    if intent:
+        reply_content = _answer_intent(intent, user_id)
+        if reply_content:
+            intent_parser.record('fast_path', time.perf_counter() - started_at, intent.name)
+            conversation_store.record_exchange(user_id, session_key, conversation, user_message, reply_content)
+            return {"type": "text", "content": reply_content}
 
     if user_message.startswith("CMD::"):
         parts = user_message.split("::")
@@ -870,15 +1242,13 @@ def get_drishti_response(user_message, user_id, conversation_history=[]):
             reply_content = "Sorry, I received an unknown command."
 
         final_reply = {"type": "text", "content": reply_content}
-        updated_history = conversation_history + [{"role": "user", "content": user_message}, {"role": "assistant", "content": reply_content}]
-        return final_reply, updated_history
+        conversation_store.record_exchange(user_id, session_key, conversation, user_message, reply_content)
+        return final_reply
 
-    if not GEMINI_API_KEY or not GEMINI_API_URL:
-        return {"type": "text", "content": "Chatbot AI service is not configured."}, conversation_history
-
-    headers = {"Content-Type": "application/json"}
-    api_url = f"{GEMINI_API_URL}?key={GEMINI_API_KEY}"
+    return None
 
+def chat_model_payload(conversation, user_message):
+    """(gemini_history, payload) for the first model call of a chat turn."""
     # --- Step 1: Define the System Prompt - The AI's "Personality" and "Rules" ---
     system_prompt_text = """
     You are 'Drishti', a friendly, expert AI agricultural assistant for the Kisan Drishti application.
@@ -891,18 +1261,20 @@ def get_drishti_response(user_message, user_id, conversation_history=[]):
     4.  **CRITICAL RULE: Only use the functions you are given. Do not make up or invent function names. You MUST choose a function name from the provided list.**
     5.  **Be Clear and Simple:** Use simple language that is easy for a farmer to understand.
     """
-    system_instruction = {"parts": [{"text": system_prompt_text}]}
+    tools = [{"function_declarations": get_tools_schema(for_gemini=True)}]
 
+    # --- Step 2: Take the recent turns from the server-side store; older ones live on as a summary ---
+    summary, recent_turns = conversation_store.request_window(conversation, user_message, reserved_chars=len(system_prompt_text) + len(json.dumps(tools)))
+    if summary:
+        system_prompt_text += f"\n    **Summary of the earlier conversation:**\n{summary}\n"
+    system_instruction = {"parts": [{"text": system_prompt_text}]}
 
-    # --- Step 2: Prepare the message history and tool definitions for the Gemini API ---
     gemini_history = []
-    for message in conversation_history:
+    for message in recent_turns:
         # Gemini uses 'model' for the assistant role
         role = 'model' if message['role'] == 'assistant' else 'user'
         gemini_history.append({"role": role, "parts": [{"text": message.get('content', '')}]})
     gemini_history.append({"role": "user", "parts": [{"text": user_message}]})
-    
-    tools = [{"function_declarations": get_tools_schema(for_gemini=True)}]
 
     # --- Step 3: First call to Gemini to see if it wants to use a tool ---
     payload = {
@@ -910,68 +1282,44 @@ def get_drishti_response(user_message, user_id, conversation_history=[]):
         "system_instruction": system_instruction, # Add the system prompt here
         "tools": tools
     }
-
-    try:
-        response = requests.post(api_url, headers=headers, json=payload, timeout=90)
-        response.raise_for_status()
-        candidate = response.json().get('candidates', [{}])[0]
-        
-        # Check if the model's response was to call a function
-        if candidate.get('content', {}).get('parts', [{}])[0].get("functionCall"):
-            ai_response_part = candidate['content']['parts'][0]
-            # --- Step 4a: Gemini wants to use a tool ---
-            tool_call = ai_response_part["functionCall"]
-            tool_name = tool_call.get("name")
-            tool_args = tool_call.get("args", {})
-
-            if tool_name not in AVAILABLE_TOOLS:
-                reply_content = "Sorry, I tried to use a tool that doesn't exist."
-            else:
-                # Execute the tool
-                if 'user_id' in inspect.signature(AVAILABLE_TOOLS[tool_name]).parameters: tool_args['user_id'] = user_id
-                tool_output = AVAILABLE_TOOLS[tool_name](**tool_args)
-
-                # This is your existing logic for handling UI option buttons
-                if tool_name in ["list_my_reports", "create_fertilizer_plan"] and isinstance(tool_output, list):
-                    options = []
-                    for report in tool_output:
-                        report_id = report.get('report_id')
-                        label = f"Report #{report_id} from {report.get('date')}"
-                        # Create a precise, machine-readable command instead of a sentence
-                        if tool_name == 'create_fertilizer_plan':
-                            command = f"CMD::CREATE_FERTILIZER_PLAN::{report_id}"
-                        else: # This handles 'list_my_reports'
-                            command = f"CMD::GET_REPORT_DETAILS::{report_id}"
-                        
-                        options.append({"label": label, "payload": {"message": command}})
-                        
-                    reply = {"type": "options", "content": "Of course. Please select one of your saved reports:", "options": options}
-                    return reply, conversation_history
-                
-                # --- Step 4b: Send the tool result back to Gemini for a natural language summary ---
-                gemini_history.append({"role": "model", "parts": [{"functionCall": tool_call}]})
-                gemini_history.append({"role": "function", "parts": [{"functionResponse": {"name": tool_name, "response": {"result": json.dumps(tool_output)}}}]})
-                
-                final_payload = {
-                    "contents": gemini_history,
-                    "system_instruction": system_instruction # Re-send the instructions
-                }
-                final_response = requests.post(api_url, headers=headers, json=final_payload, timeout=90)
-                final_response.raise_for_status()
-                reply_content = final_response.json()['candidates'][0]['content']['parts'][0].get('text', "I've processed your request.")
-        else:
-            # --- Step 4c: No tool was called, just a simple chat reply ---
-            reply_content = candidate.get('content', {}).get('parts', [{}])[0].get('text', "I'm not sure how to respond.")
-
-        # --- Step 5: Finalize the response for the frontend ---
-        final_reply = {"type": "text", "content": reply_content}
-        updated_history = conversation_history + [{"role": "user", "content": user_message}, {"role": "assistant", "content": reply_content}]
-        
-        return final_reply, updated_history
-
-    except Exception as e:
-        logger.error(f"FATAL error in Gemini API call: {e}", exc_info=True)
-        return {"type": "text", "content": "A critical error occurred while contacting the AI assistant."}, conversation_history
+    return gemini_history, payload
+
+def model_tool_calls(candidate):
+    return [part["functionCall"] for part in candidate.get('content', {}).get('parts', []) if part.get("functionCall")]
+
+def tool_options_reply(tool_calls, tool_outputs):
+    # This is your existing logic for handling UI option buttons
+    for tool_call, tool_output in zip(tool_calls, tool_outputs):
+        if tool_call.get("name") in ["list_my_reports", "create_fertilizer_plan"] and isinstance(tool_output, list):
+            return _report_options_reply(tool_call["name"], tool_output)
+    return None
+
+def chat_follow_up_payload(gemini_history, payload, tool_calls, tool_outputs, tool_round):
+    """Appends one round of tool calls and results to the history and builds the follow-up request."""
+    gemini_history.append({"role": "model", "parts": [{"functionCall": tool_call} for tool_call in tool_calls]})
+    gemini_history.append({"role": "function", "parts": [
+        {"functionResponse": {"name": tool_call.get("name"), "response": {"result": json.dumps(tool_output)}}}
+        for tool_call, tool_output in zip(tool_calls, tool_outputs)
+    ]})
+
+    follow_up_payload = {
+        "contents": gemini_history,
+        "system_instruction": payload["system_instruction"] # Re-send the instructions
+    }
+    # The model may chain another round of tools, except on the last allowed round.
+    if tool_round < CHAT_MAX_TOOL_ROUNDS:
+        follow_up_payload["tools"] = payload["tools"]
+    return follow_up_payload
+
+def finish_chat_reply(candidate, user_message, user_id, session_key, conversation, started_at):
+    text_parts = [part["text"] for part in candidate.get('content', {}).get('parts', []) if part.get("text")]
+    reply_content = "".join(text_parts) or "I'm not sure how to respond."
+
+    # --- Step 5: Finalize the response for the frontend ---
+    intent_parser.record('model', time.perf_counter() - started_at)
+    final_reply = {"type": "text", "content": reply_content}
+    conversation_store.record_exchange(user_id, session_key, conversation, user_message, reply_content)
+    return final_reply
     
 def create_fertilizer_plan(user_id, report_id: int = None):
     """
@@ -981,12 +1329,12 @@ def create_fertilizer_plan(user_id, report_id: int = None):
     """
     # Flow 1: No report ID was provided, so we must list the reports for the user to choose.
     if report_id is None:
-        reports_data, _ = database.get_user_reports(user_id)
-        if not reports_data.get("success") or not reports_data.get("reports"):
+        reports = database.get_user_report_summaries(user_id, limit=5)
+        if not reports:
             return "You have no saved reports to create a plan from. Please analyze a field first."
         
         formatted_reports = []
-        for report in reports_data["reports"][:5]:
+        for report in reports:
             try:
                 report_date = report['saved_at'].strftime('%b %d, %Y')
                 formatted_reports.append({"report_id": report['id'], "date": report_date})
@@ -996,15 +1344,10 @@ def create_fertilizer_plan(user_id, report_id: int = None):
 
     # Flow 2: A report ID was provided, so we generate the plan.
     else:
-        report_record = database.get_report_by_id(user_id, report_id)
+        report_record = database.get_report_summary_by_id(user_id, report_id)
         if not report_record: return f"Sorry, I could not find report #{report_id}."
         
-        data = report_record['report_data']
-        if isinstance(data, str):
-            data = json.loads(data)
-        crop = data.get('recommendations', {}).get('recommended_crops', [None])[0]
-        state = data.get('location', {}).get('state')
-        soil_type = data.get('soil_analysis', {}).get('prediction')
+        crop, state, soil_type = report_record['top_crop'], report_record['state'], report_record['soil_type']
         
         if not all([crop, state, soil_type]): return f"Report #{report_id} is missing data needed for a plan."
         
@@ -1019,57 +1362,23 @@ def create_fertilizer_plan(user_id, report_id: int = None):
         else:
             return f"Sorry, I could not generate a fertilizer plan for {crop} in {soil_type} for report #{report_id}."
 
-@cache.memoize(timeout=600)
 def get_dashboard_data(user_id, lang='en'): # <-- Add lang
     """
     This is the single source of truth for all dashboard data.
     It fetches the latest report and calculates all necessary metrics in one place.
+    The summary is memoized on the latest report itself, so a save, sync or delete handled
+    by any worker changes the key; failures are never memoized.
     """
-    report_record = database.get_latest_user_report(user_id)
+    report_record = database.get_latest_report_summary(user_id)
 
     if not report_record:
         return {"success": True, "has_data": False}
     
     try:
-        report_data = report_record['report_data']
-        if isinstance(report_data, str):
-            report_data = json.loads(report_data)
-        location = report_data.get('location', {})
-        lat, lon = location.get('latitude'), location.get('longitude')
-        state, district = location.get('state'), location.get('district')
-        top_crop = report_data.get('recommendations', {}).get('recommended_crops', ['N/A'])[0]
-        soil_type = report_data.get('soil_analysis', {}).get('prediction', 'N/A')
-        
-        # --- TRANSLATE DYNAMIC TEXT ---
-        if lang == 'hi':
-            top_crop_display = CROP_TRANSLATIONS_HI.get(top_crop.lower(), top_crop)
-            soil_type_display = SOIL_TRANSLATIONS_HI.get(soil_type.lower(), soil_type)
-        else:
-            top_crop_display = top_crop
-            soil_type_display = soil_type
-            
-        if not all([lat, lon, state, district]):
+        lat, lon = float(report_record['latitude']), float(report_record['longitude'])
+        if not all([lat, lon, report_record['state'], report_record['district']]):
              return {"success": False, "error": "Latest report has incomplete location data."}
-
-        username = database.get_username_by_id(user_id)
-        current_weather = get_weather_data(lat, lon, lang=lang)
-        price_data = get_mandi_prices(state, district, top_crop, lang=lang)
-        mandi_price = price_data.get("average_mandi_price")
-        price_chart_data = get_dashboard_price_summary(state, district, lang=lang)
-
-        summary = {
-            "success": True, 
-            "has_data": True, 
-            "username": username,
-            "location": f"{district.title()}, {state.title()}",
-            "current_weather": current_weather,
-            # Use the translated display values
-            "soil_type": soil_type_display, 
-            "last_report": {"date": report_record['saved_at'].strftime('%d-%m-%Y'), "top_crop_recommended": top_crop_display},
-            "mandi_price": {"crop": top_crop_display, "price": mandi_price},
-            "price_chart": price_chart_data 
-        }
-        return summary
+        return _dashboard_summary(user_id, lang, dict(report_record))
         
     except Exception as e:
         logger.error(f"Error generating dashboard summary data: {e}", exc_info=True)
@@ -1077,10 +1386,51 @@ def get_dashboard_data(user_id, lang='en'): # <-- Add lang
             return {"success": False, "error": "डैशबोर्ड के लिए रिपोर्ट डेटा पार्स नहीं किया जा सका।"}
         return {"success": False, "error": "Could not parse report data for dashboard."}
 
+@cache.memoize(timeout=600)
+def _dashboard_summary(user_id, lang, report_record):
+    """The dashboard for one version of a user's latest report. Raises instead of returning an error, so failures aren't cached."""
+    lat, lon = float(report_record['latitude']), float(report_record['longitude'])
+    state, district = report_record['state'], report_record['district']
+    top_crop = report_record['top_crop'] or 'N/A'
+    soil_type = report_record['soil_type'] or 'N/A'
+    
+    # --- TRANSLATE DYNAMIC TEXT ---
+    if lang == 'hi':
+        top_crop_display = CROP_TRANSLATIONS_HI.get(top_crop.lower(), top_crop)
+        soil_type_display = SOIL_TRANSLATIONS_HI.get(soil_type.lower(), soil_type)
+    else:
+        top_crop_display = top_crop
+        soil_type_display = soil_type
+
+    username = database.get_username_by_id(user_id)
+    current_weather = get_weather_data(lat, lon, lang=lang)
+    price_data = get_mandi_prices(state, district, top_crop, lang=lang)
+    mandi_price = price_data.get("average_mandi_price")
+    price_chart_data = get_dashboard_price_summary(state, district, lang=lang)
+
+    return {
+        "success": True, 
+        "has_data": True, 
+        "username": username,
+        "location": f"{district.title()}, {state.title()}",
+        "current_weather": current_weather,
+        # Use the translated display values
+        "soil_type": soil_type_display, 
+        "last_report": {"date": report_record['saved_at'].strftime('%d-%m-%Y'), "top_crop_recommended": top_crop_display},
+        "mandi_price": {"crop": top_crop_display, "price": mandi_price},
+        "price_chart": price_chart_data 
+    }
+
+REFRESHER_LOCK = leader_election.FileLeaderLock(REFRESHER_LOCK_PATH, REFRESHER_HEARTBEAT_SECONDS)
+_UPDATER_THREAD = None
+_SCHEDULE_RECHECK_SECONDS = 300
+_UPDATER_LOCK = threading.Lock()
+
 def _cache_updater_worker():
     """
     This is the main worker function for our background thread.
-    It runs in an infinite loop, waking up periodically to refresh all state caches.
+    It runs in an infinite loop, refreshing whichever state the demand-driven schedule says is due next.
+    Only the elected leader gets here; it heartbeats the lock file while it works and sleeps.
     """
     logger.info("CACHE UPDATER: Background cache refresh thread has started.")
     
@@ -1090,45 +1440,82 @@ def _cache_updater_worker():
         return
     all_states = sorted(list(set(_DISTRICT_TO_STATE_MAP.values())))
     
+    scheduler = refresh_scheduler.RefreshScheduler(all_states)
+    
     while True:
-        logger.info(f"CACHE UPDATER: Starting scheduled refresh for {len(all_states)} states...")
+        wait_seconds, state = scheduler.next_due()
+        if wait_seconds > 0:
+            scheduler.publish()
+            # Wake up regularly so a state that suddenly gets busy is pulled forward.
+            REFRESHER_LOCK.sleep(min(wait_seconds, _SCHEDULE_RECHECK_SECONDS))
+            continue
         
-        today = datetime.now()
-        for state in all_states:
-            try:
-                # We only try to fetch for today's date during the refresh.
-                live_records = _fetch_live_price_data(state, today)
-                
-                if live_records:
-                    # Save the freshly fetched data to the local cache file
-                    data_to_cache = {"records": live_records, "timestamp": today.isoformat()}
-                    _save_to_local_cache(state, data_to_cache)
-                    logger.info(f"CACHE UPDATER: Successfully refreshed cache for '{state}'.")
+        try:
+            # Only dates that haven't been fully ingested yet are fetched. The schedule has already
+            # decided the state is due, so unfinished days only need to be older than the floor.
+            floor = timedelta(minutes=REFRESH_MIN_INTERVAL_MINUTES)
+            fetched_dates = price_store.refresh_state(state, _fetch_live_price_data, refresh_interval=floor)
+            if fetched_dates is None:
+                # The upstream failed: nothing is known about whether prices changed, so retry soon.
+                scheduler.record_refresh(state, None)
+                logger.warning(f"CACHE UPDATER: Refresh for '{state}' failed; retrying after the minimum interval.")
+            else:
+                # Rebuild the comparison pivot now rather than on the first request after the refresh.
+                _state_price_pivot(state)
+                scheduler.record_refresh(state, _price_signature(state))
+
+                if fetched_dates:
+                    logger.info(f"CACHE UPDATER: Successfully refreshed {fetched_dates} date(s) for '{state}'.")
                 else:
-                    logger.warning(f"CACHE UPDATER: Could not fetch live data for '{state}'. Its cache was not updated.")
-                
-                # Small delay to avoid overwhelming the API
-                time.sleep(5) 
-                
-            except Exception as e:
-                logger.error(f"CACHE UPDATER: An error occurred for state '{state}' during refresh: {e}")
+                    logger.info(f"CACHE UPDATER: Nothing new fetched for '{state}'.")
+            
+        except Exception as e:
+            scheduler.record_refresh(state, None)
+            logger.error(f"CACHE UPDATER: An error occurred for state '{state}' during refresh: {e}")
+        
+        # Small delay to avoid overwhelming the API
+        REFRESHER_LOCK.sleep(5)
 
-        sleep_duration_hours = 6
-        sleep_duration_seconds = sleep_duration_hours * 3600
-        logger.info(f"CACHE UPDATER: All states processed. Sleeping for {sleep_duration_hours} hours.")
-        time.sleep(sleep_duration_seconds)
+def _price_signature(state):
+    """Identifies the prices currently served for a state, to tell refreshes that changed nothing apart."""
+    return hash(frozenset(price_store.window_index(state).items()))
 
+def _refresher_election_loop():
+    """
+    Every worker runs this loop, but only the holder of REFRESHER_LOCK refreshes prices.
+    Followers retry the lock periodically, so one of them takes over if the leader dies.
+    They read the leader's output through the shared price store files, which are re-read
+    whenever they change on disk.
+    """
+    while True:
+        if REFRESHER_LOCK.try_acquire():
+            try:
+                _cache_updater_worker()
+            except Exception as e:
+                logger.error(f"CACHE UPDATER: Refresher crashed: {e}", exc_info=True)
+            # Let another process take over rather than holding the lock without refreshing.
+            REFRESHER_LOCK.release()
+        time.sleep(REFRESHER_ELECTION_RETRY_SECONDS)
 
 def start_background_cache_updater():
     """
-    This function launches the cache updater worker in a single, persistent background thread.
-    It should only be called once when the application starts.
+    Starts this process's refresher thread, which takes part in the per-host leader election.
+    Safe to call more than once.
     """
-    if 'cache_updater_thread' in threading.enumerate():
-        logger.info("CACHE UPDATER: Updater thread already running.")
+    global _UPDATER_THREAD
+    if not PRICE_REFRESHER_ENABLED:
+        logger.info("CACHE UPDATER: Disabled by PRICE_REFRESHER_ENABLED.")
         return
+    with _UPDATER_LOCK:
+        if _UPDATER_THREAD is not None and _UPDATER_THREAD.is_alive():
+            logger.info("CACHE UPDATER: Updater thread already running.")
+            return
+
+        logger.info("CACHE UPDATER: Initializing and starting background cache refresh thread.")
+        _UPDATER_THREAD = threading.Thread(target=_refresher_election_loop, name='cache_updater_thread')
+        _UPDATER_THREAD.daemon = True
+        _UPDATER_THREAD.start()
+
 
-    logger.info("CACHE UPDATER: Initializing and starting background cache refresh thread.")
-    thread = threading.Thread(target=_cache_updater_worker, name='cache_updater_thread')
-    thread.daemon = True
-    thread.start()
+# Built once, after every tool function above is defined.
+TOOL_RUNTIME = tool_runtime.ToolRuntime(globals(), labelers={'get_mandi_price': label_price_result, 'get_revenue_estimate': label_price_result})
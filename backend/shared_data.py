@@ -0,0 +1,86 @@
+# shared_data.py - Read-only arrays shared across worker processes, and per-process memory reporting
+
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+from config import SHARED_DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+_SMAPS_FIELDS = ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty', 'Shared_Clean', 'Shared_Dirty', 'Swap')
+
+
+def publish_array(name, array):
+    """
+    Writes an immutable array to SHARED_DATA_DIR and returns a read-only memory map of it.
+    The file name carries a content hash, so every worker that builds the same data maps the
+    same file and the kernel keeps a single copy in the page cache.
+    """
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha1(array.tobytes() + str((array.dtype, array.shape)).encode()).hexdigest()[:12]
+    path = os.path.join(SHARED_DATA_DIR, f"{name}.{digest}.npy")
+    try:
+        if not os.path.exists(path):
+            os.makedirs(SHARED_DATA_DIR, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array, allow_pickle=False)
+            os.replace(tmp_path, path)
+        return np.load(path, mmap_mode='r')
+    except (OSError, ValueError) as e:
+        # Unshareable dtypes or a read-only disk just mean a private copy.
+        logger.warning(f"SHARED DATA: Keeping '{name}' in process memory: {e}")
+        array.setflags(write=False)
+        return array
+
+
+def process_memory(pid=None):
+    """
+    RSS, PSS and USS (private pages) of a process in KiB, from /proc/<pid>/smaps_rollup.
+    USS is what the process would free on exit; PSS splits shared pages between their users.
+    """
+    pid = pid or os.getpid()
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", 'r') as f:
+            for line in f:
+                field, _, rest = line.partition(':')
+                if field in _SMAPS_FIELDS:
+                    values[field] = int(rest.split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return {
+        "pid": pid,
+        "rss_kb": values.get('Rss'),
+        "pss_kb": values.get('Pss'),
+        "uss_kb": values.get('Private_Clean', 0) + values.get('Private_Dirty', 0),
+        "shared_kb": values.get('Shared_Clean', 0) + values.get('Shared_Dirty', 0),
+        "swap_kb": values.get('Swap'),
+    }
+
+
+def _children(parent_pid):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'r') as f:
+                # The command name may contain spaces, so fields are counted from the closing parenthesis.
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == parent_pid:
+                    pids.append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+    return sorted(pids)
+
+
+def worker_memory():
+    """Memory of this process and, under gunicorn, of the arbiter and every sibling worker."""
+    if os.getenv('GUNICORN_PRELOAD') is None:
+        return {"workers": [process_memory()], "arbiter": None}
+    arbiter = os.getppid()
+    workers = [usage for usage in (process_memory(pid) for pid in _children(arbiter)) if usage]
+    return {"workers": workers, "arbiter": process_memory(arbiter)}
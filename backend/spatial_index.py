@@ -0,0 +1,128 @@
+# spatial_index.py - Nearest-district lookup over bundled district centroids
+
+import csv
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+from sklearn.neighbors import KDTree
+
+from config import DISTRICT_CENTROIDS_PATH, GPS_MAX_DISTANCE_KM
+
+logger = logging.getLogger(__name__)
+
+_KM_PER_DEGREE = 111.2
+# Longitudes are scaled as at central India so plain Euclidean distance is close to ground distance.
+_LON_SCALE = math.cos(math.radians(23.0))
+_CELL_DEG = 0.5
+_MAX_RING = 4
+
+
+class DistrictIndex:
+    """
+    Uniform grid over district centroids for single-point lookups, with a KD-tree
+    for batch queries and for points too far from any populated cell.
+    """
+
+    def __init__(self, rows):
+        self.locations = []
+        lats, xs = [], []
+        for district, state, latitude, longitude in rows:
+            self.locations.append((district, state))
+            lats.append(float(latitude))
+            xs.append(float(longitude) * _LON_SCALE)
+
+        self._lats, self._xs = lats, xs
+        self._grid = {}
+        for i, (lat, x) in enumerate(zip(lats, xs)):
+            self._grid.setdefault(self._cell(lat, x), []).append(i)
+        self._tree = KDTree(np.column_stack([lats, xs]))
+        self._max_distance = GPS_MAX_DISTANCE_KM / _KM_PER_DEGREE
+
+    def __len__(self):
+        return len(self.locations)
+
+    @staticmethod
+    def _cell(lat, x):
+        return (math.floor(lat / _CELL_DEG), math.floor(x / _CELL_DEG))
+
+    def nearest(self, latitude, longitude):
+        """Returns (centroid position, distance in degrees of latitude) of the closest centroid."""
+        x = longitude * _LON_SCALE
+        row, col = self._cell(latitude, x)
+        best, best_dist = None, float('inf')
+
+        for ring in range(_MAX_RING + 1):
+            for r in range(row - ring, row + ring + 1):
+                for c in range(col - ring, col + ring + 1):
+                    if max(abs(r - row), abs(c - col)) != ring:
+                        continue
+                    for i in self._grid.get((r, c), ()):
+                        dist = (self._lats[i] - latitude) ** 2 + (self._xs[i] - x) ** 2
+                        if dist < best_dist:
+                            best, best_dist = i, dist
+            # Anything in an unvisited ring is at least `ring` cells away.
+            if best is not None and math.sqrt(best_dist) <= ring * _CELL_DEG:
+                return best, math.sqrt(best_dist)
+
+        dist, idx = self._tree.query([[latitude, x]], k=1)
+        return int(idx[0][0]), float(dist[0][0])
+
+    def locate(self, latitude, longitude):
+        """Returns (district, state), or (None, None) if no centroid is within GPS_MAX_DISTANCE_KM."""
+        i, dist = self.nearest(latitude, longitude)
+        return self.locations[i] if dist <= self._max_distance else (None, None)
+
+    def locate_many(self, points):
+        """Vectorized locate() for an iterable of (latitude, longitude) pairs."""
+        coords = np.asarray(list(points), dtype=float).reshape(-1, 2)
+        if not len(coords):
+            return []
+        coords[:, 1] *= _LON_SCALE
+        dists, idxs = self._tree.query(coords, k=1)
+        return [
+            self.locations[i] if d <= self._max_distance else (None, None)
+            for d, i in zip(dists[:, 0], idxs[:, 0])
+        ]
+
+
+_INDEX = None
+_INDEX_LOADED = False
+_INDEX_LOCK = threading.Lock()
+
+
+def load_index(path=DISTRICT_CENTROIDS_PATH):
+    """Builds the index from a district,state,latitude,longitude CSV. Returns None if it cannot be read."""
+    if not path or not os.path.exists(path):
+        logger.error(f"SPATIAL INDEX: District centroid file '{path}' not found.")
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            rows = [
+                (row['district'].strip(), row['state'].strip().upper(), row['latitude'], row['longitude'])
+                for row in csv.DictReader(f)
+            ]
+        index = DistrictIndex(rows)
+    except Exception as e:
+        logger.error(f"SPATIAL INDEX: Failed to load '{path}': {e}")
+        return None
+    logger.info(f"SPATIAL INDEX: Indexed {len(index)} district centroids.")
+    return index
+
+
+def get_index():
+    global _INDEX, _INDEX_LOADED
+    if not _INDEX_LOADED:
+        with _INDEX_LOCK:
+            if not _INDEX_LOADED:
+                _INDEX = load_index()
+                _INDEX_LOADED = True
+    return _INDEX
+
+
+def district_locations():
+    """(state, district) pairs for every bundled centroid, for seeding the gazetteer."""
+    index = get_index()
+    return [(state, district) for district, state in index.locations] if index else []
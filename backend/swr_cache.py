@@ -0,0 +1,154 @@
+# swr_cache.py - Stale-while-revalidate caching with single-flight background refreshes
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from config import SWR_REFRESH_WORKERS, SWR_RETRY_SECONDS, SWR_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+_REFRESH_EXECUTOR = ThreadPoolExecutor(max_workers=SWR_REFRESH_WORKERS, thread_name_prefix='swr_refresh')
+_PENDING = set()       # keys with a refresh queued or running
+_FAILED_AT = {}        # key -> monotonic time of the last failed refresh
+_PENDING_LOCK = threading.Lock()
+_CACHES = []
+
+
+def refresh_in_background(key, refresh_fn):
+    """
+    Queues refresh_fn() unless a refresh for `key` is already queued or running, or the last
+    one failed less than SWR_RETRY_SECONDS ago. Returns True if a refresh was queued.
+    refresh_fn should return a falsy value or raise when the refresh failed.
+    """
+    now = time.monotonic()
+    with _PENDING_LOCK:
+        if key in _PENDING or now - _FAILED_AT.get(key, float('-inf')) < SWR_RETRY_SECONDS:
+            return False
+        _PENDING.add(key)
+
+    def run():
+        succeeded = False
+        try:
+            succeeded = bool(refresh_fn())
+        except Exception as e:
+            logger.error(f"SWR CACHE: Background refresh of {key!r} failed: {e}")
+        finally:
+            with _PENDING_LOCK:
+                _PENDING.discard(key)
+                if succeeded:
+                    _FAILED_AT.pop(key, None)
+                else:
+                    _FAILED_AT[key] = time.monotonic()
+
+    try:
+        _REFRESH_EXECUTOR.submit(run)
+    except RuntimeError:  # interpreter shutdown
+        with _PENDING_LOCK:
+            _PENDING.discard(key)
+        return False
+    return True
+
+
+class SWRCache:
+    """
+    An in-process LRU whose entries are fresh for `ttl` seconds and then servable as stale
+    for a further `grace` seconds. A stale read returns at once and queues one background
+    reload; only a miss or an entry past its grace period makes the caller wait for the loader.
+    """
+
+    def __init__(self, name, ttl, grace, max_entries=SWR_MAX_ENTRIES):
+        self.name = name
+        self.ttl = ttl
+        self.grace = grace
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (stored at, value)
+        self._lock = threading.Lock()
+        self._stats = {"fresh_hits": 0, "stale_hits": 0, "misses": 0, "expired": 0}
+        _CACHES.append(self)
+
+    def _put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, key, loader):
+        value = loader()
+        if value is not None:
+            self._put(key, value)
+        return value
+
+    def _lookup(self, key, loader):
+        """
+        (value, is_stale) when the entry can be served without waiting, queueing a background
+        reload through `loader` if it is stale. Otherwise (the expired entry or None, None).
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            age = now - entry[0]
+            if age < self.ttl:
+                self._count("fresh_hits", 'hit')
+                return entry[1], False
+            if age < self.ttl + self.grace:
+                self._count("stale_hits", 'stale')
+                refresh_in_background((self.name, key), lambda: self._load(key, loader) is not None)
+                return entry[1], True
+            self._count("expired", 'miss')
+        else:
+            self._count("misses", 'miss')
+        return entry, None
+
+    @staticmethod
+    def _loaded(value, expired):
+        if value is None and expired is not None:
+            # Past its grace period but better than nothing while the upstream is down.
+            return expired[1], True
+        return value, False
+
+    def get(self, key, loader):
+        """
+        Returns (value, is_stale). The loader returns None on failure; failures are not cached,
+        so a stale entry keeps being served until a reload succeeds or its grace runs out.
+        """
+        value, is_stale = self._lookup(key, loader)
+        if is_stale is not None:
+            return value, is_stale
+        return self._loaded(self._load(key, loader), value)
+
+    async def get_async(self, key, loader, async_loader):
+        """
+        get() for the async views: a miss awaits async_loader() instead of blocking the event loop.
+        Stale entries still reload through the blocking `loader` on the background refresh pool.
+        """
+        value, is_stale = self._lookup(key, loader)
+        if is_stale is not None:
+            return value, is_stale
+        loaded = await async_loader()
+        if loaded is not None:
+            self._put(key, loaded)
+        return self._loaded(loaded, value)
+
+    def _count(self, stat, result):
+        self._stats[stat] += 1
+        metrics.CACHE_REQUESTS.inc(self.name, result)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        return {"entries": size, "ttl_seconds": self.ttl, "grace_seconds": self.grace, **self._stats}
+
+
+def stats():
+    """Per-cache hit counts plus the refreshes currently queued or running."""
+    with _PENDING_LOCK:
+        pending = len(_PENDING)
+    return {"caches": {cache.name: cache.stats() for cache in _CACHES}, "pending_refreshes": pending}
@@ -0,0 +1,38 @@
+import csv
+import json
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BACKEND_DIR, 'data')
+
+# Backend modules are imported flat, as the app does when run from backend/.
+sys.path.insert(0, BACKEND_DIR)
+
+import gazetteer  # noqa: E402
+
+
+def _read_json(name):
+    with open(os.path.join(DATA_DIR, name), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _read_csv(name):
+    with open(os.path.join(DATA_DIR, name), 'r', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.fixture(scope='session')
+def repo_gazetteer():
+    """The gazetteer as services builds it from the bundled datasets."""
+    mandi_rows = _read_csv('mandi_prices.csv')
+    locations = list(dict.fromkeys((row['State'], row['District']) for row in mandi_rows))
+    locations += [(row['state'], row['district']) for row in _read_csv('district_centroids.csv')]
+    gazetteer.build(
+        state_districts=_read_json('state_districts.json'),
+        district_to_state={k.lower(): v for k, v in _read_json('district_to_state.json').items()},
+        locations=locations,
+        commodities=list(dict.fromkeys(row['Commodity'] for row in mandi_rows)),
+    )
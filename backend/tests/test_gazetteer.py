@@ -0,0 +1,49 @@
+import pytest
+
+import gazetteer
+
+pytestmark = pytest.mark.usefixtures('repo_gazetteer')
+
+
+@pytest.mark.parametrize('fuzzy', [True, False])
+def test_skeleton_collision_is_not_a_match(fuzzy):
+    # 'calcuta' and 'calicut' share the skeleton 'clct' but not their vowel positions.
+    match = gazetteer.resolve_district('Calcutta', fuzzy=fuzzy)
+    assert match is None or match.state != 'KERALA'
+
+
+@pytest.mark.parametrize('text, district_id', [('Ahmadabad', 'ahmedabad'), ('Ahmadnagar', 'ahmednagar'), ('Bengaluru', 'bangalore')])
+def test_vowel_variants_still_resolve_strictly(text, district_id):
+    assert gazetteer.resolve_district(text, fuzzy=False).id == district_id
+
+
+@pytest.mark.parametrize('text', ['dhaniya', 'dhania', 'Coriander', 'धनिया'])
+def test_coriander_names(text):
+    assert gazetteer.commodity_key(text) == 'coriander'
+
+
+def test_strict_lookups_never_guess_from_trigrams():
+    assert gazetteer.resolve_district('Vadodra').id == 'vadodara'
+    assert gazetteer.resolve_district('Vadodra', fuzzy=False) is None
+    assert gazetteer.resolve_commodity('potatos').id == 'potato'
+    assert gazetteer.resolve_commodity('potatos', fuzzy=False) is None
+
+
+@pytest.mark.parametrize('text', ['wheet', 'rise', 'chilli'])
+def test_weak_commodity_guesses_are_rejected(text):
+    assert gazetteer.resolve_commodity(text) is None
+
+
+def test_trigram_guess_needs_a_margin_over_the_runner_up():
+    index = gazetteer._NameIndex()
+    index.add('tomato', 'tomato', ['tomatoes'])
+    index.add('potato', 'potato', ['potatoes'])
+    assert index.lookup('potatoe', min_score=0.6) == ('potato', 0.824)
+    # 'tatoes' is as close to one as to the other.
+    assert index.lookup('tatoes', min_score=0.6, margin=0.0) == ('potato', 0.625)
+    assert index.lookup('tatoes', min_score=0.6) == (None, 0.0)
+
+
+@pytest.mark.parametrize('text, district_id', [('पुणे', 'pune'), ('नासिक', 'nashik'), ('मुंबई', 'mumbai')])
+def test_devanagari_district_names(text, district_id):
+    assert gazetteer.resolve_district(text, fuzzy=False).id == district_id
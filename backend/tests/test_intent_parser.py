@@ -0,0 +1,25 @@
+import pytest
+
+import intent_parser
+
+pytestmark = pytest.mark.usefixtures('repo_gazetteer')
+
+
+@pytest.mark.parametrize('message, name, slots', [
+    ("What is the price of onion in Pune?", 'mandi_price', {"crop": 'onion', "district": 'Pune', "state": 'MAHARASHTRA'}),
+    ("revenue for 2.5 acres of wheat in Nashik", 'revenue_estimate', {"crop": 'wheat', "district": 'Nashik', "state": 'MAHARASHTRA', "area": 2.5}),
+    ("पुणे में प्याज का भाव क्या है", 'mandi_price', {"crop": 'onion', "district": 'Pune', "state": 'MAHARASHTRA'}),
+])
+def test_formulaic_questions(message, name, slots):
+    intent = intent_parser.parse(message)
+    assert (intent.name, intent.slots) == (name, slots)
+
+
+@pytest.mark.parametrize('message', [
+    "Is the price of onion in Pune going up?",
+    "price of wheat in pune last year",
+    "price of wheat in Calcutta",
+    "price of onion in pune and nashik",
+])
+def test_other_questions_go_to_the_model(message):
+    assert intent_parser.parse(message) is None
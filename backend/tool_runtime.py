@@ -0,0 +1,181 @@
+# tool_runtime.py - Precompiled chatbot tool dispatch with result caching and timing
+
+import inspect
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import gazetteer
+from config import TOOL_RESULT_CACHE_TTL_SECONDS, TOOL_RESULT_CACHE_MAX_ENTRIES
+from tool_registry import TOOL_FUNCTIONS
+from tools import get_tools_schema
+
+logger = logging.getLogger(__name__)
+
+# Tools whose result depends only on their arguments, so it can be shared across users and turns.
+CACHEABLE_TOOLS = {'get_mandi_price', 'get_revenue_estimate'}
+
+_JSON_TYPES = {'string': str, 'number': float, 'integer': int, 'boolean': bool}
+
+
+def _coerce(value, json_type):
+    """Converts a model-supplied argument to its schema type, or raises ValueError."""
+    target = _JSON_TYPES.get(json_type)
+    if target is None or value is None:
+        return value
+    if target is str:
+        return str(value).strip()
+    if target is bool:
+        return value if isinstance(value, bool) else str(value).lower() in ('true', '1', 'yes')
+    if target is int:
+        number = float(value)
+        if not number.is_integer():
+            raise ValueError(f"expected a whole number, got {value!r}")
+        return int(number)
+    return float(value)
+
+
+def _normalize_arg(name, value, args):
+    """Cache-key form of an argument: place and crop names collapse onto their gazetteer IDs."""
+    if name == 'district':
+        return gazetteer.district_key(value, args.get('state'))
+    if name == 'state':
+        return gazetteer.state_key(value)
+    if name == 'crop':
+        return gazetteer.commodity_key(value)
+    if isinstance(value, float):
+        return round(value, 3)
+    return value
+
+
+class _Tool:
+    __slots__ = ('name', 'func', 'params', 'required', 'types', 'accepts_user_id', 'cacheable')
+
+    def __init__(self, name, func, schema):
+        parameters = (schema or {}).get('parameters', {})
+        signature = inspect.signature(func)
+        self.name = name
+        self.func = func
+        self.params = set(signature.parameters) - {'user_id'}
+        self.required = set(parameters.get('required', []))
+        self.types = {param: spec.get('type') for param, spec in parameters.get('properties', {}).items()}
+        self.accepts_user_id = 'user_id' in signature.parameters
+        self.cacheable = name in CACHEABLE_TOOLS and not self.accepts_user_id
+
+    def validate(self, args):
+        """Returns (clean args, error message). Unknown arguments are dropped."""
+        clean = {}
+        for param, value in (args or {}).items():
+            if param not in self.params:
+                continue
+            try:
+                clean[param] = _coerce(value, self.types.get(param))
+            except (TypeError, ValueError) as e:
+                return None, f"Invalid value for '{param}': {e}"
+        missing = [param for param in self.required if clean.get(param) in (None, '')]
+        if missing:
+            return None, f"Missing required argument(s): {', '.join(sorted(missing))}"
+        return clean, None
+
+
+class ToolRuntime:
+    """
+    Dispatch table built once from tool_registry.TOOL_FUNCTIONS and tools.get_tools_schema.
+    `labelers` maps a tool name to labeler(result, args), which adds caller-specific display names
+    after the cache lookup, so a cached result never carries another caller's spelling.
+    """
+
+    def __init__(self, functions, labelers=None):
+        schemas = {entry['name']: entry for entry in get_tools_schema(for_gemini=True)}
+        self.tools = {}
+        for name in TOOL_FUNCTIONS:
+            if name not in functions:
+                logger.warning(f"TOOL RUNTIME: '{name}' is registered but not implemented.")
+                continue
+            self.tools[name] = _Tool(name, functions[name], schemas.get(name))
+
+        self._labelers = labelers or {}
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._stats = {name: {"calls": 0, "errors": 0, "cache_hits": 0, "total_ms": 0.0, "max_ms": 0.0} for name in self.tools}
+        self._stats_lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self.tools
+
+    def _cache_get(self, key):
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return entry[1]
+
+    def _cache_put(self, key, result):
+        with self._cache_lock:
+            self._cache[key] = (time.monotonic() + TOOL_RESULT_CACHE_TTL_SECONDS, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > TOOL_RESULT_CACHE_MAX_ENTRIES:
+                self._cache.popitem(last=False)
+
+    def _record(self, name, elapsed, error=False, cache_hit=False):
+        with self._stats_lock:
+            stats = self._stats[name]
+            stats["calls"] += 1
+            stats["errors"] += int(error)
+            stats["cache_hits"] += int(cache_hit)
+            stats["total_ms"] += elapsed * 1000
+            stats["max_ms"] = max(stats["max_ms"], elapsed * 1000)
+
+    def call(self, name, args, user_id=None):
+        """Validates and runs one tool call. Always returns a result; failures come back as {'error': ...}."""
+        tool = self.tools.get(name)
+        if tool is None:
+            return {"error": f"The tool '{name}' does not exist."}
+
+        started = time.perf_counter()
+        clean_args, error = tool.validate(args)
+        if error:
+            self._record(name, time.perf_counter() - started, error=True)
+            return {"error": error}
+
+        cache_key = None
+        if tool.cacheable and TOOL_RESULT_CACHE_TTL_SECONDS > 0:
+            cache_key = (name, tuple(sorted((param, _normalize_arg(param, value, clean_args)) for param, value in clean_args.items())))
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                self._record(name, time.perf_counter() - started, cache_hit=True)
+                return self._label(name, dict(cached), clean_args)
+
+        if tool.accepts_user_id:
+            clean_args['user_id'] = user_id
+        try:
+            result = tool.func(**clean_args)
+        except Exception as e:
+            self._record(name, time.perf_counter() - started, error=True)
+            logger.error(f"TOOL RUNTIME: '{name}' failed: {e}", exc_info=True)
+            return {"error": f"The '{name}' lookup failed."}
+
+        failed = isinstance(result, dict) and "error" in result
+        if cache_key is not None and isinstance(result, dict) and not failed:
+            self._cache_put(cache_key, dict(result))
+        self._record(name, time.perf_counter() - started, error=failed)
+        return self._label(name, result, clean_args)
+
+    def _label(self, name, result, args):
+        labeler = self._labelers.get(name)
+        if labeler is None or not isinstance(result, dict) or "error" in result:
+            return result
+        return labeler(result, args)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                name: {**stats, "avg_ms": round(stats["total_ms"] / stats["calls"], 1) if stats["calls"] else None,
+                       "total_ms": round(stats["total_ms"], 1), "max_ms": round(stats["max_ms"], 1)}
+                for name, stats in self._stats.items()
+            }
@@ -502,7 +502,6 @@ document.addEventListener('DOMContentLoaded', () => {
     const ctaBubble = document.getElementById('drishti-cta-bubble');
     const ctaCloseBtn = document.getElementById('drishti-cta-close');
 
-    let drishtiChatHistory = [];
     let isChatInitialized = false;
 
     const hideCtaBubble = () => { if (ctaBubble) ctaBubble.classList.remove('active'); };
@@ -590,7 +589,6 @@ document.addEventListener('DOMContentLoaded', () => {
         try {
             const data = await API.chatWithDrishti(payload);
             addDrishtiResponse(data.reply);
-            drishtiChatHistory = data.history || [];
         } catch (error) {
             addDrishtiResponse({ type: 'text', content: `Sorry, an error occurred: ${error.message}` });
         } finally {
@@ -624,7 +622,7 @@ document.addEventListener('DOMContentLoaded', () => {
             if (!userMessage) return;
             addMessageToChat(userMessage, true);
             chatInput.value = '';
-            sendToDrishti({ message: userMessage, history: drishtiChatHistory });
+            sendToDrishti({ message: userMessage });
         });
     }
 
@@ -635,7 +633,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 const payload = JSON.parse(button.dataset.payload);
                 addMessageToChat(button.textContent, true);
                 if (button.parentElement) button.parentElement.remove();
-                sendToDrishti({ message: payload.message, history: drishtiChatHistory });
+                sendToDrishti({ message: payload.message });
             }
         });
     }